@@ -1,7 +1,7 @@
 import json
 import os
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode # Importar utilidades de URL
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
@@ -151,6 +151,15 @@ class ChatMessageModel(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, nullable=False)
 
+class ConversationSummaryModel(Base):
+    __tablename__ = "conversation_summaries"
+    
+    routine_id = Column(Integer, ForeignKey("routines.id", ondelete="CASCADE"), primary_key=True)
+    summary = Column(Text, nullable=False)
+    # ID del último mensaje de chat incluido en el resumen
+    summarized_until = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
 async def table_exists(table_name):
     """Verifica si una tabla existe en la base de datos"""
     try:
@@ -168,8 +177,9 @@ async def init_db():
         print("🔍 Verificando si las tablas ya existen...")
         routines_exists = await table_exists("routines")
         chat_messages_exists = await table_exists("chat_messages")
+        summaries_exists = await table_exists("conversation_summaries")
         
-        if routines_exists and chat_messages_exists:
+        if routines_exists and chat_messages_exists and summaries_exists:
             print("✅ Las tablas ya existen, omitiendo creación")
             return
         
@@ -205,6 +215,17 @@ async def init_db():
                         )
                         """)
                     
+                    # Crear la tabla conversation_summaries si no existe
+                    if not summaries_exists:
+                        await conn.execute("""
+                        CREATE TABLE IF NOT EXISTS conversation_summaries (
+                            routine_id INTEGER PRIMARY KEY REFERENCES routines(id) ON DELETE CASCADE,
+                            summary TEXT NOT NULL,
+                            summarized_until INTEGER NOT NULL,
+                            updated_at TIMESTAMP NOT NULL
+                        )
+                        """)
+                    
                     await conn.commit()
                 print("✅ Tablas creadas correctamente con SQL directo")
                 return
@@ -322,6 +343,42 @@ async def save_routine(routine: Routine, user_id: int = None, routine_id: int =
             # Error general si no se identifica específicamente
             raise Exception(f"Error al guardar rutina: {str(e)}")
 
+async def save_routines_bulk(entries: List[Tuple[Routine, int, List[Tuple[str, str]]]]) -> List[int]:
+    """
+    Guarda varias rutinas nuevas (con sus mensajes de chat iniciales) en una
+    sola transacción. Cada entrada es (rutina, user_id, [(sender, content)]).
+    Devuelve los IDs en el mismo orden.
+    """
+    now = datetime.now()
+
+    async with async_session() as session:
+        try:
+            routine_models = [
+                RoutineModel(
+                    user_id=user_id or routine.user_id,
+                    routine_name=routine.routine_name,
+                    routine_data=routine.model_dump_json(),
+                    created_at=now,
+                    updated_at=now
+                )
+                for routine, user_id, _ in entries
+            ]
+            session.add_all(routine_models)
+            # flush asigna los IDs sin confirmar todavía la transacción
+            await session.flush()
+
+            session.add_all([
+                ChatMessageModel(routine_id=routine_model.id, sender=sender, content=content, timestamp=now)
+                for routine_model, (_, _, messages) in zip(routine_models, entries)
+                for sender, content in messages
+            ])
+            await session.commit()
+            return [routine_model.id for routine_model in routine_models]
+        except Exception as e:
+            await session.rollback()
+            print(f"Error al guardar el lote de rutinas en la base de datos: {str(e)}")
+            raise Exception(f"Error al guardar el lote de rutinas: {str(e)}")
+
 async def get_routine(routine_id: int) -> Optional[Routine]:
     """Obtiene una rutina por su ID"""
     async with async_session() as session:
@@ -358,6 +415,41 @@ async def get_chat_history(routine_id: int) -> List[Dict[str, Any]]:
         
         return [{"sender": msg.sender, "content": msg.content} for msg in messages]
 
+async def get_conversation_state(routine_id: int) -> Dict[str, Any]:
+    """
+    Obtiene el resumen guardado de la conversación de una rutina y los mensajes
+    posteriores al último mensaje resumido, en orden
+    """
+    async with async_session() as session:
+        summary_model = await session.get(ConversationSummaryModel, routine_id)
+        summarized_until = summary_model.summarized_until if summary_model else 0
+        
+        stmt = (
+            select(ChatMessageModel)
+            .where(ChatMessageModel.routine_id == routine_id, ChatMessageModel.id > summarized_until)
+            .order_by(ChatMessageModel.id)
+        )
+        result = await session.execute(stmt)
+        messages = result.scalars().all()
+        
+        return {
+            "summary": summary_model.summary if summary_model else "",
+            "summarized_until": summarized_until,
+            "messages": [{"id": msg.id, "sender": msg.sender, "content": msg.content} for msg in messages]
+        }
+
+async def save_conversation_summary(routine_id: int, summary: str, summarized_until: int):
+    """Guarda (o actualiza) el resumen de la conversación de una rutina"""
+    async with async_session() as session:
+        summary_model = await session.get(ConversationSummaryModel, routine_id)
+        if summary_model is None:
+            summary_model = ConversationSummaryModel(routine_id=routine_id)
+            session.add(summary_model)
+        summary_model.summary = summary
+        summary_model.summarized_until = summarized_until
+        summary_model.updated_at = datetime.now()
+        await session.commit()
+
 async def get_user_routines(user_id: int) -> List[Dict[str, Any]]:
     """Obtiene todas las rutinas de un usuario específico"""
     async with async_session() as session:
@@ -368,10 +460,13 @@ async def get_user_routines(user_id: int) -> List[Dict[str, Any]]:
         return [{"id": r.id, "routine_name": r.routine_name, "updated_at": r.updated_at} for r in routines]
 
 async def delete_routine_from_db(routine_id: int) -> bool:
-    """Elimina una rutina y sus mensajes asociados de la base de datos"""
+    """Elimina una rutina, sus mensajes y el resumen de su conversación de la base de datos"""
     try:
         async with async_session() as session:
-            # Eliminar rutina (los mensajes asociados se eliminarán por CASCADE)
+            # SQLite no aplica el CASCADE (las claves foráneas están desactivadas), así que
+            # los datos asociados se eliminan en la misma transacción que la rutina
+            await session.execute(delete(ConversationSummaryModel).where(ConversationSummaryModel.routine_id == routine_id))
+            await session.execute(delete(ChatMessageModel).where(ChatMessageModel.routine_id == routine_id))
             stmt = delete(RoutineModel).where(RoutineModel.id == routine_id)
             await session.execute(stmt)
             await session.commit()
@@ -1,8 +1,9 @@
 import os
+import json
 import asyncio
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, Form, status
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -22,10 +23,25 @@ except RuntimeError:
 # Importar servicios y módulos
 from app.services.gemini_service import GeminiRoutineGenerator, GEMINI_CONFIGURED
 from app.services.image_analysis_service import GeminiImageAnalyzer
-from app.db.database import init_db, save_routine, get_routine, save_chat_message, get_chat_history, get_user_routines, delete_routine_from_db
+from app.services.llm_executor import llm_executor
+from app.services.llm_backend import GEMINI_WARMUP, get_default_backend
+from app.services.response_cache import response_cache
+from app.services.single_flight import single_flight
+from app.services.resilience import LLMUnavailableError, gemini_resilience
+from app.services.rate_limiter import rate_limiter
+from app.services.llm_metrics import llm_metrics
+from app.services.model_router import model_router
+from app.services.api_key_pool import api_key_pool
+from app.services.routine_commands import local_commands
+from app.services.routine_pool import routine_pool
+from app.services.similarity_cache import similarity_cache
+from app.services.conversation_context import load_conversation_context
+from app.services.batch_service import generate_routines_batch, BATCH_MAX_CONCURRENCY, BATCH_MAX_SIZE
+from app.db.database import init_db, save_routine, save_routines_bulk, get_routine, save_chat_message, get_chat_history, get_user_routines, delete_routine_from_db
 from app.websocket.manager import ConnectionManager
 from app.websocket.routes import WebSocketRoutes
 from app.models.models import RoutineRequest
+from app.services.routine_service import routine_events
 
 # Crear la app FastAPI
 app = FastAPI(title="GymAI - Gestor Inteligente de Rutinas")
@@ -53,6 +69,8 @@ if os.environ.get("VERCEL_ENV") is None:
 
 # Inicializar el generador de rutinas con Gemini
 routine_generator = GeminiRoutineGenerator()
+# Generador de la reserva de rutinas (sin generación local: solo se guardan rutinas del modelo)
+pool_generator = GeminiRoutineGenerator(offline_fallback=False)
 # Inicializar el analizador de imágenes
 image_analyzer = GeminiImageAnalyzer()
 
@@ -65,7 +83,7 @@ ws_routes = WebSocketRoutes(manager, routine_generator, image_analyzer)
 # Configurar eventos de inicio
 @app.on_event("startup")
 async def startup_event():
-    """Inicializar la base de datos"""
+    """Inicializar la base de datos y, si está activado, preparar la conexión con el modelo"""
     # Solo inicializar si no estamos en Vercel (donde lo hace vercel_app.py)
     if not os.environ.get("VERCEL_ENV"):
         print("⏳ Inicializando base de datos (evento startup)...")
@@ -77,6 +95,13 @@ async def startup_event():
             print("⚠️ La aplicación seguirá ejecutándose, pero podrían ocurrir errores")
             import traceback
             print(traceback.format_exc())
+    
+    # Abrir la conexión con el modelo sin retrasar el arranque del worker
+    if GEMINI_WARMUP:
+        asyncio.ensure_future(llm_executor.run(get_default_backend().warm_up))
+    
+    # Rellenar la reserva de rutinas pregeneradas en las horas valle
+    routine_pool.start(pool_generator)
 
 # Rutas de la aplicación
 @app.get("/", response_class=HTMLResponse)
@@ -93,12 +118,50 @@ async def list_routines(request: Request, user_id: int = 1):
         {"request": request, "routines": routines}
     )
 
+def build_routine_request(data: dict) -> RoutineRequest:
+    """Construye la solicitud de rutina a partir del cuerpo JSON recibido"""
+    return RoutineRequest(
+        goals=data.get("goals", ""),
+        equipment=data.get("equipment", ""),
+        days=data.get("days", 3),
+        experience_level=data.get("experience_level", ""),
+        available_equipment=data.get("available_equipment", ""),
+        time_per_session=data.get("time_per_session", ""),
+        health_conditions=data.get("health_conditions", ""),
+        user_id=data.get("user_id", 1)
+    )
+
+def creation_chat_messages(routine_request: RoutineRequest) -> list:
+    """Mensajes iniciales del chat de una rutina recién creada: [(sender, content)]"""
+    return [
+        ("user", f"Quiero una rutina para {routine_request.goals} con una intensidad de {routine_request.days} días a la semana."),
+        ("assistant", "¡He creado una rutina personalizada para ti! Puedes verla en el panel principal.")
+    ]
+
+async def save_creation_chat(routine_id: int, routine_request: RoutineRequest):
+    """Guarda los mensajes iniciales del chat de una rutina recién creada"""
+    try:
+        for sender, content in creation_chat_messages(routine_request):
+            await save_chat_message(routine_id, sender, content)
+    except Exception as chat_error:
+        print(f"Error al guardar mensajes de chat: {str(chat_error)}")
+        # No fallar por esto, es menos crítico
+
+def llm_unavailable_response(error: LLMUnavailableError) -> JSONResponse:
+    """Respuesta 503 cuando el modelo no está disponible (circuito abierto o reintentos agotados)"""
+    retry_after = max(1, int(error.retry_after + 0.999))
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"error": str(error), "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
 @app.post("/api/create_routine")
 async def create_routine(request: Request):
     """Endpoint para crear una rutina inicial con manejo de errores mejorado"""
     try:
-        # Verificar si Gemini está configurado
-        if not GEMINI_CONFIGURED:
+        # Verificar si Gemini está configurado (o se puede generar sin conexión)
+        if not GEMINI_CONFIGURED and not routine_generator.offline_fallback:
             return JSONResponse(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 content={"error": "El servicio de IA no está disponible. La API de Gemini no está configurada."}
@@ -106,20 +169,13 @@ async def create_routine(request: Request):
             
         data = await request.json()
         print(f"Datos recibidos para crear rutina: {data}")
-        routine_request = RoutineRequest(
-            goals=data.get("goals", ""),
-            equipment=data.get("equipment", ""),
-            days=data.get("days", 3),
-            experience_level=data.get("experience_level", ""),
-            available_equipment=data.get("available_equipment", ""),
-            time_per_session=data.get("time_per_session", ""),
-            health_conditions=data.get("health_conditions", ""),
-            user_id=data.get("user_id", 1)
-        )
+        routine_request = build_routine_request(data)
         
         try:
-            # Generar rutina con Gemini
-            routine = await routine_generator.create_initial_routine(routine_request)
+            # Servir una rutina pregenerada si hay una para la combinación o generarla con Gemini
+            routine = await routine_pool.take(routine_request)
+            if routine is None:
+                routine = await routine_generator.create_initial_routine(routine_request)
             print(f"Rutina generada con éxito: {routine.routine_name}")
             
             # Intentar guardar en la base de datos
@@ -134,15 +190,14 @@ async def create_routine(request: Request):
                 )
             
             # Intentar guardar mensajes de chat
-            try:
-                await save_chat_message(routine_id, "user", f"Quiero una rutina para {routine_request.goals} con una intensidad de {routine_request.days} días a la semana.")
-                await save_chat_message(routine_id, "assistant", "¡He creado una rutina personalizada para ti! Puedes verla en el panel principal.")
-            except Exception as chat_error:
-                print(f"Error al guardar mensajes de chat: {str(chat_error)}")
-                # No fallar por esto, es menos crítico
+            await save_creation_chat(routine_id, routine_request)
                 
             return {"routine_id": routine_id, "routine": routine.model_dump()}
             
+        except LLMUnavailableError as unavailable_error:
+            print(f"Servicio de IA no disponible: {str(unavailable_error)}")
+            return llm_unavailable_response(unavailable_error)
+            
         except ValueError as value_error:
             print(f"Error al crear rutina: {str(value_error)}")
             return JSONResponse(
@@ -171,6 +226,89 @@ async def create_routine(request: Request):
             content={"error": str(e), "details": "Hubo un problema al crear la rutina"}
         )
 
+@app.post("/api/create_routine/stream")
+async def create_routine_stream(request: Request):
+    """
+    Crea una rutina enviando al cliente cada día en cuanto se genera.
+    La respuesta es NDJSON: un evento JSON por línea y, al final, un evento
+    "routine_created" con el ID de la rutina guardada (o un evento "error").
+    """
+    if not GEMINI_CONFIGURED and not routine_generator.offline_fallback:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"error": "El servicio de IA no está disponible. La API de Gemini no está configurada."}
+        )
+    
+    data = await request.json()
+    routine_request = build_routine_request(data)
+    
+    async def event_stream():
+        try:
+            pooled = await routine_pool.take(routine_request)
+            if pooled is not None:
+                events = routine_events(pooled)
+            else:
+                events = routine_generator.stream_initial_routine(routine_request)
+            async for event in events:
+                if event["type"] == "routine":
+                    routine = event["routine"]
+                    routine_id = await save_routine(routine, user_id=routine_request.user_id)
+                    await save_creation_chat(routine_id, routine_request)
+                    event = {"type": "routine_created", "routine_id": routine_id, "routine": routine.model_dump()}
+                yield json.dumps(event, default=str) + "\n"
+        except Exception as e:
+            print(f"Error al crear rutina en streaming: {str(e)}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+@app.post("/api/create_routines/batch")
+async def create_routines_batch(request: Request):
+    """
+    Crea varias rutinas a la vez. El cuerpo es {"requests": [...], "concurrency": N}
+    (o directamente la lista de solicitudes). La respuesta es NDJSON: un evento
+    "routine_created" o "error" por solicitud, en el orden en que terminan, y
+    un evento final "batch_done" con el resumen.
+    """
+    if not GEMINI_CONFIGURED and not routine_generator.offline_fallback:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"error": "El servicio de IA no está disponible. La API de Gemini no está configurada."}
+        )
+    
+    data = await request.json()
+    items = data.get("requests") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return JSONResponse(status_code=400, content={"error": "Se esperaba una lista de solicitudes de rutina"})
+    if len(items) > BATCH_MAX_SIZE:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"El lote no puede tener más de {BATCH_MAX_SIZE} solicitudes"}
+        )
+    
+    concurrency = BATCH_MAX_CONCURRENCY
+    if isinstance(data, dict) and isinstance(data.get("concurrency"), int) and data["concurrency"] > 0:
+        concurrency = min(data["concurrency"], BATCH_MAX_CONCURRENCY)
+    
+    routine_requests = []
+    for item in items:
+        try:
+            routine_requests.append(build_routine_request(item))
+        except (AttributeError, ValueError):
+            routine_requests.append(None)
+    
+    async def persist(ready):
+        return await save_routines_bulk([
+            (routine, routine_request.user_id, creation_chat_messages(routine_request))
+            for _, routine_request, routine in ready
+        ])
+    
+    async def event_stream():
+        async for event in generate_routines_batch(routine_generator, routine_requests, persist, concurrency):
+            yield json.dumps(event, default=str) + "\n"
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 @app.get("/dashboard/{routine_id}", response_class=HTMLResponse)
 async def dashboard(request: Request, routine_id: int):
     """Dashboard principal con rutina y chat lateral"""
@@ -238,12 +376,14 @@ async def modify_routine_api(routine_id: int, request: Request):
                 content={"error": "Rutina no encontrada"}
             )
         
+        # Contexto de la conversación anterior (antes de guardar el mensaje nuevo)
+        history = (await load_conversation_context(routine_id)).render()
+        
         # Guardar mensaje del usuario
         await save_chat_message(routine_id, "user", message)
         
         # Procesar con el generador de rutinas
-        modified_routine = await routine_generator.modify_routine(current_routine, message)
-        explanation = await routine_generator.explain_routine_changes(current_routine, modified_routine, message)
+        modified_routine, explanation = await routine_generator.modify_and_explain(current_routine, message, history)
         
         # Actualizar la rutina en la BD
         await save_routine(modified_routine, routine_id=routine_id)
@@ -254,6 +394,9 @@ async def modify_routine_api(routine_id: int, request: Request):
             "explanation": explanation,
             "routine": modified_routine.model_dump()
         })
+    except LLMUnavailableError as e:
+        print(f"Servicio de IA no disponible: {str(e)}")
+        return llm_unavailable_response(e)
     except Exception as e:
         print(f"Error al procesar solicitud HTTP: {e}")
         import traceback
@@ -272,5 +415,35 @@ async def health_check():
     return {
         "status": "online",
         "server_time": datetime.now().isoformat(),
-        "gemini_available": GEMINI_CONFIGURED
-    }
\ No newline at end of file
+        "gemini_available": GEMINI_CONFIGURED,
+        "offline_fallback": routine_generator.offline_fallback,
+        "llm_backend": routine_generator.backend.name,
+        "gemini_concurrency": llm_executor.stats(),
+        "gemini_circuit": gemini_resilience.breaker.state
+    }
+
+# Métricas de las llamadas a la IA (pool de ejecución, caché, coalescencia, resiliencia y cola)
+@app.get("/api/llm/metrics")
+async def get_llm_metrics():
+    """Devuelve el estado del pool de llamadas al modelo, las cachés, la coalescencia, el circuito, la cola, las rutas, las claves, los comandos locales, la reserva de rutinas y las operaciones"""
+    return {
+        "executor": llm_executor.stats(),
+        "cache": response_cache.stats(),
+        "similarity_cache": similarity_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "resilience": gemini_resilience.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "routing": model_router.stats(),
+        "api_keys": api_key_pool.stats(),
+        "local_commands": local_commands.stats(),
+        "routine_pool": routine_pool.stats(),
+        "operations": llm_metrics.stats()
+    }
+
+@app.get("/api/llm/metrics/{operation}")
+async def llm_operation_metrics(operation: str):
+    """Devuelve los histogramas de tiempos y tamaños de una operación (create, modify, explain, analyze, variations)"""
+    stats = llm_metrics.stats(operation)
+    if not stats:
+        raise HTTPException(status_code=404, detail=f"No hay métricas para la operación '{operation}'")
+    return stats
@@ -37,4 +37,5 @@ class RoutineRequest(BaseModel):
     goals: str
     equipment: str = ""
     days: int
+    experience_level: str = ""
     user_id: int = 1
@@ -0,0 +1,189 @@
+"""
+Pool de claves de la API de Gemini con control de cuota por clave.
+
+Todo el tráfico del proceso salía por una sola `GEMINI_API_KEY`, así que el
+rendimiento máximo era la cuota de esa clave. Con `GEMINI_API_KEYS` (claves
+separadas por comas) cada llamada usa la clave con más margen en el último
+minuto, según sus peticiones y tokens frente a `GEMINI_KEY_RPM` y
+`GEMINI_KEY_TPM`. Una clave que devuelve un error de cuota (429) se aparta
+durante un tiempo, que se duplica si vuelve a fallar, y las llamadas pasan a
+las demás. `stats()` informa de la utilización de cada clave para saber
+cuándo añadir más.
+
+Las claves nunca aparecen completas en los registros ni en las estadísticas.
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Claves del pool separadas por comas (si está vacío se usa GEMINI_API_KEY)
+GEMINI_API_KEYS = os.getenv("GEMINI_API_KEYS", "")
+
+# Cuota de cada clave: peticiones y tokens por minuto (0 = sin límite)
+GEMINI_KEY_RPM = float(os.getenv("GEMINI_KEY_RPM", "60"))
+GEMINI_KEY_TPM = float(os.getenv("GEMINI_KEY_TPM", "1000000"))
+
+# Segundos que se aparta una clave tras un error de cuota (se duplica con cada error seguido)
+GEMINI_KEY_BENCH_SECONDS = float(os.getenv("GEMINI_KEY_BENCH_SECONDS", "60"))
+GEMINI_KEY_MAX_BENCH_SECONDS = float(os.getenv("GEMINI_KEY_MAX_BENCH_SECONDS", "600"))
+
+# Ventana de la cuota por minuto
+QUOTA_WINDOW = 60.0
+
+
+def parse_keys(config: str = GEMINI_API_KEYS, fallback: Optional[str] = None) -> List[str]:
+    """Claves configuradas, sin duplicados y en el mismo orden"""
+    keys: List[str] = []
+    for key in config.replace("\n", ",").split(","):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    if not keys:
+        fallback = fallback if fallback is not None else os.getenv("GEMINI_API_KEY")
+        if fallback:
+            keys.append(fallback)
+    return keys
+
+
+def mask_key(api_key: str) -> str:
+    """Identificador de la clave que se puede mostrar"""
+    return f"…{api_key[-4:]}" if len(api_key) > 8 else "…"
+
+
+def is_quota_error(error: BaseException) -> bool:
+    """Indica si el error es de cuota agotada (429 / RESOURCE_EXHAUSTED)"""
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error).lower()
+    return "quota" in message or "resource exhausted" in message or "resource_exhausted" in message
+
+
+class ApiKeyState:
+    """Uso reciente y acumulado de una clave"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.label = mask_key(api_key)
+        self.requests: Deque[float] = deque()
+        self.tokens: Deque[Tuple[float, int]] = deque()
+        self.window_tokens = 0
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.consecutive_quota_errors = 0
+        self.benched_until = 0.0
+
+    def trim(self, now: float):
+        """Descarta lo que ya salió de la ventana de un minuto"""
+        while self.requests and self.requests[0] <= now - QUOTA_WINDOW:
+            self.requests.popleft()
+        while self.tokens and self.tokens[0][0] <= now - QUOTA_WINDOW:
+            self.window_tokens -= self.tokens.popleft()[1]
+
+    def utilisation(self, rpm: float, tpm: float) -> float:
+        """Fracción de la cuota por minuto consumida (la mayor de peticiones y tokens)"""
+        used_requests = len(self.requests) / rpm if rpm > 0 else 0.0
+        used_tokens = self.window_tokens / tpm if tpm > 0 else 0.0
+        return max(used_requests, used_tokens)
+
+
+class ApiKeyPool:
+    """Reparte las llamadas entre las claves según su margen de cuota"""
+
+    def __init__(
+        self,
+        keys: Optional[Sequence[str]] = None,
+        rpm: float = GEMINI_KEY_RPM,
+        tpm: float = GEMINI_KEY_TPM,
+        bench_seconds: float = GEMINI_KEY_BENCH_SECONDS,
+        max_bench_seconds: float = GEMINI_KEY_MAX_BENCH_SECONDS,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.keys = list(keys) if keys is not None else parse_keys()
+        self.rpm = rpm
+        self.tpm = tpm
+        self.bench_seconds = bench_seconds
+        self.max_bench_seconds = max(bench_seconds, max_bench_seconds)
+        self._clock = clock
+        self._states = [ApiKeyState(key) for key in self.keys]
+        self._lock = threading.Lock()
+
+    def acquire(self) -> ApiKeyState:
+        """
+        Clave para la siguiente llamada: la de más margen entre las que no están
+        apartadas (a igualdad, la que tiene menos llamadas en curso). Si todas
+        están apartadas se usa la que antes vuelve.
+        """
+        if not self._states:
+            raise RuntimeError("No hay claves de la API de Gemini configuradas")
+        with self._lock:
+            now = self._clock()
+            for state in self._states:
+                state.trim(now)
+            active = [state for state in self._states if state.benched_until <= now]
+            if active:
+                state = min(active, key=lambda s: (s.utilisation(self.rpm, self.tpm), s.in_flight))
+            else:
+                state = min(self._states, key=lambda s: s.benched_until)
+            state.requests.append(now)
+            state.in_flight += 1
+            state.total_requests += 1
+            return state
+
+    def release(self, state: ApiKeyState, tokens: int = 0, error: Optional[BaseException] = None):
+        """Anota los tokens de una llamada terminada y aparta la clave si agotó su cuota"""
+        with self._lock:
+            now = self._clock()
+            state.in_flight = max(0, state.in_flight - 1)
+            if tokens > 0:
+                state.tokens.append((now, tokens))
+                state.window_tokens += tokens
+                state.total_tokens += tokens
+            if error is None:
+                state.consecutive_quota_errors = 0
+                return
+            state.errors += 1
+            if not is_quota_error(error):
+                return
+            state.quota_errors += 1
+            state.consecutive_quota_errors += 1
+            bench = min(self.bench_seconds * 2 ** (state.consecutive_quota_errors - 1), self.max_bench_seconds)
+            state.benched_until = now + bench
+        print(f"⏸️ Clave de Gemini {state.label} sin cuota, apartada {bench:.0f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """Utilización de cada clave en el último minuto y totales"""
+        with self._lock:
+            now = self._clock()
+            keys = []
+            for state in self._states:
+                state.trim(now)
+                keys.append({
+                    "key": state.label,
+                    "requests_per_minute": len(state.requests),
+                    "tokens_per_minute": state.window_tokens,
+                    "utilisation": round(state.utilisation(self.rpm, self.tpm), 3),
+                    "in_flight": state.in_flight,
+                    "total_requests": state.total_requests,
+                    "total_tokens": state.total_tokens,
+                    "errors": state.errors,
+                    "quota_errors": state.quota_errors,
+                    "benched_for": round(max(0.0, state.benched_until - now), 1)
+                })
+        return {
+            "keys": keys,
+            "available": sum(1 for key in keys if not key["benched_for"]),
+            "rpm_per_key": self.rpm,
+            "tpm_per_key": self.tpm
+        }
+
+
+# Pool compartido por todos los clientes de Gemini del proceso
+api_key_pool = ApiKeyPool()
@@ -0,0 +1,100 @@
+"""
+Generación de rutinas por lotes.
+
+Para dar de alta un gimnasio hay que crear decenas de rutinas. Las rutinas se
+generan en paralelo con un límite de concurrencia y cada resultado (o su
+error) se emite en cuanto termina. Las rutinas terminadas se guardan agrupadas:
+mientras se confirma un grupo en la base de datos se acumulan las siguientes,
+que se guardan juntas en la transacción siguiente.
+"""
+import os
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.models.models import Routine, RoutineRequest
+
+# Rutinas que se generan a la vez dentro de un lote
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+# Número máximo de solicitudes por lote
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "100"))
+
+# Guarda un grupo de (índice, solicitud, rutina) y devuelve sus IDs en el mismo orden
+PersistFunc = Callable[[List[Tuple[int, RoutineRequest, Routine]]], Awaitable[List[int]]]
+
+
+async def generate_routines_batch(
+    generator: Any,
+    requests: List[Optional[RoutineRequest]],
+    persist: PersistFunc,
+    concurrency: int = BATCH_MAX_CONCURRENCY
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Genera las rutinas del lote y emite eventos:
+    - {"type": "routine_created", "index", "routine_id", "routine"} por cada rutina guardada
+    - {"type": "error", "index", "error"} por cada solicitud que falla
+    - {"type": "batch_done", "total", "created", "failed"} al final
+
+    Las solicitudes None (no válidas) se notifican como error sin generarse.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    finished: asyncio.Queue = asyncio.Queue()
+    created = failed = 0
+
+    async def generate(index: int, routine_request: RoutineRequest):
+        async with semaphore:
+            try:
+                routine = await generator.create_initial_routine(routine_request)
+                finished.put_nowait((index, routine_request, routine, None))
+            except Exception as e:
+                finished.put_nowait((index, routine_request, None, e))
+
+    tasks = []
+    for index, routine_request in enumerate(requests):
+        if routine_request is None:
+            failed += 1
+            yield {"type": "error", "index": index, "error": "Solicitud de rutina no válida"}
+        else:
+            tasks.append(asyncio.ensure_future(generate(index, routine_request)))
+
+    try:
+        remaining = len(tasks)
+        while remaining:
+            # Esperar al primer resultado y recoger todos los que ya estén listos
+            results = [await finished.get()]
+            while not finished.empty():
+                results.append(finished.get_nowait())
+            remaining -= len(results)
+
+            ready = []
+            for index, routine_request, routine, error in results:
+                if error is not None:
+                    failed += 1
+                    print(f"Error al generar la rutina {index} del lote: {str(error)}")
+                    yield {"type": "error", "index": index, "error": str(error)}
+                else:
+                    ready.append((index, routine_request, routine))
+
+            if not ready:
+                continue
+
+            try:
+                routine_ids = await persist(ready)
+            except Exception as e:
+                print(f"Error al guardar un grupo de {len(ready)} rutinas del lote: {str(e)}")
+                failed += len(ready)
+                for index, _, _ in ready:
+                    yield {"type": "error", "index": index, "error": "No se pudo guardar la rutina en la base de datos"}
+                continue
+
+            for (index, _, routine), routine_id in zip(ready, routine_ids):
+                created += 1
+                routine.id = routine_id
+                yield {"type": "routine_created", "index": index, "routine_id": routine_id,
+                       "routine": routine.model_dump()}
+
+        yield {"type": "batch_done", "total": len(requests), "created": created, "failed": failed}
+    finally:
+        # Si el cliente se desconecta no se siguen generando rutinas
+        for task in tasks:
+            if not task.done():
+                task.cancel()
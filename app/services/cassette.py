@@ -0,0 +1,276 @@
+"""
+Grabación y reproducción de las llamadas al modelo ("cassette").
+
+Para medir y probar el camino completo de las peticiones sin red, el tráfico
+real se graba una vez y después se reproduce:
+
+- `LLM_CASSETTE_RECORD=true` envuelve el backend configurado en
+  `RecordingBackend`, que guarda cada llamada (fragmentos de la respuesta,
+  tiempos hasta el primer fragmento y entre fragmentos, o el error) en
+  `LLM_CASSETTE_PATH`: JSON por líneas comprimido con gzip si la ruta acaba en
+  `.gz`.
+- `LLM_BACKEND=replay` usa `ReplayBackend`, que responde desde la cassette a
+  cada prompt (con sus imágenes) por su hash, en el mismo orden en que se
+  grabaron si un prompt aparece varias veces. Con `LLM_CASSETTE_LATENCY=true`
+  espera los tiempos grabados para reproducir la forma real de la latencia.
+
+Un prompt que no está en la cassette produce `CassetteMissError`, que no se
+reintenta: la reproducción es determinista y nunca llama a la API.
+"""
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from app.services.llm_backend import LLMBackend
+from app.services.response_cache import canonicalize_prompt
+
+load_dotenv()
+
+# Archivo de la cassette
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", os.path.join("cassettes", "gemini.jsonl.gz"))
+
+# Grabar en la cassette todas las llamadas del backend configurado
+LLM_CASSETTE_RECORD = os.getenv("LLM_CASSETTE_RECORD", "false").lower() == "true"
+
+# Reproducir las respuestas con las latencias grabadas (si no, al instante)
+LLM_CASSETTE_LATENCY = os.getenv("LLM_CASSETTE_LATENCY", "false").lower() == "true"
+
+# Caracteres del prompt que se guardan para reconocer cada grabación
+PROMPT_PREVIEW_CHARS = 120
+
+
+class CassetteMissError(Exception):
+    """El prompt no está grabado en la cassette"""
+
+
+class ReplayedError(Exception):
+    """Error grabado de la API, con el mismo mensaje y código HTTP"""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+
+class CassetteResponse:
+    """Respuesta o fragmento reproducido, con la interfaz `.text` del SDK"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+def cassette_key(contents: Any) -> str:
+    """Hash del prompt canonizado y de las imágenes que lo acompañan"""
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            digest.update(canonicalize_prompt(part).encode("utf-8"))
+        elif isinstance(part, (bytes, bytearray)):
+            digest.update(hashlib.sha256(part).digest())
+        elif hasattr(part, "tobytes"):
+            # Imagen de PIL
+            digest.update(f"{getattr(part, 'mode', '')}{getattr(part, 'size', '')}".encode("utf-8"))
+            digest.update(hashlib.sha256(part.tobytes()).digest())
+        else:
+            digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _prompt_preview(contents: Any) -> str:
+    """Principio del texto del prompt"""
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    text = " ".join(part for part in parts if isinstance(part, str))
+    return canonicalize_prompt(text)[:PROMPT_PREVIEW_CHARS]
+
+
+def _chunk_text(chunk: Any) -> str:
+    """Texto de una respuesta o fragmento (vacío si el SDK no lo expone)"""
+    try:
+        text = chunk.text
+    except (AttributeError, ValueError):
+        return ""
+    return text if isinstance(text, str) else ""
+
+
+class Cassette:
+    """Grabaciones de un archivo JSON por líneas (comprimido si acaba en .gz)"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or LLM_CASSETTE_PATH
+        self._lock = threading.Lock()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def append(self, record: Dict[str, Any]):
+        """Añade una grabación (cada escritura es un miembro gzip completo)"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._open("a") as f:
+                f.write(line)
+
+    def load(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Grabaciones por clave, en el orden en que se hicieron"""
+        records: Dict[str, List[Dict[str, Any]]] = {}
+        if not os.path.exists(self.path):
+            return records
+        with self._open("r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    records.setdefault(record["key"], []).append(record)
+        return records
+
+
+class RecordingBackend(LLMBackend):
+    """Envuelve un backend y graba en la cassette cada llamada que atiende"""
+
+    def __init__(self, inner: LLMBackend, cassette: Optional[Cassette] = None):
+        self.inner = inner
+        self.cassette = cassette or Cassette()
+
+    # Mismo nombre y modelo que el backend envuelto para no cambiar las claves de caché
+    @property
+    def name(self) -> str:
+        return self.inner.name
+
+    @property
+    def model_name(self) -> str:
+        return self.inner.model_name
+
+    @property
+    def available(self) -> bool:
+        return self.inner.available
+
+    def warm_up(self):
+        self.inner.warm_up()
+
+    @property
+    def routable(self) -> bool:
+        return self.inner.routable
+
+    def for_model(self, model_name: str) -> LLMBackend:
+        """El modelo elegido por el enrutador también se graba, en la misma cassette"""
+        return RecordingBackend(self.inner.for_model(model_name), self.cassette)
+
+    def _record(self, contents: Any, stream: bool, chunks: List[str], delays: List[float],
+                error: Optional[BaseException] = None):
+        record: Dict[str, Any] = {
+            "key": cassette_key(contents),
+            "model": self.model_name,
+            "prompt": _prompt_preview(contents),
+            "stream": stream,
+            "chunks": chunks,
+            "delays": [round(delay, 4) for delay in delays]
+        }
+        if error is not None:
+            code = getattr(error, "code", None)
+            record["error"] = {"message": str(error), "code": code if isinstance(code, int) else None}
+        try:
+            self.cassette.append(record)
+        except OSError as e:
+            print(f"⚠️ No se pudo grabar la llamada en la cassette: {str(e)}")
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs) -> Any:
+        start = time.perf_counter()
+        try:
+            response = self.inner.generate_content(contents, stream=stream, **kwargs)
+        except Exception as e:
+            self._record(contents, stream, [], [time.perf_counter() - start], e)
+            raise
+        if stream:
+            return self._record_stream(contents, response, start)
+        self._record(contents, False, [_chunk_text(response)], [time.perf_counter() - start])
+        return response
+
+    def _record_stream(self, contents: Any, chunks: Any, start: float) -> Iterator[Any]:
+        """Entrega los fragmentos y graba la llamada al terminar"""
+        texts: List[str] = []
+        delays: List[float] = []
+        last = start
+        try:
+            for chunk in chunks:
+                now = time.perf_counter()
+                delays.append(now - last)
+                texts.append(_chunk_text(chunk))
+                yield chunk
+                last = time.perf_counter()
+        except Exception as e:
+            delays.append(time.perf_counter() - last)
+            self._record(contents, True, texts, delays, e)
+            raise
+        self._record(contents, True, texts, delays)
+
+
+class ReplayBackend(LLMBackend):
+    """Responde desde la cassette, opcionalmente con las latencias grabadas"""
+
+    name = "replay"
+
+    def __init__(self, cassette: Optional[Cassette] = None, latency: bool = LLM_CASSETTE_LATENCY):
+        self.cassette = cassette or Cassette()
+        self.latency = latency
+        self.records = self.cassette.load()
+        self.model_name = next((entries[0].get("model", "") for entries in self.records.values()), "")
+        self.calls = 0
+        self.misses = 0
+        self._served: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        print(f"📼 Cassette {self.cassette.path}: {sum(len(e) for e in self.records.values())} llamadas grabadas")
+
+    @property
+    def available(self) -> bool:
+        return bool(self.records)
+
+    def _next_record(self, contents: Any) -> Dict[str, Any]:
+        """Siguiente grabación del prompt (vuelve a empezar al agotarlas)"""
+        key = cassette_key(contents)
+        with self._lock:
+            self.calls += 1
+            entries = self.records.get(key)
+            if not entries:
+                self.misses += 1
+                raise CassetteMissError(
+                    f"Prompt no grabado en la cassette: {_prompt_preview(contents)[:60]}..."
+                )
+            served = self._served.get(key, 0)
+            self._served[key] = served + 1
+        return entries[served % len(entries)]
+
+    def _sleep(self, seconds: float):
+        if self.latency and seconds > 0:
+            time.sleep(seconds)
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs) -> Any:
+        record = self._next_record(contents)
+        if stream:
+            return self._replay_stream(record)
+        self._sleep(sum(record["delays"]))
+        self._raise_error(record)
+        return CassetteResponse("".join(record["chunks"]))
+
+    def _replay_stream(self, record: Dict[str, Any]) -> Iterator[CassetteResponse]:
+        delays = record["delays"]
+        for index, text in enumerate(record["chunks"]):
+            self._sleep(delays[index] if index < len(delays) else 0)
+            yield CassetteResponse(text)
+        if "error" in record:
+            self._sleep(delays[-1] if len(delays) > len(record["chunks"]) else 0)
+            self._raise_error(record)
+
+    @staticmethod
+    def _raise_error(record: Dict[str, Any]):
+        error = record.get("error")
+        if error:
+            raise ReplayedError(error["message"], error.get("code"))
@@ -0,0 +1,148 @@
+"""
+Contexto de conversación acotado para los prompts de modificación.
+
+El historial del chat se guardaba en `chat_messages` pero no llegaba al
+modelo, que olvidaba las peticiones anteriores; añadirlo entero haría crecer
+el prompt sin límite. El prompt incluye ahora los últimos turnos literales y
+un resumen de las peticiones más antiguas. El resumen se guarda con la rutina
+y se actualiza de forma incremental: solo se leen los mensajes posteriores al
+último que se resumió. Todo el bloque respeta un presupuesto fijo de tokens.
+
+El resumen es local (una línea por petición anterior del usuario, recortada)
+para no añadir otra llamada al modelo en cada edición.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional
+from app.services.llm_backend import CHARS_PER_TOKEN
+
+# Turnos (petición del usuario y respuesta) que se incluyen literalmente
+CHAT_CONTEXT_TURNS = int(os.getenv("CHAT_CONTEXT_TURNS", "3"))
+
+# Presupuesto máximo de tokens del bloque de contexto en cada prompt
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "600"))
+
+# Tokens máximos del resumen guardado; al superarlos se descartan las peticiones más antiguas
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "200"))
+
+# Caracteres máximos de cada petición dentro del resumen
+SUMMARY_ITEM_CHARS = 140
+
+SENDER_LABELS = {"user": "Usuario", "assistant": "Entrenador"}
+
+_OMITTED_PATTERN = re.compile(r"^\(\+(\d+) peticiones anteriores\)$")
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokens aproximados de un texto"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def fold_into_summary(summary: str, messages: List[Dict[str, Any]],
+                      budget: int = CHAT_SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Añade al resumen una línea por cada petición del usuario de `messages`.
+    Si el resumen supera el presupuesto se descartan las líneas más antiguas
+    y se cuenta cuántas peticiones se han omitido.
+    """
+    omitted = 0
+    items: List[str] = []
+    for line in summary.splitlines():
+        match = _OMITTED_PATTERN.match(line)
+        if match:
+            omitted = int(match.group(1))
+        elif line.strip():
+            items.append(line)
+
+    items.extend(f"- {_shorten(message['content'], SUMMARY_ITEM_CHARS)}"
+                 for message in messages if message["sender"] == "user" and message["content"].strip())
+
+    def render() -> str:
+        header = [f"(+{omitted} peticiones anteriores)"] if omitted else []
+        return "\n".join(header + items)
+
+    while items and estimate_tokens(render()) > budget:
+        items.pop(0)
+        omitted += 1
+    return render()
+
+
+class ConversationContext:
+    """Resumen de las peticiones antiguas y últimos mensajes literales de una rutina"""
+
+    def __init__(self, summary: str = "", messages: Optional[List[Dict[str, Any]]] = None):
+        self.summary = summary
+        self.messages = messages or []
+
+    def render(self, budget: int = CHAT_CONTEXT_TOKEN_BUDGET) -> str:
+        """
+        Texto para el prompt dentro del presupuesto de tokens: primero se
+        descartan los mensajes recientes más antiguos, después las líneas
+        del resumen y, si aún no cabe, se recorta el texto.
+        """
+        messages = list(self.messages)
+        summary_lines = self.summary.splitlines()
+
+        def build() -> str:
+            parts = []
+            if summary_lines:
+                parts.append("Resumen de peticiones anteriores del usuario:\n" + "\n".join(summary_lines))
+            if messages:
+                parts.append("Últimos mensajes de la conversación:\n" + "\n".join(
+                    f"{SENDER_LABELS.get(message['sender'], message['sender'])}: {' '.join(message['content'].split())}"
+                    for message in messages
+                ))
+            return "\n\n".join(parts)
+
+        text = build()
+        while estimate_tokens(text) > budget and len(messages) > 1:
+            messages.pop(0)
+            text = build()
+        while estimate_tokens(text) > budget and summary_lines:
+            summary_lines.pop(0)
+            text = build()
+        if estimate_tokens(text) > budget:
+            text = _shorten(text, budget * CHARS_PER_TOKEN)
+        return text
+
+
+def split_recent(messages: List[Dict[str, Any]], turns: int = CHAT_CONTEXT_TURNS):
+    """Separa los mensajes en (a resumir, recientes): los recientes empiezan en la K-ésima última petición"""
+    user_positions = [index for index, message in enumerate(messages) if message["sender"] == "user"]
+    if turns <= 0:
+        return messages, []
+    if len(user_positions) <= turns:
+        return [], messages
+    start = user_positions[-turns]
+    return messages[:start], messages[start:]
+
+
+async def load_conversation_context(routine_id: int, turns: int = CHAT_CONTEXT_TURNS) -> ConversationContext:
+    """
+    Lee el resumen guardado y los mensajes posteriores, resume los que ya no
+    entran en los últimos `turns` turnos y guarda el resumen actualizado.
+    Si falla la base de datos se continúa sin contexto.
+    """
+    from app.db.database import get_conversation_state, save_conversation_summary
+
+    try:
+        state = await get_conversation_state(routine_id)
+        older, recent = split_recent(state["messages"], turns)
+        summary = state["summary"]
+    except Exception as e:
+        print(f"⚠️ No se pudo cargar el contexto de la conversación: {str(e)}")
+        return ConversationContext()
+
+    if older:
+        summary = fold_into_summary(summary, older)
+        try:
+            await save_conversation_summary(routine_id, summary, older[-1]["id"])
+        except Exception as e:
+            # Otro worker pudo guardarlo a la vez; se volverá a resumir en la siguiente petición
+            print(f"⚠️ No se pudo guardar el resumen de la conversación: {str(e)}")
+    return ConversationContext(summary, recent)
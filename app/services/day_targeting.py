@@ -0,0 +1,106 @@
+"""
+Detección de los días de la rutina a los que se refiere un mensaje del chat.
+
+Un mensaje como "cambia el día de piernas" solo afecta a un día, pero la
+modificación enviaba y regeneraba la semana completa. Aquí se decide, sin
+llamar al modelo, qué entradas de `Routine.days` menciona el mensaje: por el
+nombre del día ("el lunes", "el día 2"), por su enfoque ("piernas") o por el
+nombre de un ejercicio ("la sentadilla"). Si el mensaje habla de la rutina en
+general, cambia el número de días o no menciona ninguno, no hay días
+concretos y se modifica la rutina completa.
+"""
+import re
+import unicodedata
+from typing import List, Set
+from app.models.models import Routine
+
+# Expresiones que afectan a la rutina completa aunque mencionen un día
+WHOLE_ROUTINE_PATTERNS = (
+    r"\btoda la rutina\b", r"\brutina completa\b", r"\btodos los dias\b", r"\bcada dia\b",
+    r"\btoda la semana\b", r"\bcada sesion\b", r"\btodas las sesiones\b", r"\bnombre de la rutina\b",
+    r"\b(anade|agrega|anadir|agregar|quita|quitar|elimina|eliminar|borra|borrar)\b.{0,20}\b(un|otro|el|los)\b.{0,5}\bdias?\b",
+    r"\b(mas|menos)\s+dias\b", r"\b\d+\s+dias\b"
+)
+
+# Ordinales con los que se nombra un día por su posición
+ORDINALS = ("primer", "segundo", "tercer", "cuarto", "quinto", "sexto", "septimo")
+
+# Palabras del enfoque de un día que no sirven para identificarlo
+FOCUS_STOPWORDS = {"dia", "dias", "entrenamiento", "rutina", "sesion", "ejercicios", "trabajo", "general"}
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas, sin acentos y con los espacios simplificados"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def _stem(word: str) -> str:
+    """Raíz aproximada para que "pierna" y "piernas" coincidan"""
+    if len(word) > 4 and word.endswith("es"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _contains(text: str, phrase: str) -> bool:
+    """Indica si la frase aparece en el texto como palabras completas"""
+    return bool(phrase) and re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+def _by_day_name(routine: Routine, text: str) -> Set[int]:
+    """Días nombrados explícitamente: por su nombre o por su posición"""
+    indices = set()
+    for index, day in enumerate(routine.days):
+        if _contains(text, _normalize(day.day_name)):
+            indices.add(index)
+        if re.search(rf"\bdia {index + 1}\b", text):
+            indices.add(index)
+        if index < len(ORDINALS) and re.search(rf"\b{ORDINALS[index]}o? dia\b", text):
+            indices.add(index)
+    return indices
+
+
+def _by_focus(routine: Routine, text: str) -> Set[int]:
+    """Días cuyo enfoque comparte alguna palabra significativa con el mensaje"""
+    words = {_stem(word) for word in text.split() if len(word) > 3}
+    indices = set()
+    for index, day in enumerate(routine.days):
+        focus = {_stem(word) for word in _normalize(day.focus).split()
+                 if len(word) > 3 and word not in FOCUS_STOPWORDS}
+        if focus & words:
+            indices.add(index)
+    return indices
+
+
+def _by_exercise(routine: Routine, text: str) -> Set[int]:
+    """Días que contienen un ejercicio nombrado en el mensaje"""
+    stems = " ".join(_stem(word) for word in text.split())
+    indices = set()
+    for index, day in enumerate(routine.days):
+        for exercise in day.exercises:
+            name = " ".join(_stem(word) for word in _normalize(exercise.name).split())
+            if _contains(stems, name):
+                indices.add(index)
+                break
+    return indices
+
+
+def target_days(routine: Routine, user_request: str) -> List[int]:
+    """
+    Índices de los días a los que se refiere el mensaje, en orden.
+    Devuelve una lista vacía si hay que modificar la rutina completa.
+    """
+    text = _normalize(user_request)
+    if not routine.days or any(re.search(pattern, text) for pattern in WHOLE_ROUTINE_PATTERNS):
+        return []
+
+    # Un día nombrado explícitamente manda sobre los enfoques y ejercicios que aparezcan.
+    # En "cambia X por Y" solo X identifica el día; Y es el contenido nuevo
+    replaced = text.split(" por ")[0]
+    indices = _by_day_name(routine, text) or (_by_focus(routine, replaced) | _by_exercise(routine, replaced))
+    if len(indices) == len(routine.days):
+        return []
+    return sorted(indices)
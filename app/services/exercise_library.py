@@ -0,0 +1,218 @@
+"""
+Biblioteca local de ejercicios para el generador sin conexión.
+
+Cada ejercicio tiene un grupo muscular, una categoría de equipamiento y el
+nivel mínimo recomendado, y la biblioteca está indexada por grupo muscular
+para elegir en tiempo constante los candidatos de cada hueco de un día.
+Todos los grupos tienen al menos un ejercicio sin material para principiantes,
+así que siempre se puede montar una rutina.
+"""
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Set
+
+# Niveles de experiencia
+BEGINNER, INTERMEDIATE, ADVANCED = 1, 2, 3
+
+# Categorías de equipamiento
+BODYWEIGHT = "peso corporal"
+DUMBBELLS = "mancuernas"
+BARBELL = "barra"
+MACHINE = "maquina"
+CABLE = "polea"
+BANDS = "bandas"
+KETTLEBELL = "kettlebell"
+PULLUP_BAR = "barra de dominadas"
+
+ALL_EQUIPMENT = {BODYWEIGHT, DUMBBELLS, BARBELL, MACHINE, CABLE, BANDS, KETTLEBELL, PULLUP_BAR}
+
+
+class LibraryExercise(NamedTuple):
+    """Ejercicio de la biblioteca"""
+    name: str
+    muscle: str
+    category: str
+    equipment: str  # Texto que se muestra en la rutina
+    level: int
+
+
+EXERCISE_LIBRARY = (
+    # Pecho
+    LibraryExercise("Flexiones", "pecho", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Flexiones declinadas", "pecho", BODYWEIGHT, "Ninguno", INTERMEDIATE),
+    LibraryExercise("Press de banca", "pecho", BARBELL, "Barra y banco", INTERMEDIATE),
+    LibraryExercise("Press inclinado con mancuernas", "pecho", DUMBBELLS, "Mancuernas y banco", BEGINNER),
+    LibraryExercise("Aperturas con mancuernas", "pecho", DUMBBELLS, "Mancuernas y banco", BEGINNER),
+    LibraryExercise("Press de pecho en máquina", "pecho", MACHINE, "Máquina de press", BEGINNER),
+    LibraryExercise("Cruce de poleas", "pecho", CABLE, "Polea", INTERMEDIATE),
+    LibraryExercise("Press de pecho con banda", "pecho", BANDS, "Banda elástica", BEGINNER),
+    LibraryExercise("Fondos en paralelas", "pecho", BODYWEIGHT, "Paralelas", ADVANCED),
+    # Espalda
+    LibraryExercise("Remo invertido", "espalda", BODYWEIGHT, "Mesa o barra baja", BEGINNER),
+    LibraryExercise("Superman", "espalda", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Dominadas", "espalda", PULLUP_BAR, "Barra de dominadas", ADVANCED),
+    LibraryExercise("Remo con barra", "espalda", BARBELL, "Barra", INTERMEDIATE),
+    LibraryExercise("Peso muerto", "espalda", BARBELL, "Barra", ADVANCED),
+    LibraryExercise("Remo con mancuerna a una mano", "espalda", DUMBBELLS, "Mancuerna y banco", BEGINNER),
+    LibraryExercise("Jalón al pecho", "espalda", CABLE, "Polea", BEGINNER),
+    LibraryExercise("Remo sentado en polea", "espalda", CABLE, "Polea", BEGINNER),
+    LibraryExercise("Remo con banda", "espalda", BANDS, "Banda elástica", BEGINNER),
+    LibraryExercise("Remo con kettlebell", "espalda", KETTLEBELL, "Kettlebell", BEGINNER),
+    # Hombros
+    LibraryExercise("Flexiones en pica", "hombros", BODYWEIGHT, "Ninguno", INTERMEDIATE),
+    LibraryExercise("Elevaciones de brazos en Y", "hombros", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Press militar", "hombros", BARBELL, "Barra", INTERMEDIATE),
+    LibraryExercise("Press de hombros con mancuernas", "hombros", DUMBBELLS, "Mancuernas", BEGINNER),
+    LibraryExercise("Elevaciones laterales", "hombros", DUMBBELLS, "Mancuernas", BEGINNER),
+    LibraryExercise("Face pull", "hombros", CABLE, "Polea", INTERMEDIATE),
+    LibraryExercise("Press de hombros en máquina", "hombros", MACHINE, "Máquina de press", BEGINNER),
+    LibraryExercise("Elevaciones laterales con banda", "hombros", BANDS, "Banda elástica", BEGINNER),
+    # Bíceps
+    LibraryExercise("Dominadas supinas", "biceps", PULLUP_BAR, "Barra de dominadas", ADVANCED),
+    LibraryExercise("Curl isométrico con toalla", "biceps", BODYWEIGHT, "Toalla", BEGINNER),
+    LibraryExercise("Curl de bíceps", "biceps", DUMBBELLS, "Mancuernas", BEGINNER),
+    LibraryExercise("Curl martillo", "biceps", DUMBBELLS, "Mancuernas", BEGINNER),
+    LibraryExercise("Curl con barra", "biceps", BARBELL, "Barra", BEGINNER),
+    LibraryExercise("Curl en polea", "biceps", CABLE, "Polea", BEGINNER),
+    LibraryExercise("Curl con banda", "biceps", BANDS, "Banda elástica", BEGINNER),
+    # Tríceps
+    LibraryExercise("Fondos en banco", "triceps", BODYWEIGHT, "Banco o silla", BEGINNER),
+    LibraryExercise("Flexiones diamante", "triceps", BODYWEIGHT, "Ninguno", INTERMEDIATE),
+    LibraryExercise("Extensión de tríceps en polea", "triceps", CABLE, "Polea", BEGINNER),
+    LibraryExercise("Press francés", "triceps", BARBELL, "Barra Z y banco", INTERMEDIATE),
+    LibraryExercise("Extensión de tríceps con mancuerna", "triceps", DUMBBELLS, "Mancuerna", BEGINNER),
+    LibraryExercise("Extensión de tríceps con banda", "triceps", BANDS, "Banda elástica", BEGINNER),
+    # Cuádriceps
+    LibraryExercise("Sentadilla con peso corporal", "cuadriceps", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Zancadas", "cuadriceps", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Sentadilla búlgara", "cuadriceps", DUMBBELLS, "Mancuernas y banco", INTERMEDIATE),
+    LibraryExercise("Sentadilla goblet", "cuadriceps", DUMBBELLS, "Mancuerna", BEGINNER),
+    LibraryExercise("Sentadilla", "cuadriceps", BARBELL, "Barra", INTERMEDIATE),
+    LibraryExercise("Sentadilla frontal", "cuadriceps", BARBELL, "Barra", ADVANCED),
+    LibraryExercise("Prensa de piernas", "cuadriceps", MACHINE, "Máquina de prensa", BEGINNER),
+    LibraryExercise("Extensión de cuádriceps", "cuadriceps", MACHINE, "Máquina de extensiones", BEGINNER),
+    LibraryExercise("Sentadilla goblet con kettlebell", "cuadriceps", KETTLEBELL, "Kettlebell", BEGINNER),
+    # Isquiotibiales
+    LibraryExercise("Puente de isquiotibiales", "isquiotibiales", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Curl nórdico", "isquiotibiales", BODYWEIGHT, "Ninguno", ADVANCED),
+    LibraryExercise("Peso muerto rumano", "isquiotibiales", BARBELL, "Barra", INTERMEDIATE),
+    LibraryExercise("Peso muerto rumano con mancuernas", "isquiotibiales", DUMBBELLS, "Mancuernas", BEGINNER),
+    LibraryExercise("Curl femoral en máquina", "isquiotibiales", MACHINE, "Máquina de curl femoral", BEGINNER),
+    LibraryExercise("Swing con kettlebell", "isquiotibiales", KETTLEBELL, "Kettlebell", INTERMEDIATE),
+    # Glúteos
+    LibraryExercise("Puente de glúteos", "gluteos", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Hip thrust", "gluteos", BARBELL, "Barra y banco", INTERMEDIATE),
+    LibraryExercise("Patada de glúteo en polea", "gluteos", CABLE, "Polea", BEGINNER),
+    LibraryExercise("Abducción con banda", "gluteos", BANDS, "Banda elástica", BEGINNER),
+    LibraryExercise("Step-up con mancuernas", "gluteos", DUMBBELLS, "Mancuernas y cajón", BEGINNER),
+    # Gemelos
+    LibraryExercise("Elevación de talones", "gemelos", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Elevación de talones con mancuernas", "gemelos", DUMBBELLS, "Mancuernas", BEGINNER),
+    LibraryExercise("Elevación de talones en máquina", "gemelos", MACHINE, "Máquina de gemelos", BEGINNER),
+    # Core
+    LibraryExercise("Plancha", "core", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Plancha lateral", "core", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Dead bug", "core", BODYWEIGHT, "Ninguno", BEGINNER),
+    LibraryExercise("Elevaciones de piernas colgado", "core", PULLUP_BAR, "Barra de dominadas", ADVANCED),
+    LibraryExercise("Pallof press", "core", CABLE, "Polea", INTERMEDIATE),
+    LibraryExercise("Rueda abdominal", "core", BODYWEIGHT, "Rueda abdominal", ADVANCED),
+)
+
+# Índice por grupo muscular
+LIBRARY_BY_MUSCLE: Dict[str, List[LibraryExercise]] = {}
+for _exercise in EXERCISE_LIBRARY:
+    LIBRARY_BY_MUSCLE.setdefault(_exercise.muscle, []).append(_exercise)
+
+# Palabras del texto de equipamiento y categorías que habilitan
+EQUIPMENT_KEYWORDS = {
+    "gimnasio": ALL_EQUIPMENT,
+    "gym": ALL_EQUIPMENT,
+    "completo": ALL_EQUIPMENT,
+    "mancuerna": {DUMBBELLS},
+    "barra": {BARBELL, PULLUP_BAR},
+    "dominada": {PULLUP_BAR},
+    "maquina": {MACHINE},
+    "polea": {CABLE},
+    "banda": {BANDS},
+    "goma": {BANDS},
+    "elastic": {BANDS},
+    "kettlebell": {KETTLEBELL},
+    "pesa rusa": {KETTLEBELL},
+}
+
+# Palabras de cada tipo de objetivo
+GOAL_KEYWORDS = (
+    ("fuerza", ("fuerza", "powerlifting")),
+    ("hipertrofia", ("hipertrofia", "musculo", "masa", "volumen")),
+    ("resistencia", ("resistencia", "definir", "definicion", "perder", "grasa", "tonificar", "adelgazar"))
+)
+GENERAL_GOAL = "general"
+
+# Palabras del nivel de experiencia
+LEVEL_KEYWORDS = (
+    (BEGINNER, ("principiante", "novato", "inicial", "basico", "empezando", "nunca")),
+    (ADVANCED, ("avanzado", "experto", "competicion", "experiencia alta")),
+    (INTERMEDIATE, ("intermedio", "medio")),
+)
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin acentos"""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def parse_equipment(text: str) -> Set[str]:
+    """
+    Categorías de equipamiento disponibles según el texto de la petición.
+    Sin indicar nada se asume un gimnasio; el peso corporal siempre está disponible.
+    """
+    text = normalize(text)
+    if not text.strip():
+        return set(ALL_EQUIPMENT)
+    categories = {BODYWEIGHT}
+    for keyword, enabled in EQUIPMENT_KEYWORDS.items():
+        if re.search(rf"\b{keyword}", text):
+            categories |= enabled
+    return categories
+
+
+def goal_categories(text: str) -> List[str]:
+    """Tipos de objetivo mencionados en el texto, en el orden de GOAL_KEYWORDS"""
+    text = normalize(text)
+    return [goal for goal, keywords in GOAL_KEYWORDS if any(keyword in text for keyword in keywords)]
+
+
+def parse_goal(text: str) -> str:
+    """Tipo de objetivo principal ("general" si no se reconoce ninguno)"""
+    goals = goal_categories(text)
+    return goals[0] if goals else GENERAL_GOAL
+
+
+def equipment_label(categories: Set[str]) -> str:
+    """Texto canónico de un conjunto de categorías de equipamiento"""
+    if categories >= ALL_EQUIPMENT:
+        return "gimnasio"
+    extra = sorted(categories - {BODYWEIGHT})
+    return ", ".join(extra) if extra else "sin equipo"
+
+
+def parse_level(text: str) -> int:
+    """Nivel de experiencia (intermedio si no se indica)"""
+    text = normalize(text)
+    for level, keywords in LEVEL_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return level
+    return INTERMEDIATE
+
+
+def exercises_for(muscle: str, categories: Set[str], level: int) -> List[LibraryExercise]:
+    """
+    Ejercicios de un grupo muscular con el equipamiento disponible y adecuados
+    al nivel. Si ninguno encaja se relaja primero el nivel y después el equipamiento.
+    """
+    candidates = LIBRARY_BY_MUSCLE.get(muscle, [])
+    return ([e for e in candidates if e.category in categories and e.level <= level]
+            or [e for e in candidates if e.category in categories]
+            or [e for e in candidates if e.level <= level]
+            or list(candidates))
@@ -1,187 +1,896 @@
 import os
-import json
-import re
+import asyncio
 import traceback
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
-from app.models.models import Routine, RoutineRequest
+from pydantic import ValidationError
+from app.models.models import Day, Routine, RoutineRequest
+from app.services.llm_executor import llm_executor
+from app.services.json_stream import IncrementalRoutineParser
+from app.services.response_cache import response_cache, make_cache_key
+from app.services.similarity_cache import similarity_cache
+from app.services.single_flight import single_flight
+from app.services.routine_patch import PatchError, apply_routine_patch
+from app.services.routine_diff import diff_routines, describe_change, render_explanation
+from app.services.json_repair import extract_json, coerce_day, coerce_routine_dict
+from app.services.resilience import LLMUnavailableError, gemini_resilience
+from app.services.rate_limiter import rate_limiter, PRIORITY_CHAT, PRIORITY_CREATE
+from app.services.llm_backend import LLMBackend, get_default_backend
+from app.services.model_router import model_router
+from app.services.llm_metrics import LLMCall, llm_metrics, current_llm_call, use_llm_call
+from app.services.routine_service import RoutineGenerator, routine_events
+from app.services.day_targeting import target_days
+from app.services.routine_commands import local_commands
+from app.services.prompts import (
+    build_initial_prompt, build_modification_prompt, build_combined_modification_prompt,
+    build_patch_prompt, build_day_prompt, build_explanation_prompt, build_skeleton_prompt,
+    build_skeleton_day_prompt
+)
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Variable para seguimiento de si Gemini está configurado
-GEMINI_CONFIGURED = False
+# Enviar los días de la rutina al cliente a medida que se generan
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "true").lower() == "true"
 
-# Intentar configurar Gemini solo si la API key está disponible
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    try:
-        import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
-        # Definir el modelo a utilizar
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        GEMINI_CONFIGURED = True
-        print("✅ API de Gemini configurada correctamente")
-    except Exception as e:
-        print(f"❌ Error al configurar Gemini API: {str(e)}")
-else:
-    print("⚠️ GEMINI_API_KEY no encontrada, servicio de IA no estará disponible")
+# Obtener la rutina modificada y su explicación en una sola llamada al modelo
+GEMINI_COMBINED_MODIFY = os.getenv("GEMINI_COMBINED_MODIFY", "true").lower() == "true"
 
-class GeminiRoutineGenerator:
+# Modo de modificación: "patch" (el modelo devuelve solo operaciones) o "full" (rutina completa)
+GEMINI_MODIFY_MODE = os.getenv("GEMINI_MODIFY_MODE", "patch").lower()
+
+# Regenerar solo los días a los que se refiere el mensaje, en paralelo, en lugar de la rutina completa
+GEMINI_SCOPED_MODIFY = os.getenv("GEMINI_SCOPED_MODIFY", "true").lower() == "true"
+
+# Rutinas con al menos estos días se generan por partes: primero la estructura
+# (enfoque de cada día) y después los ejercicios de cada día en paralelo (0 = desactivado)
+GEMINI_FANOUT_MIN_DAYS = int(os.getenv("GEMINI_FANOUT_MIN_DAYS", "5"))
+
+# Días que se generan a la vez en la generación por partes
+GEMINI_FANOUT_CONCURRENCY = int(os.getenv("GEMINI_FANOUT_CONCURRENCY", "4"))
+
+# Generar la rutina con la biblioteca local de ejercicios si Gemini no está
+# configurado, no está disponible o no responde a tiempo
+OFFLINE_FALLBACK_ENABLED = os.getenv("OFFLINE_FALLBACK_ENABLED", "true").lower() == "true"
+
+# Segundos que se espera al modelo al crear una rutina antes de usar la generación local (0 = sin límite)
+OFFLINE_FALLBACK_DEADLINE = float(os.getenv("OFFLINE_FALLBACK_DEADLINE", "30"))
+
+# Reescribir con el modelo la explicación de cambios generada localmente
+GEMINI_MOTIVATIONAL_EXPLANATIONS = os.getenv("GEMINI_MOTIVATIONAL_EXPLANATIONS", "false").lower() == "true"
+
+# Backend de IA por defecto (Gemini, o el backend falso con LLM_BACKEND=fake)
+backend = get_default_backend()
+
+# Variable para seguimiento de si el backend por defecto está configurado
+GEMINI_CONFIGURED = backend.available
+
+class CachedResponse:
+    """Respuesta servida desde la caché, con la misma interfaz `.text` que la del SDK"""
+    
+    def __init__(self, text: str):
+        self.text = text
+
+class GeminiRoutineGenerator(RoutineGenerator):
     """Servicio para generar rutinas de entrenamiento utilizando la API de Gemini"""
     
+    def __init__(
+        self,
+        streaming: bool = GEMINI_STREAMING,
+        combined_modify: bool = GEMINI_COMBINED_MODIFY,
+        modify_mode: str = GEMINI_MODIFY_MODE,
+        motivational_explanations: bool = GEMINI_MOTIVATIONAL_EXPLANATIONS,
+        backend: Optional[LLMBackend] = None,
+        scoped_modify: bool = GEMINI_SCOPED_MODIFY,
+        fanout_min_days: int = GEMINI_FANOUT_MIN_DAYS,
+        fanout_concurrency: int = GEMINI_FANOUT_CONCURRENCY,
+        offline_fallback: bool = OFFLINE_FALLBACK_ENABLED,
+        offline_deadline: float = OFFLINE_FALLBACK_DEADLINE
+    ):
+        super().__init__(backend)
+        self.streaming = streaming
+        self.combined_modify = combined_modify
+        self.modify_mode = modify_mode
+        self.motivational_explanations = motivational_explanations
+        self.scoped_modify = scoped_modify
+        self.fanout_min_days = fanout_min_days
+        self.fanout_concurrency = fanout_concurrency
+        self.offline_fallback = offline_fallback
+        self.offline_deadline = offline_deadline
+    
+    @property
+    def backend(self) -> LLMBackend:
+        """Backend inyectado o, si no hay, el backend por defecto del módulo"""
+        return self._backend if self._backend is not None else backend
+    
+    @property
+    def configured(self) -> bool:
+        """Indica si el backend puede atender peticiones"""
+        return GEMINI_CONFIGURED if self._backend is None else self._backend.available
+    
+    @property
+    def model_name(self) -> str:
+        """Backend y modelo, parte de la clave de caché"""
+        return f"{self.backend.name}/{self.backend.model_name}"
+    
+    def _routed(self, operation: str) -> bool:
+        """Solo se enruta entre modelos con el backend por defecto (no con uno inyectado)"""
+        return self._backend is None and isinstance(backend, LLMBackend) and backend.routable and operation in model_router.routes
+    
+    def _backend_for(self, operation: str) -> LLMBackend:
+        """Backend del modelo que el enrutador asigna ahora a la operación"""
+        if not self._routed(operation):
+            return self.backend
+        return backend.for_model(model_router.choose(operation))
+    
+    def _cache_model(self, operation: str) -> str:
+        """
+        Modelo de la clave de caché: el principal de la ruta, de modo que las
+        respuestas del respaldo se comparten y un cambio de ruta invalida la caché
+        """
+        if not self._routed(operation):
+            return self.model_name
+        return f"{backend.name}/{model_router.routes[operation].primary}"
+    
+    def _route_observer(self, operation: str, model_backend: LLMBackend):
+        """Función que informa al enrutador de la latencia y el resultado de cada intento"""
+        if not self._routed(operation):
+            return None
+        return lambda seconds, ok: model_router.record(operation, model_backend.model_name, seconds, ok)
+    
+    @property
+    def streams_modifications(self) -> bool:
+        """Las modificaciones se envían en streaming solo si se pide la rutina completa"""
+        return self.streaming and self.modify_mode != "patch"
+    
     def _build_initial_prompt(self, request: RoutineRequest) -> str:
         """Construye el prompt inicial para crear una rutina"""
-        return f"""
-        Actúa como un entrenador personal profesional y crea una rutina de entrenamiento detallada con estas características:
-        
-        Objetivos: {request.goals}
-        Días de entrenamiento: {request.days} días a la semana
-        Nivel de experiencia: {request.experience_level if hasattr(request, 'experience_level') else 'No especificado'}
-        Equipo disponible: {request.available_equipment if hasattr(request, 'available_equipment') else 'No especificado'}
-        Tiempo por sesión: {request.time_per_session if hasattr(request, 'time_per_session') else 'No especificado'}
-        Condiciones de salud: {request.health_conditions if hasattr(request, 'health_conditions') else 'Ninguna'}
+        return build_initial_prompt(request)
+    
+    def _build_modification_prompt(self, current_routine: Routine, user_request: str, history: str = "") -> str:
+        """Construye el prompt para modificar una rutina existente"""
+        return build_modification_prompt(current_routine, user_request, history)
+    
+    def _build_combined_modification_prompt(self, current_routine: Routine, user_request: str, history: str = "") -> str:
+        """Construye el prompt para modificar una rutina y explicar los cambios en una sola respuesta"""
+        return build_combined_modification_prompt(current_routine, user_request, history)
+    
+    def _build_patch_prompt(self, current_routine: Routine, user_request: str, history: str = "") -> str:
+        """Construye el prompt para obtener solo las operaciones de modificación"""
+        return build_patch_prompt(current_routine, user_request, history)
+    
+    def _fans_out(self, request: RoutineRequest) -> bool:
+        """Las rutinas largas se generan por partes en lugar de en una sola respuesta"""
+        return 0 < self.fanout_min_days <= request.days
+    
+    def _target_days(self, current_routine: Routine, user_request: str) -> List[int]:
+        """Días que se regeneran por separado (vacío = rutina completa)"""
+        if not self.scoped_modify:
+            return []
+        return target_days(current_routine, user_request)
+    
+    def _split_combined_response(self, response_dict: dict) -> Tuple[dict, Any]:
+        """Separa la rutina y la explicación de una respuesta combinada"""
+        if isinstance(response_dict.get("routine"), dict):
+            return response_dict["routine"], response_dict.get("explanation")
+        # El modelo devolvió solo la rutina, sin envoltorio
+        return response_dict, None
+    
+    def _extract_json_from_text(self, text: str) -> dict:
+        """Extrae el contenido JSON de una respuesta de texto, reparando los defectos habituales"""
+        result = extract_json(text)
+        if not result:
+            print("Error al extraer JSON: no se encontró un objeto JSON utilizable")
+            print(f"Texto recibido: {text[:200]}...")  # Mostrar primeros 200 caracteres
+        return result
+    
+    def _validate_routine(self, routine_dict: dict) -> Routine:
+        """Ajusta los valores casi correctos y valida la rutina con Pydantic"""
+        return Routine.model_validate(coerce_routine_dict(routine_dict))
+    
+    async def _generate_content(self, prompt, user_id: Optional[int] = None, priority: int = PRIORITY_CREATE):
+        """
+        Llama al modelo en el pool dedicado para no bloquear el bucle de eventos,
+        con plazos, reintentos y circuito (ver `resilience`), tras pasar por el
+        limitador de peticiones con la prioridad indicada.
+        Si el mismo prompt ya se respondió (en este u otro worker) se sirve desde la caché,
+        y si ya hay una llamada idéntica en curso se espera a su resultado.
+        La espera en la cola, el tiempo de red y los tamaños se anotan en la operación en curso,
+        que también decide el modelo (ver `model_router`).
+        """
+        call = current_llm_call()
+        call.set_prompt(prompt)
+        cache_model = self._cache_model(call.operation)
+        cached = await response_cache.get(prompt, cache_model)
+        if cached is not None:
+            print("✅ Respuesta servida desde la caché")
+            call.source = "cache"
+            call.set_response(cached)
+            return CachedResponse(cached)
         
-        La rutina debe seguir ESTRICTAMENTE este formato JSON:
+        async def call_model():
+            with call.phase("queue_wait"):
+                await rate_limiter.acquire(user_id, priority)
+            call.source = "model"
+            call.model_calls += 1
+            model_backend = self._backend_for(call.operation)
+            with call.phase("network"):
+                return await gemini_resilience.call(
+                    lambda: llm_executor.run(model_backend.generate_content, prompt),
+                    on_attempt=self._route_observer(call.operation, model_backend)
+                )
         
-        {{
-            "routine_name": "Nombre descriptivo de la rutina",
-            "days": [
-                {{
-                    "day_name": "Lunes",
-                    "focus": "Parte del cuerpo que se trabaja ese día",
-                    "exercises": [
-                        {{
-                            "name": "Nombre del ejercicio",
-                            "sets": 3,
-                            "reps": "8-12",
-                            "rest": "60-90 seg",
-                            "equipment": "Equipamiento necesario"
-                        }}
-                    ]
-                }}
-            ]
-        }}
+        # Las solicitudes idénticas en curso comparten una sola llamada al modelo
+        call.source = "shared"
+        response = await single_flight.do(make_cache_key(prompt, cache_model), call_model)
+        call.set_response(response)
+        return response
+    
+    async def _remember(self, prompt: str, response):
+        """Guarda en la caché una respuesta que ya se validó correctamente"""
+        if not isinstance(response, CachedResponse):
+            await response_cache.set(prompt, self._cache_model(current_llm_call().operation), response.text)
+    
+    def _stream_text_sync(self, prompt, model_backend: Optional[LLMBackend] = None):
+        """Itera (de forma bloqueante) los fragmentos de texto de una respuesta en streaming"""
+        for chunk in (model_backend or self.backend).generate_content(prompt, stream=True):
+            try:
+                yield chunk.text
+            except ValueError:
+                # Fragmentos sin texto (p. ej. solo metadatos de seguridad)
+                continue
+    
+    async def _stream_routine(
+        self,
+        prompt: str,
+        overrides: Dict[str, Any],
+        combined: bool = False,
+        priority: int = PRIORITY_CREATE,
+        call: Optional[LLMCall] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Consume la respuesta del modelo fragmento a fragmento y emite eventos:
+        - {"type": "routine_name", "routine_name": str}
+        - {"type": "day", "index": int, "day": dict} por cada día que valida contra `Day`
+        - {"type": "routine", "routine": Routine, "explanation": str | None} al final,
+          con la rutina completa validada (y la explicación si el prompt era combinado)
         
-        IMPORTANTE: 
-        1. Devuelve SOLO el JSON válido, sin texto explicativo.
-        2. Incluye exactamente {request.days} días en la rutina.
+        Los tiempos se anotan en `call`: en streaming la red es el tiempo de espera
+        de cada fragmento y `first_chunk` el tiempo hasta el primero.
         """
-    
-    def _build_modification_prompt(self, current_routine: Routine, user_request: str) -> str:
-        """Construye el prompt para modificar una rutina existente"""
-        routine_json = current_routine.model_dump_json()
+        call = call or LLMCall("untracked")
+        call.set_prompt(prompt)
+        parser = IncrementalRoutineParser()
+        day_index = 0
         
-        return f"""
-        Actúa como un entrenador personal. El usuario tiene la siguiente rutina de entrenamiento:
+        cache_model = self._cache_model(call.operation)
+        cached = await response_cache.get(prompt, cache_model)
+        if cached is not None:
+            print("✅ Respuesta servida desde la caché")
+            call.source = "cache"
+            chunks = self._iter_cached(cached)
+        else:
+            async def model_chunks():
+                with call.phase("queue_wait"):
+                    await rate_limiter.acquire(overrides.get("user_id"), priority)
+                call.source = "model"
+                call.model_calls += 1
+                model_backend = self._backend_for(call.operation)
+                model_stream = gemini_resilience.stream(
+                    lambda: llm_executor.stream(self._stream_text_sync, prompt, model_backend),
+                    on_attempt=self._route_observer(call.operation, model_backend)
+                )
+                async for chunk in call.timed("network", model_stream):
+                    yield chunk
+            
+            call.source = "shared"
+            chunks = single_flight.stream(make_cache_key(prompt, cache_model), model_chunks)
         
-        ```json
-        {routine_json}
-        ```
+        async for chunk in chunks:
+            with call.phase("json_extraction"):
+                parsed = parser.feed(chunk)
+            for kind, value in parsed:
+                if kind == "routine_name":
+                    yield {"type": "routine_name", "routine_name": value}
+                    continue
+                with call.phase("validation"):
+                    try:
+                        day = Day.model_validate(coerce_day(value))
+                    except ValidationError as e:
+                        print(f"Día incompleto en streaming, se validará al final: {str(e)}")
+                        day = None
+                if day is None:
+                    day_index += 1
+                    continue
+                yield {"type": "day", "index": day_index, "day": day.model_dump()}
+                day_index += 1
         
-        El usuario ha solicitado: "{user_request}"
+        call.set_response(parser.buffer)
+        with call.phase("json_extraction"):
+            routine_dict = self._extract_json_from_text(parser.buffer)
+        if not routine_dict:
+            call.fail("json_extraction")
+            raise ValueError("No se pudo extraer JSON válido de la respuesta de Gemini")
         
-        Modifica la rutina según esta solicitud y devuelve SOLO el JSON actualizado.
-        """
+        explanation = None
+        if combined:
+            routine_dict, explanation = self._split_combined_response(routine_dict)
+            if not isinstance(explanation, str) or not explanation.strip():
+                explanation = None
+        
+        routine_dict.update(overrides)
+        with call.phase("validation"):
+            routine = self._validate_routine(routine_dict)
+        if cached is None:
+            await response_cache.set(prompt, cache_model, parser.buffer)
+        
+        yield {
+            "type": "routine",
+            "routine": routine,
+            "explanation": explanation.strip() if explanation else None
+        }
     
-    def _extract_json_from_text(self, text: str) -> dict:
-        """Extrae el contenido JSON de una respuesta de texto"""
-        try:
-            # Buscar bloques de código JSON
-            json_pattern = r"```(?:json)?\s*([\s\S]*?)\s*```"
-            json_matches = re.findall(json_pattern, text)
-            
-            if json_matches:
-                return json.loads(json_matches[0].strip())
+    async def _create_skeleton(self, request: RoutineRequest) -> Dict[str, Any]:
+        """Pide el nombre de la rutina y el enfoque de cada día, sin ejercicios"""
+        prompt = build_skeleton_prompt(request)
+        call = current_llm_call()
+        response = await self._generate_content(prompt, request.user_id, PRIORITY_CREATE)
+        
+        with call.phase("json_extraction"):
+            skeleton = self._extract_json_from_text(response.text)
+        days = skeleton.get("days") if isinstance(skeleton, dict) else None
+        if not isinstance(days, list) or len(days) < request.days or not all(isinstance(day, dict) for day in days):
+            call.fail("json_extraction")
+            raise ValueError("La estructura de la rutina no es válida")
+        
+        await self._remember(prompt, response)
+        return {
+            "routine_name": str(skeleton.get("routine_name") or f"Rutina de {request.days} días"),
+            "days": [
+                {"day_name": str(day.get("day_name") or self.days_of_week[index % 7]),
+                 "focus": str(day.get("focus") or "General")}
+                for index, day in enumerate(days[:request.days])
+            ]
+        }
+    
+    async def _create_skeleton_day(
+        self,
+        request: RoutineRequest,
+        skeleton: Dict[str, Any],
+        index: int,
+        semaphore: asyncio.Semaphore,
+        call: LLMCall
+    ) -> Tuple[int, Day]:
+        """Genera los ejercicios de un día de la estructura, como parte de la operación `call`"""
+        with use_llm_call(call):
+            prompt = build_skeleton_day_prompt(request, skeleton, index)
+            async with semaphore:
+                # La petición ya se contó en el límite del usuario al pedir la estructura;
+                # los días solo consumen del límite global
+                response = await self._generate_content(prompt, None, PRIORITY_CREATE)
             
-            # Si no hay bloques de código, parsear el texto completo
-            clean_text = text.strip()
-            return json.loads(clean_text)
+            with call.phase("json_extraction"):
+                day_dict = self._extract_json_from_text(response.text)
+            if isinstance(day_dict, dict) and isinstance(day_dict.get("day"), dict):
+                # El modelo envolvió el día en un objeto
+                day_dict = day_dict["day"]
+            if not day_dict:
+                call.fail("json_extraction")
+                raise ValueError(f"No se pudo extraer JSON válido del día {index + 1}")
             
+            # El nombre y el enfoque son siempre los de la estructura
+            day_dict.update(skeleton["days"][index])
+            with call.phase("validation"):
+                day = Day.model_validate(coerce_day(day_dict))
+            await self._remember(prompt, response)
+            return index, day
+    
+    async def _fanout_routine(self, request: RoutineRequest, call: LLMCall) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Genera la rutina por partes y emite los mismos eventos que `_stream_routine`:
+        primero se pide la estructura y después los ejercicios de cada día en
+        llamadas paralelas (como mucho `fanout_concurrency` a la vez). Cada día se
+        emite cuando termina, así que el tiempo total depende del día más lento y
+        no de la suma de todos, y ninguna respuesta es tan larga como para cortarse.
+        """
+        with use_llm_call(call):
+            skeleton = await self._create_skeleton(request)
+        print(f"🧩 Estructura de '{skeleton['routine_name']}' lista, generando {len(skeleton['days'])} días en paralelo")
+        yield {"type": "routine_name", "routine_name": skeleton["routine_name"]}
+        
+        semaphore = asyncio.Semaphore(max(1, self.fanout_concurrency))
+        tasks = [
+            asyncio.ensure_future(self._create_skeleton_day(request, skeleton, index, semaphore, call))
+            for index in range(len(skeleton["days"]))
+        ]
+        days: List[Optional[Day]] = [None] * len(tasks)
+        try:
+            for next_day in asyncio.as_completed(tasks):
+                index, day = await next_day
+                days[index] = day
+                yield {"type": "day", "index": index, "day": day.model_dump()}
+        finally:
+            # Si un día falla no tiene sentido seguir generando el resto
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        with call.phase("validation"):
+            routine = self._validate_routine({
+                "user_id": request.user_id,
+                "routine_name": skeleton["routine_name"],
+                "days": [day.model_dump() for day in days]
+            })
+        yield {"type": "routine", "routine": routine, "explanation": None}
+    
+    async def _create_with_fanout(self, request: RoutineRequest, call: LLMCall) -> Optional[Routine]:
+        """Rutina generada por partes, o None si falló para generarla en una sola respuesta"""
+        routine = None
+        try:
+            async for event in self._fanout_routine(request, call):
+                if event["type"] == "routine":
+                    routine = event["routine"]
+        except LLMUnavailableError:
+            raise
         except Exception as e:
-            print(f"Error al extraer JSON: {str(e)}")
-            print(f"Texto recibido: {text[:200]}...")  # Mostrar primeros 200 caracteres
-            return {}
+            print(f"⚠️ Error en la generación por partes ({str(e)}), generando la rutina completa")
+        return routine
+    
+    async def _iter_cached(self, text: str) -> AsyncIterator[str]:
+        """Entrega una respuesta cacheada como un único fragmento"""
+        yield text
+    
+    def _offline_routine(self, request: RoutineRequest, call: LLMCall, reason: str) -> Routine:
+        """Rutina de la biblioteca local cuando el modelo no puede atender la petición"""
+        print(f"📴 {reason}, generando la rutina sin conexión")
+        call.source = "offline"
+        return self.build_offline_routine(request)
     
     async def create_initial_routine(self, request: RoutineRequest) -> Routine:
-        """Genera una rutina inicial utilizando la API de Gemini"""
+        """
+        Genera una rutina inicial utilizando la API de Gemini. Si está activada la
+        generación sin conexión, se usa cuando Gemini no está configurado, no está
+        disponible o no responde antes de `offline_deadline`.
+        """
         
         # Verificar si Gemini está configurado
-        if not GEMINI_CONFIGURED:
+        if not self.configured and not self.offline_fallback:
             print("❌ Gemini no está configurado")
             raise ValueError("API de Gemini no está configurada. No se pueden generar rutinas.")
         
+        with llm_metrics.track("create") as call:
+            similar = await similarity_cache.get(request)
+            if similar is not None:
+                call.source = "similar"
+                return similar
+            if not self.configured:
+                return self._offline_routine(request, call, "Gemini no está configurado")
+            if not self.offline_fallback:
+                return await self._create_with_model(request, call)
+            
+            try:
+                return await asyncio.wait_for(self._create_with_model(request, call),
+                                              self.offline_deadline or None)
+            except LLMUnavailableError:
+                return self._offline_routine(request, call, "Gemini no está disponible")
+            except asyncio.TimeoutError:
+                return self._offline_routine(request, call, f"Gemini no respondió en {self.offline_deadline:.0f}s")
+    
+    async def _create_with_model(self, request: RoutineRequest, call: LLMCall) -> Routine:
+        """Genera la rutina inicial con el modelo (por partes si es larga)"""
         prompt = self._build_initial_prompt(request)
         
+        if self._fans_out(request):
+            routine = await self._create_with_fanout(request, call)
+            if routine is not None:
+                print(f"✅ Rutina generada por partes: {routine.routine_name}")
+                await similarity_cache.set(request, routine)
+                return routine
+        
         try:
             print("Enviando solicitud a Gemini API...")
-            response = model.generate_content(prompt)
+            response = await self._generate_content(prompt, request.user_id, PRIORITY_CREATE)
             
             print(f"Respuesta recibida de Gemini, extrayendo JSON...")
             print(f"Muestra de respuesta: {response.text[:200]}...")  # Primeros 200 caracteres
             
-            routine_dict = self._extract_json_from_text(response.text)
+            with call.phase("json_extraction"):
+                routine_dict = self._extract_json_from_text(response.text)
             
             if not routine_dict:
                 print("❌ No se pudo extraer JSON válido de la respuesta")
+                call.fail("json_extraction")
                 raise ValueError("No se pudo extraer JSON válido de la respuesta de Gemini")
                 
             routine_dict["user_id"] = request.user_id
             
             print(f"Validando rutina con Pydantic...")
-            routine = Routine.model_validate(routine_dict)
+            with call.phase("validation"):
+                routine = self._validate_routine(routine_dict)
             print(f"✅ Rutina validada correctamente: {routine.routine_name}")
+            await self._remember(prompt, response)
+            await similarity_cache.set(request, routine)
             return routine
             
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             print(f"❌ Error al generar rutina con Gemini: {str(e)}")
             print(traceback.format_exc())
             raise ValueError(f"Error al generar rutina con Gemini: {str(e)}")
     
-    async def modify_routine(self, current_routine: Routine, user_request: str) -> Routine:
+    async def modify_routine(self, current_routine: Routine, user_request: str, history: str = "") -> Routine:
         """Modifica una rutina existente según la solicitud del usuario"""
+        # Las ediciones mecánicas se aplican localmente, sin llamar al modelo
+        local = local_commands.apply(current_routine, user_request)
+        if local is not None:
+            return local[0]
+        
         # Verificar si Gemini está configurado
-        if not GEMINI_CONFIGURED:
+        if not self.configured:
             print("❌ Gemini no está configurado")
             raise ValueError("API de Gemini no está configurada. No se pueden modificar rutinas.")
             
-        prompt = self._build_modification_prompt(current_routine, user_request)
+        indices = self._target_days(current_routine, user_request)
+        prompt = self._build_modification_prompt(current_routine, user_request, history)
         
-        try:
-            response = model.generate_content(prompt)
-            routine_dict = self._extract_json_from_text(response.text)
+        with llm_metrics.track("modify") as call:
+            if indices:
+                routine = await self._modify_days(current_routine, indices, user_request, history)
+                if routine is not None:
+                    return routine
             
-            if not routine_dict:
-                raise ValueError("No se pudo extraer JSON válido")
+            try:
+                response = await self._generate_content(prompt, current_routine.user_id, PRIORITY_CHAT)
+                with call.phase("json_extraction"):
+                    routine_dict = self._extract_json_from_text(response.text)
+                
+                if not routine_dict:
+                    call.fail("json_extraction")
+                    raise ValueError("No se pudo extraer JSON válido")
+                
+                # Mantener el ID y user_id originales
+                routine_dict["id"] = current_routine.id
+                routine_dict["user_id"] = current_routine.user_id
+                
+                with call.phase("validation"):
+                    routine = self._validate_routine(routine_dict)
+                await self._remember(prompt, response)
+                return routine
+                
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                print(f"Error al modificar rutina: {str(e)}")
+                raise ValueError(f"Error al modificar rutina con Gemini: {str(e)}")
+    
+    async def explain_routine_changes(self, old_routine: Routine, new_routine: Routine, user_request: str) -> str:
+        """
+        Genera una explicación de los cambios realizados a la rutina a partir de
+        la comparación local de ambas versiones. Si las explicaciones motivadoras
+        están activadas, el resumen se envía al modelo para redactarlo de nuevo.
+        """
+        changes = diff_routines(old_routine, new_routine)
+        explanation = render_explanation(changes)
+        
+        if not self.motivational_explanations or not changes or not self.configured:
+            return explanation
+        
+        summary = "\n".join(describe_change(change) for change in changes)
+        prompt = build_explanation_prompt(user_request, summary)
+        
+        with llm_metrics.track("explain") as call:
+            try:
+                response = await self._generate_content(prompt, new_routine.user_id, PRIORITY_CHAT)
+                rewritten = response.text.strip()
+                if rewritten:
+                    await self._remember(prompt, response)
+                    return rewritten
+                call.outcome = "empty_response"
+            except Exception as e:
+                print(f"⚠️ Error al redactar la explicación con Gemini, usando la plantilla: {str(e)}")
+                call.error = e
+        
+        return explanation
+    
+    async def modify_and_explain(
+        self,
+        current_routine: Routine,
+        user_request: str,
+        history: str = ""
+    ) -> Tuple[Routine, str]:
+        """
+        Modifica la rutina y genera la explicación de los cambios con una sola
+        llamada al modelo. En modo "patch" el modelo devuelve solo operaciones
+        que se aplican localmente; si no son válidas se pide la rutina completa.
+        Si la respuesta combinada no es válida, o si el modo combinado está
+        desactivado, se usan las dos llamadas por separado.
+        Si el mensaje se refiere a días concretos, solo se regeneran esos días.
+        `history` es el contexto de la conversación que se añade al prompt.
+        Las ediciones mecánicas (series, repeticiones, descanso...) se aplican
+        localmente sin llamar al modelo (ver `routine_commands`).
+        """
+        local = local_commands.apply(current_routine, user_request)
+        if local is not None:
+            return local
+        
+        with llm_metrics.track("modify") as call:
+            indices = self._target_days(current_routine, user_request)
+            if indices:
+                routine = await self._modify_days(current_routine, indices, user_request, history)
+                if routine is not None:
+                    explanation = await self.explain_routine_changes(current_routine, routine, user_request)
+                    return routine, explanation
             
-            # Mantener el ID y user_id originales
-            routine_dict["id"] = current_routine.id
-            routine_dict["user_id"] = current_routine.user_id
+            if self.modify_mode == "patch":
+                result = await self._modify_with_patch(current_routine, user_request, history)
+                if result is not None:
+                    return result
+        
+            if not self.combined_modify:
+                return await self._modify_and_explain_separately(current_routine, user_request, history)
+        
+            if not self.configured:
+                print("❌ Gemini no está configurado")
+                raise ValueError("API de Gemini no está configurada. No se pueden modificar rutinas.")
+        
+            prompt = self._build_combined_modification_prompt(current_routine, user_request, history)
+        
+            try:
+                response = await self._generate_content(prompt, current_routine.user_id, PRIORITY_CHAT)
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                print(f"Error al modificar rutina: {str(e)}")
+                raise ValueError(f"Error al modificar rutina con Gemini: {str(e)}")
+        
+            try:
+                with call.phase("json_extraction"):
+                    response_dict = self._extract_json_from_text(response.text)
+                if not response_dict:
+                    raise ValueError("No se pudo extraer JSON válido")
             
-            routine = Routine.model_validate(routine_dict)
-            return routine
+                routine_dict, explanation = self._split_combined_response(response_dict)
+                if not isinstance(explanation, str) or not explanation.strip():
+                    raise ValueError("La respuesta no incluye una explicación")
             
+                # Mantener el ID y user_id originales
+                routine_dict["id"] = current_routine.id
+                routine_dict["user_id"] = current_routine.user_id
+            
+                with call.phase("validation"):
+                    routine = self._validate_routine(routine_dict)
+                await self._remember(prompt, response)
+                return routine, explanation.strip()
+            
+            except ValueError as e:
+                print(f"⚠️ Respuesta combinada no válida ({str(e)}), usando dos llamadas")
+                return await self._modify_and_explain_separately(current_routine, user_request, history)
+    
+    async def _modify_with_patch(
+        self,
+        current_routine: Routine,
+        user_request: str,
+        history: str = ""
+    ) -> Optional[Tuple[Routine, str]]:
+        """
+        Pide al modelo solo las operaciones de modificación y las aplica localmente.
+        Devuelve None si la respuesta no es un parche válido para usar el modo completo.
+        """
+        if not self.configured:
+            print("❌ Gemini no está configurado")
+            raise ValueError("API de Gemini no está configurada. No se pueden modificar rutinas.")
+        
+        prompt = self._build_patch_prompt(current_routine, user_request, history)
+        call = current_llm_call()
+        
+        try:
+            response = await self._generate_content(prompt, current_routine.user_id, PRIORITY_CHAT)
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             print(f"Error al modificar rutina: {str(e)}")
             raise ValueError(f"Error al modificar rutina con Gemini: {str(e)}")
+        
+        with call.phase("json_extraction"):
+            response_dict = self._extract_json_from_text(response.text)
+        if not isinstance(response_dict, dict):
+            response_dict = {}
+        try:
+            with call.phase("validation"):
+                routine = apply_routine_patch(current_routine, response_dict.get("operations"))
+        except PatchError as e:
+            print(f"⚠️ Parche no válido ({str(e)}), pidiendo la rutina completa")
+            return None
+        
+        await self._remember(prompt, response)
+        explanation = response_dict.get("explanation")
+        if not isinstance(explanation, str) or not explanation.strip():
+            explanation = await self.explain_routine_changes(current_routine, routine, user_request)
+        return routine, explanation.strip()
     
-    async def explain_routine_changes(self, old_routine: Routine, new_routine: Routine, user_request: str) -> str:
-        """Genera una explicación de los cambios realizados a la rutina"""
-        # Verificar si Gemini está configurado
-        if not GEMINI_CONFIGURED:
+    async def _modify_day(self, current_routine: Routine, index: int, user_request: str, history: str) -> Day:
+        """Regenera un solo día de la rutina"""
+        prompt = build_day_prompt(current_routine, index, user_request, history)
+        call = current_llm_call()
+        response = await self._generate_content(prompt, current_routine.user_id, PRIORITY_CHAT)
+        
+        with call.phase("json_extraction"):
+            day_dict = self._extract_json_from_text(response.text)
+        if isinstance(day_dict, dict) and isinstance(day_dict.get("day"), dict):
+            # El modelo envolvió el día en un objeto
+            day_dict = day_dict["day"]
+        if not day_dict:
+            raise ValueError("No se pudo extraer JSON válido del día")
+        
+        with call.phase("validation"):
+            day = Day.model_validate(coerce_day(day_dict))
+        await self._remember(prompt, response)
+        return day
+    
+    async def _modify_days(
+        self,
+        current_routine: Routine,
+        indices: List[int],
+        user_request: str,
+        history: str = ""
+    ) -> Optional[Routine]:
+        """
+        Regenera en paralelo solo los días indicados y los sustituye en la rutina;
+        el resto de días se conservan sin cambios. Devuelve None si algún día no
+        se pudo regenerar, para modificar la rutina completa.
+        """
+        print(f"🎯 Modificando {len(indices)} de {len(current_routine.days)} días: "
+              f"{', '.join(current_routine.days[index].day_name for index in indices)}")
+        results = await asyncio.gather(
+            *(self._modify_day(current_routine, index, user_request, history) for index in indices),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, LLMUnavailableError):
+                raise result
+            if isinstance(result, BaseException):
+                print(f"⚠️ No se pudo regenerar un día ({str(result)}), modificando la rutina completa")
+                return None
+        
+        days = list(current_routine.days)
+        for index, day in zip(indices, results):
+            days[index] = day
+        return current_routine.model_copy(update={"days": days})
+    
+    async def _modify_and_explain_separately(
+        self,
+        current_routine: Routine,
+        user_request: str,
+        history: str = ""
+    ) -> Tuple[Routine, str]:
+        """Comportamiento original: modificar y después explicar los cambios por separado"""
+        modified_routine = await self.modify_routine(current_routine, user_request, history)
+        explanation = await self.explain_routine_changes(current_routine, modified_routine, user_request)
+        return modified_routine, explanation
+    
+    async def stream_initial_routine(self, request: RoutineRequest) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Genera una rutina inicial emitiendo cada día en cuanto está disponible.
+        Las rutinas largas se generan por partes y sus días pueden llegar en cualquier orden.
+        Si Gemini no está configurado, no está disponible o no emite el primer evento
+        antes de `offline_deadline`, se emite la rutina sin conexión con los mismos eventos.
+        """
+        if not self.configured and not self.offline_fallback:
             print("❌ Gemini no está configurado")
-            raise ValueError("API de Gemini no está configurada. No se puede explicar cambios.")
-            
-        prompt = f"""
-        El usuario solicitó: "{user_request}"
+            raise ValueError("API de Gemini no está configurada. No se pueden generar rutinas.")
         
-        Explica brevemente los cambios realizados a la rutina de forma profesional y motivadora.
-        No incluyas código JSON, solo texto explicando los cambios principales.
+        call = llm_metrics.start("create")
+        similar = await similarity_cache.get(request)
+        if similar is not None:
+            call.source = "similar"
+            llm_metrics.record(call)
+            async for event in routine_events(similar):
+                yield event
+            return
+        if not self.configured:
+            async for event in self._stream_offline(request, call, "Gemini no está configurado"):
+                yield event
+            return
+        
+        prompt = self._build_initial_prompt(request)
+        emitted = False
+        try:
+            if self._fans_out(request):
+                events = self._fanout_routine(request, call)
+            else:
+                events = self._stream_routine(prompt, {"user_id": request.user_id}, call=call)
+            if self.offline_fallback and self.offline_deadline:
+                events = self._first_event_within(events, self.offline_deadline)
+            async for event in events:
+                emitted = True
+                if event["type"] == "routine":
+                    await similarity_cache.set(request, event["routine"])
+                yield event
+        except (LLMUnavailableError, asyncio.TimeoutError) as e:
+            if self.offline_fallback and not emitted:
+                reason = "Gemini no está disponible" if isinstance(e, LLMUnavailableError) \
+                    else f"Gemini no respondió en {self.offline_deadline:.0f}s"
+                async for event in self._stream_offline(request, call, reason):
+                    yield event
+                return
+            llm_metrics.record(call, e)
+            raise
+        except Exception as e:
+            llm_metrics.record(call, e)
+            print(f"❌ Error al generar rutina en streaming con Gemini: {str(e)}")
+            raise ValueError(f"Error al generar rutina con Gemini: {str(e)}")
+        llm_metrics.record(call)
+    
+    @staticmethod
+    async def _first_event_within(events: AsyncIterator[Dict[str, Any]], seconds: float) -> AsyncIterator[Dict[str, Any]]:
+        """Reemite los eventos; lanza asyncio.TimeoutError si el primero tarda más de `seconds`"""
+        iterator = events.__aiter__()
+        try:
+            try:
+                first = await asyncio.wait_for(iterator.__anext__(), seconds)
+            except StopAsyncIteration:
+                return
+            yield first
+            async for event in iterator:
+                yield event
+        finally:
+            await iterator.aclose()
+    
+    async def _stream_offline(self, request: RoutineRequest, call: LLMCall, reason: str) -> AsyncIterator[Dict[str, Any]]:
+        """Eventos de streaming de la rutina sin conexión"""
+        routine = self._offline_routine(request, call, reason)
+        llm_metrics.record(call)
+        async for event in routine_events(routine):
+            yield event
+    
+    async def stream_modify_routine(
+        self,
+        current_routine: Routine,
+        user_request: str,
+        history: str = ""
+    ) -> AsyncIterator[Dict[str, Any]]:
         """
+        Modifica una rutina emitiendo cada día actualizado en cuanto está disponible.
+        En modo combinado el evento final incluye también la explicación de los cambios.
+        Si el mensaje se refiere a días concretos solo se regeneran y emiten esos días.
+        """
+        local = local_commands.apply(current_routine, user_request)
+        if local is not None:
+            yield {"type": "routine", "routine": local[0], "explanation": local[1]}
+            return
+        
+        if not self.configured:
+            print("❌ Gemini no está configurado")
+            raise ValueError("API de Gemini no está configurada. No se pueden modificar rutinas.")
+        
+        indices = self._target_days(current_routine, user_request)
+        if indices:
+            with llm_metrics.track("modify"):
+                routine = await self._modify_days(current_routine, indices, user_request, history)
+            if routine is not None:
+                for index in indices:
+                    yield {"type": "day", "index": index, "day": routine.days[index].model_dump()}
+                yield {"type": "routine", "routine": routine, "explanation": None}
+                return
+        
+        if self.combined_modify:
+            prompt = self._build_combined_modification_prompt(current_routine, user_request, history)
+        else:
+            prompt = self._build_modification_prompt(current_routine, user_request, history)
+        overrides = {"id": current_routine.id, "user_id": current_routine.user_id}
+        call = llm_metrics.start("modify")
         
         try:
-            response = model.generate_content(prompt)
-            return response.text.strip()
-            
+            events = self._stream_routine(prompt, overrides, combined=self.combined_modify,
+                                          priority=PRIORITY_CHAT, call=call)
+            async for event in events:
+                yield event
+        except LLMUnavailableError as e:
+            llm_metrics.record(call, e)
+            raise
         except Exception as e:
-            print(f"Error al obtener explicación: {str(e)}")
-            raise ValueError(f"Error al generar explicación con Gemini: {str(e)}")
\ No newline at end of file
+            llm_metrics.record(call, e)
+            print(f"Error al modificar rutina en streaming: {str(e)}")
+            raise ValueError(f"Error al modificar rutina con Gemini: {str(e)}")
+        llm_metrics.record(call)
@@ -1,8 +1,14 @@
 import os
 import base64
 from io import BytesIO
-import google.generativeai as genai
+from typing import Optional
 from dotenv import load_dotenv
+from app.services.llm_executor import llm_executor
+from app.services.resilience import LLMUnavailableError, gemini_resilience
+from app.services.rate_limiter import rate_limiter, PRIORITY_IMAGE
+from app.services.llm_backend import LLMBackend, get_default_backend
+from app.services.model_router import model_router
+from app.services.llm_metrics import llm_metrics
 
 # Intentar importar PIL, si no está disponible, definir un flag
 PIL_AVAILABLE = False
@@ -16,23 +22,56 @@ except ImportError:
 # Cargar variables de entorno
 load_dotenv()
 
-# Verificar si la API de Gemini está configurada
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    print("⚠️ GEMINI_API_KEY no está configurada - Funcionalidad de IA limitada")
-else:
-    # Configurar la API de Gemini con la clave API
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        print("✅ API de Gemini configurada correctamente")
-        # Definir el modelo a utilizar (gemini-1.5-flash es multimodal)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-    except Exception as e:
-        print(f"❌ Error al configurar la API de Gemini: {str(e)}")
+# Backend de IA compartido con el generador de rutinas (gemini-1.5-flash es multimodal)
+backend = get_default_backend()
+
+# Verificar si el backend de IA está configurado
+GEMINI_CONFIGURED = backend.available
 
 class GeminiImageAnalyzer:
     """Servicio para analizar imágenes de ejercicios usando la API de Gemini"""
     
+    def __init__(self, backend: Optional[LLMBackend] = None):
+        self._backend = backend
+    
+    @property
+    def backend(self) -> LLMBackend:
+        """Backend inyectado o, si no hay, el backend por defecto del módulo"""
+        return self._backend if self._backend is not None else backend
+    
+    @property
+    def configured(self) -> bool:
+        """Indica si el backend puede atender peticiones"""
+        return GEMINI_CONFIGURED if self._backend is None else self._backend.available
+    
+    def _routed(self, operation: str) -> bool:
+        """Solo se enruta entre modelos con el cliente de Gemini por defecto (no con un backend inyectado)"""
+        return self._backend is None and isinstance(backend, LLMBackend) and backend.routable and operation in model_router.routes
+    
+    async def _generate(self, operation: str, prompt: str, image):
+        """
+        Llama al modelo que el enrutador asigna a la operación con el prompt y
+        la imagen, registrando la espera, la red y los tamaños
+        """
+        with llm_metrics.track(operation) as call:
+            call.set_prompt(prompt)
+            with call.phase("queue_wait"):
+                await rate_limiter.acquire(priority=PRIORITY_IMAGE)
+            call.source = "model"
+            call.model_calls += 1
+            model_backend = self.backend
+            on_attempt = None
+            if self._routed(operation):
+                model_backend = backend.for_model(model_router.choose(operation))
+                on_attempt = lambda seconds, ok: model_router.record(operation, model_backend.model_name, seconds, ok)
+            with call.phase("network"):
+                response = await gemini_resilience.call(
+                    lambda: llm_executor.run(model_backend.generate_content, [prompt, image]),
+                    on_attempt=on_attempt
+                )
+            call.set_response(response)
+            return response
+    
     async def analyze_exercise_image(self, image_data, exercise_name=None):
         """
         Analiza una imagen de un ejercicio y proporciona retroalimentación sobre la postura
@@ -49,7 +88,7 @@ class GeminiImageAnalyzer:
             return "Lo siento, la funcionalidad de análisis de imágenes está deshabilitada debido a que la biblioteca PIL (Pillow) no está instalada en el servidor."
         
         # Verificar si la API de Gemini está configurada
-        if not GEMINI_API_KEY:
+        if not self.configured:
             return "Lo siento, la funcionalidad de análisis de imágenes está deshabilitada porque no se ha configurado la API de Gemini."
         
         try:
@@ -137,11 +176,13 @@ class GeminiImageAnalyzer:
                 """
             
             # Generar el análisis con Gemini
-            response = model.generate_content([prompt, image])
+            response = await self._generate("analyze", prompt, image)
             
             # Devolver el resultado
             return response.text.strip()
             
+        except LLMUnavailableError as e:
+            return str(e)
         except Exception as e:
             print(f"Error al analizar la imagen con Gemini: {str(e)}")
             return "No se pudo analizar la imagen. Por favor, inténtalo de nuevo con una imagen más clara o desde otro ángulo."
@@ -161,7 +202,7 @@ class GeminiImageAnalyzer:
         if not PIL_AVAILABLE:
             return "Lo siento, la funcionalidad de análisis de imágenes está deshabilitada debido a que la biblioteca PIL (Pillow) no está instalada en el servidor."
         
-        if not GEMINI_API_KEY:
+        if not self.configured:
             return "Lo siento, la funcionalidad de análisis de imágenes está deshabilitada porque no se ha configurado la API de Gemini."
         
         try:
@@ -200,11 +241,13 @@ class GeminiImageAnalyzer:
                 """
             
             # Generar las sugerencias con Gemini
-            response = model.generate_content([prompt, image])
+            response = await self._generate("variations", prompt, image)
             
             # Devolver el resultado
             return response.text.strip()
             
+        except LLMUnavailableError as e:
+            return str(e)
         except Exception as e:
             print(f"Error al generar variaciones con Gemini: {str(e)}")
             return "No se pudieron generar variaciones. Por favor, inténtalo de nuevo con una imagen más clara."
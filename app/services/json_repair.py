@@ -0,0 +1,230 @@
+"""
+Extracción tolerante de JSON en respuestas del modelo.
+
+El modelo no siempre devuelve JSON limpio: añade texto antes o después,
+usa comillas tipográficas, deja comas finales o corta la respuesta antes de
+cerrar todos los corchetes. En lugar de descartar la respuesta (y obligar al
+usuario a pedir otra), este módulo localiza el objeto JSON más externo en una
+sola pasada lineal, repara los defectos habituales y ajusta los valores casi
+correctos al formato que espera `Exercise`.
+"""
+import re
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Comillas tipográficas que el modelo usa a veces como delimitadores
+SMART_OPEN_QUOTES = "“„‟"
+SMART_CLOSE_QUOTES = "”"
+SMART_QUOTES = SMART_OPEN_QUOTES + SMART_CLOSE_QUOTES
+
+DEFAULT_EQUIPMENT = "No especificado"
+
+_INT_PATTERN = re.compile(r"\d+")
+
+
+def _json_start(text: str) -> int:
+    """Posición del primer '{', priorizando el contenido de un bloque de código"""
+    fence = text.find("```")
+    if fence != -1:
+        start = text.find("{", fence)
+        if start != -1:
+            return start
+    return text.find("{")
+
+
+def _strip_trailing_comma(out: List[str]):
+    """Elimina una coma final (y los espacios que la siguen) antes de cerrar"""
+    end = len(out)
+    while end and out[end - 1] in " \t\r\n":
+        end -= 1
+    if end and out[end - 1] == ",":
+        del out[end - 1:]
+
+
+def repair_json(text: str) -> Optional[str]:
+    """
+    Recorre el texto una sola vez desde el primer '{' y devuelve el objeto
+    JSON más externo reparado, o None si no hay ningún objeto.
+
+    Reparaciones: texto alrededor, comillas tipográficas o simples como
+    delimitadores, comas finales y respuestas truncadas (se descarta el
+    último elemento incompleto y se cierran los corchetes abiertos).
+    """
+    start = _json_start(text)
+    if start == -1:
+        return None
+
+    out: List[str] = []
+    stack: List[str] = []
+    # Puntos seguros para truncar: (longitud de la salida, pila) tras cada
+    # elemento completo de una lista o campo completo del objeto raíz
+    safe_point: Optional[Tuple[int, List[str]]] = None
+    expect_key: List[bool] = []
+    in_string = False
+    string_quote = ""
+    escape = False
+    last_token = ""  # Tipo del último elemento completo: "value", "key", ":", ",", "open"
+
+    for index in range(start, len(text)):
+        char = text[index]
+
+        if in_string:
+            if escape:
+                escape = False
+                out.append(char)
+            elif char == "\\":
+                escape = True
+                out.append(char)
+            elif (string_quote == '"' and char == '"') or \
+                 (string_quote == "'" and char == "'") or \
+                 (string_quote == "smart" and char in SMART_QUOTES):
+                in_string = False
+                out.append('"')
+                is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+                last_token = "key" if is_key else "value"
+            elif char == '"' and string_quote != '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            else:
+                out.append(char)
+            continue
+
+        if char == '"' or char == "'" or char in SMART_QUOTES:
+            in_string = True
+            string_quote = "smart" if char in SMART_QUOTES else char
+            out.append('"')
+        elif char == "{" or char == "[":
+            stack.append(char)
+            expect_key.append(char == "{")
+            out.append(char)
+            last_token = "open"
+            if char == "[":
+                safe_point = (len(out), list(stack))
+        elif char == "}" or char == "]":
+            if not stack:
+                break
+            _strip_trailing_comma(out)
+            stack.pop()
+            expect_key.pop()
+            out.append("}" if char == "}" else "]")
+            last_token = "value"
+            if not stack:
+                return "".join(out)
+        elif char == ",":
+            _strip_trailing_comma(out)
+            # Dentro de una lista solo se conservan elementos completos: un
+            # ejercicio a medias no pasaría la validación
+            if last_token in ("value", "open") and (stack[-1:] == ["["] or "[" not in stack):
+                safe_point = (len(out), list(stack))
+            out.append(char)
+            if stack and stack[-1] == "{":
+                expect_key[-1] = True
+            last_token = ","
+        elif char == ":":
+            out.append(char)
+            if stack and stack[-1] == "{":
+                expect_key[-1] = False
+            last_token = ":"
+        else:
+            out.append(char)
+            if not char.isspace():
+                last_token = "value"
+
+    # Respuesta truncada: cerrar lo que quedó abierto
+    complete = not in_string and last_token in ("value", "open")
+    if not complete:
+        if safe_point is None:
+            return None
+        length, stack = safe_point
+        del out[length:]
+
+    _strip_trailing_comma(out)
+    for opener in reversed(stack):
+        out.append("}" if opener == "{" else "]")
+    return "".join(out)
+
+
+def extract_json(text: str) -> Any:
+    """
+    Extrae el objeto JSON de una respuesta del modelo. Primero prueba el
+    camino rápido (el JSON entre el primer '{' y el último '}') y, si falla,
+    la reparación completa. Devuelve {} si no se encuentra nada utilizable.
+    """
+    if not text:
+        return {}
+
+    start = _json_start(text)
+    end = text.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+
+    repaired = repair_json(text)
+    if repaired is None:
+        return {}
+    try:
+        return json.loads(repaired, strict=False)
+    except json.JSONDecodeError:
+        return {}
+
+
+def _first_int(value: Any) -> Any:
+    """Convierte "3-4", "4 series" o 3.0 en un entero (el primero que aparece)"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        match = _INT_PATTERN.search(value)
+        if match:
+            return int(match.group())
+    return value
+
+
+def _as_text(value: Any, unit: str = "") -> Any:
+    """Convierte números o listas en el texto que espera el modelo de datos"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        number = int(value) if float(value).is_integer() else value
+        return f"{number}{unit}"
+    if isinstance(value, list) and value and all(isinstance(v, (int, float, str)) for v in value):
+        return "-".join(str(v) for v in value)
+    return value
+
+
+def coerce_exercise(exercise: Any) -> Any:
+    """Ajusta los valores casi correctos de un ejercicio"""
+    if not isinstance(exercise, dict):
+        return exercise
+    if "sets" in exercise:
+        exercise["sets"] = _first_int(exercise["sets"])
+    if "reps" in exercise:
+        exercise["reps"] = _as_text(exercise["reps"])
+    if "rest" in exercise:
+        exercise["rest"] = _as_text(exercise["rest"], " seg")
+    if exercise.get("equipment") in (None, ""):
+        exercise["equipment"] = DEFAULT_EQUIPMENT
+    return exercise
+
+
+def coerce_day(day: Any) -> Any:
+    """Ajusta los valores casi correctos de un día y sus ejercicios"""
+    if not isinstance(day, dict):
+        return day
+    for field in ("day_name", "focus"):
+        if isinstance(day.get(field), (int, float)):
+            day[field] = str(day[field])
+    if isinstance(day.get("exercises"), list):
+        day["exercises"] = [coerce_exercise(exercise) for exercise in day["exercises"]]
+    return day
+
+
+def coerce_routine_dict(routine_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """Ajusta una rutina antes de `Routine.model_validate`"""
+    if isinstance(routine_dict.get("days"), list):
+        routine_dict["days"] = [coerce_day(day) for day in routine_dict["days"]]
+    return routine_dict
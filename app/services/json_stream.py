@@ -0,0 +1,151 @@
+"""
+Parser JSON incremental para respuestas de rutinas recibidas por streaming.
+
+El modelo devuelve la rutina en fragmentos de texto. En lugar de esperar a la
+respuesta completa, este parser consume cada fragmento una sola vez y emite
+los elementos de `days[]` en cuanto su objeto JSON queda cerrado, de modo que
+el cliente puede mostrarlos antes de que termine la generación.
+"""
+import json
+from typing import Any, List, Optional, Tuple
+
+# Eventos emitidos por el parser: ("routine_name", str) o ("day", dict)
+ParserEvent = Tuple[str, Any]
+
+
+class _Frame:
+    """Contenedor JSON abierto (objeto o lista) durante el análisis"""
+    __slots__ = ("kind", "key", "expect_key", "is_days")
+
+    def __init__(self, kind: str, is_days: bool = False):
+        self.kind = kind
+        self.key: Optional[str] = None
+        self.expect_key = kind == "{"
+        self.is_days = is_days
+
+
+class IncrementalRoutineParser:
+    """Analiza el JSON de una rutina a medida que llegan los fragmentos"""
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._started = False
+        self._finished = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._item_start: Optional[int] = None
+        self._days_seen = False
+        self.days_emitted = 0
+
+    @property
+    def finished(self) -> bool:
+        """Indica si el objeto raíz ya se ha cerrado"""
+        return self._finished
+
+    def feed(self, chunk: str) -> List[ParserEvent]:
+        """Añade un fragmento de texto y devuelve los eventos completados"""
+        self.buffer += chunk
+        events: List[ParserEvent] = []
+        buf = self.buffer
+        end = len(buf)
+        pos = self._pos
+
+        while pos < end and not self._finished:
+            char = buf[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._on_string(buf[self._string_start:pos + 1], events)
+                pos += 1
+                continue
+
+            if not self._started:
+                # Ignorar el texto o las vallas de código previas al JSON
+                if char == "{":
+                    self._started = True
+                    self._stack.append(_Frame("{"))
+                pos += 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char == "{" or char == "[":
+                self._open(char, pos)
+            elif char == "}" or char == "]":
+                self._close(pos, events)
+            elif char == ":":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].expect_key = False
+            elif char == ",":
+                if self._stack and self._stack[-1].kind == "{":
+                    self._stack[-1].expect_key = True
+            pos += 1
+
+        self._pos = pos
+        return events
+
+    def _open(self, char: str, pos: int):
+        """Abre un nuevo contenedor"""
+        parent = self._stack[-1] if self._stack else None
+        is_days = (
+            char == "["
+            and not self._days_seen
+            and parent is not None
+            and parent.kind == "{"
+            and parent.key == "days"
+        )
+        if is_days:
+            self._days_seen = True
+        elif char == "{" and parent is not None and parent.is_days:
+            self._item_start = pos
+        self._stack.append(_Frame(char, is_days=is_days))
+
+    def _close(self, pos: int, events: List[ParserEvent]):
+        """Cierra el contenedor actual y emite el día si corresponde"""
+        if not self._stack:
+            return
+        self._stack.pop()
+
+        if not self._stack:
+            self._finished = True
+            return
+
+        parent = self._stack[-1]
+        if parent.is_days and self._item_start is not None:
+            raw_day = self.buffer[self._item_start:pos + 1]
+            self._item_start = None
+            try:
+                events.append(("day", json.loads(raw_day)))
+                self.days_emitted += 1
+            except json.JSONDecodeError:
+                # El día completo se validará de nuevo al final de la respuesta
+                pass
+
+    def _on_string(self, raw: str, events: List[ParserEvent]):
+        """Procesa una cadena completa (clave o valor)"""
+        if not self._stack or self._stack[-1].kind != "{":
+            return
+        frame = self._stack[-1]
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+
+        if frame.expect_key:
+            frame.key = value
+        elif frame.key == "routine_name" and not self._inside_days():
+            events.append(("routine_name", value))
+
+    def _inside_days(self) -> bool:
+        """Indica si el cursor está dentro de la lista de días"""
+        return any(frame.is_days for frame in self._stack)
+
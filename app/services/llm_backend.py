@@ -0,0 +1,516 @@
+"""
+Backends de modelo de lenguaje intercambiables.
+
+Los servicios de IA no dependen directamente del SDK de Gemini sino de un
+backend con la misma interfaz mínima que `GenerativeModel`:
+`generate_content(contents, stream=False)` devuelve un objeto con `.text` o,
+en streaming, un iterable de fragmentos con `.text`. Las llamadas son
+bloqueantes, igual que en el SDK, y se ejecutan en `llm_executor`.
+
+El cliente de Gemini se crea de forma perezosa en la primera llamada y hay
+uno por proceso y modelo (`get_gemini_backend`), compartido por todos los
+servicios. Con `GEMINI_WARMUP=true` la conexión se abre en segundo plano al
+arrancar cada worker. Cada llamada usa una clave del pool de claves (ver
+`api_key_pool`) y cada clave tiene su propio `GenerativeServiceClient` (y su
+canal gRPC), compartido por todos los modelos y creado una sola vez, así que
+no se toca estado privado ni global del SDK.
+
+`LLM_BACKEND=fake` sustituye Gemini por un backend local determinista que
+devuelve rutinas válidas con la latencia, la tasa de errores y el ritmo de
+tokens configurados, para hacer pruebas de carga sin gastar cuota.
+`LLM_BACKEND=replay` reproduce llamadas grabadas con `LLM_CASSETTE_RECORD=true`
+(ver `cassette`).
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from app.services.api_key_pool import ApiKeyPool, ApiKeyState, api_key_pool
+from app.services.resilience import GEMINI_TIMEOUT, GEMINI_TOTAL_TIMEOUT
+
+load_dotenv()
+
+# Backend utilizado por los servicios: "gemini", "fake" o "replay"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+
+# Modelo de Gemini utilizado por los servicios
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# Abrir la conexión con Gemini en segundo plano al arrancar el worker
+GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "false").lower() == "true"
+
+# Parámetros del backend falso
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.8"))  # Mediana hasta el primer token (s)
+FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.4"))  # Dispersión log-normal
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "250"))  # 0 = sin límite
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED")
+
+# Caracteres por token aproximados para simular el ritmo de generación
+CHARS_PER_TOKEN = 4
+
+# Tokens por fragmento en las respuestas en streaming
+FAKE_CHUNK_TOKENS = 16
+
+
+class LLMBackend:
+    """Interfaz de los backends: misma forma que `GenerativeModel` del SDK"""
+
+    name = "base"
+    model_name = ""
+
+    @property
+    def available(self) -> bool:
+        """Indica si el backend puede atender peticiones"""
+        return False
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs) -> Any:
+        """Genera la respuesta (bloqueante). En streaming devuelve un iterable de fragmentos"""
+        raise NotImplementedError("Este método debe ser implementado por un backend concreto")
+
+    def warm_up(self):
+        """Prepara la conexión antes de la primera petición (bloqueante)"""
+
+    @property
+    def routable(self) -> bool:
+        """Indica si el enrutador puede cambiar el modelo de este backend"""
+        return False
+
+    def for_model(self, model_name: str) -> "LLMBackend":
+        """Mismo backend con el modelo que elige el enrutador"""
+        raise NotImplementedError("Este backend no permite cambiar de modelo")
+
+
+# Clientes del servicio de generación, uno por clave y proceso
+_key_clients_lock = threading.Lock()
+_key_clients: Dict[str, Any] = {}
+
+
+def _key_client(api_key: str):
+    """Cliente del servicio de generación autenticado con la clave indicada"""
+    from google.ai import generativelanguage as glm
+    with _key_clients_lock:
+        key_client = _key_clients.get(api_key)
+        if key_client is None:
+            key_client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+            _key_clients[api_key] = key_client
+            print(f"✅ Cliente de Gemini creado para la clave …{api_key[-4:]}")
+    return key_client
+
+
+class GeminiKeyModel:
+    """
+    Modelo de Gemini ligado a una clave: misma interfaz que `GenerativeModel`
+    del SDK, pero con el cliente de la clave en lugar del cliente global, de
+    modo que dos hilos con claves distintas nunca comparten estado.
+    """
+
+    def __init__(self, model_name: str, client: Any):
+        self.model_name = model_name if "/" in model_name else f"models/{model_name}"
+        self.client = client
+
+    def generate_content(self, contents: Any, stream: bool = False, timeout: Optional[float] = None) -> Any:
+        """Genera la respuesta; `timeout` es el plazo de la petición gRPC (todo el stream en streaming)"""
+        from google.ai import generativelanguage as glm
+        from google.generativeai.types import content_types, generation_types
+        request = glm.GenerateContentRequest(model=self.model_name, contents=content_types.to_contents(contents))
+        options = {"timeout": timeout} if timeout else {}
+        if stream:
+            with generation_types.rewrite_stream_error():
+                iterator = self.client.stream_generate_content(request, **options)
+            return generation_types.GenerateContentResponse.from_iterator(iterator)
+        response = self.client.generate_content(request, **options)
+        return generation_types.GenerateContentResponse.from_response(response)
+
+    def count_tokens(self, contents: Any) -> Any:
+        from google.ai import generativelanguage as glm
+        from google.generativeai.types import content_types
+        return self.client.count_tokens(
+            glm.CountTokensRequest(model=self.model_name, contents=content_types.to_contents(contents))
+        )
+
+
+def text_chars(contents: Any) -> int:
+    """Caracteres de texto de un prompt (las imágenes no cuentan)"""
+    if isinstance(contents, str):
+        return len(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(len(part) for part in contents if isinstance(part, str))
+    return 0
+
+
+def _response_tokens(contents: Any, response: Any) -> int:
+    """Tokens de una llamada: los que informa el SDK o, si no, una estimación"""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    if isinstance(total, int) and total > 0:
+        return total
+    try:
+        text = response.text
+    except (AttributeError, ValueError):
+        text = ""
+    response_chars = len(text) if isinstance(text, str) else 0
+    return (text_chars(contents) + response_chars) // CHARS_PER_TOKEN
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Backend real: delega en `google.generativeai`. El modelo de cada clave se
+    crea en la primera llamada que la usa, no al importar el módulo, para no
+    retrasar el arranque de los workers que nunca llaman a la API.
+    """
+
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME, api_key: Optional[str] = None,
+                 key_pool: Optional[ApiKeyPool] = None, timeout: float = GEMINI_TIMEOUT,
+                 stream_timeout: float = GEMINI_TOTAL_TIMEOUT):
+        self.model_name = model_name
+        # Plazos de la petición al SDK: el hilo del pool termina aunque nadie espere ya la respuesta
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
+        # Una clave explícita forma su propio pool; si no, se usa el pool compartido del proceso
+        self.key_pool = key_pool or (ApiKeyPool([api_key]) if api_key else api_key_pool)
+        self._models: Dict[str, Any] = {}
+        self._failed = False
+        self._lock = threading.Lock()
+        if not self.key_pool.keys:
+            print("⚠️ GEMINI_API_KEY no encontrada, servicio de IA no estará disponible")
+
+    @property
+    def available(self) -> bool:
+        return bool(self.key_pool.keys) and not self._failed
+
+    @property
+    def initialized(self) -> bool:
+        """Indica si el cliente ya se ha creado"""
+        return bool(self._models)
+
+    @property
+    def routable(self) -> bool:
+        return True
+
+    def for_model(self, model_name: str) -> LLMBackend:
+        return get_gemini_backend(model_name)
+
+    def _get_model(self, api_key: Optional[str] = None):
+        """
+        Modelo de la clave indicada (por defecto la primera del pool), creado la
+        primera vez que se necesita desde cualquier hilo del pool de llamadas
+        """
+        if not self.available:
+            raise RuntimeError("API de Gemini no está configurada")
+        api_key = api_key or self.key_pool.keys[0]
+        model = self._models.get(api_key)
+        if model is None:
+            with self._lock:
+                model = self._models.get(api_key)
+                if model is None:
+                    try:
+                        model = GeminiKeyModel(self.model_name, _key_client(api_key))
+                    except Exception as e:
+                        print(f"❌ Error al configurar Gemini API: {str(e)}")
+                        self._failed = True
+                        raise
+                    self._models[api_key] = model
+        return model
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs) -> Any:
+        key = self.key_pool.acquire()
+        try:
+            kwargs.setdefault("timeout", self.stream_timeout if stream else self.timeout)
+            response = self._get_model(key.api_key).generate_content(contents, stream=stream, **kwargs)
+        except Exception as e:
+            self.key_pool.release(key, error=e)
+            raise
+        if stream:
+            return self._account_stream(key, contents, response)
+        self.key_pool.release(key, tokens=_response_tokens(contents, response))
+        return response
+
+    def _account_stream(self, key: ApiKeyState, contents: Any, chunks: Any) -> Iterator[Any]:
+        """Entrega los fragmentos y, al terminar, anota en la clave los tokens estimados"""
+        response_chars = 0
+        error: Optional[BaseException] = None
+        try:
+            for chunk in chunks:
+                try:
+                    response_chars += len(chunk.text)
+                except (AttributeError, ValueError, TypeError):
+                    pass
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            tokens = (text_chars(contents) + response_chars) // CHARS_PER_TOKEN
+            self.key_pool.release(key, tokens=tokens, error=error)
+
+    def warm_up(self):
+        """Crea el modelo y abre el canal con una llamada que no consume cuota de generación"""
+        if not self.available:
+            return
+        start = time.monotonic()
+        try:
+            self._get_model().count_tokens("ping")
+            print(f"🔥 Conexión con Gemini preparada en {time.monotonic() - start:.2f}s")
+        except Exception as e:
+            print(f"⚠️ No se pudo preparar la conexión con Gemini: {str(e)}")
+
+
+class FakeBackendError(Exception):
+    """Error simulado de la API (503, reintentable)"""
+
+    code = 503
+
+
+class FakeResponse:
+    """Respuesta o fragmento del backend falso, con la interfaz `.text` del SDK"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+# Ejercicios del backend falso por enfoque: (nombre, equipamiento)
+FAKE_EXERCISES = {
+    "Pecho y tríceps": [("Press de banca", "Barra y banco"), ("Aperturas con mancuernas", "Mancuernas"),
+                        ("Fondos en paralelas", "Paralelas"), ("Extensión de tríceps en polea", "Polea")],
+    "Espalda y bíceps": [("Dominadas", "Barra de dominadas"), ("Remo con barra", "Barra"),
+                         ("Jalón al pecho", "Polea"), ("Curl de bíceps", "Mancuernas")],
+    "Piernas": [("Sentadilla", "Barra"), ("Peso muerto rumano", "Barra"),
+                ("Prensa de piernas", "Máquina de prensa"), ("Zancadas", "Mancuernas")],
+    "Hombros y core": [("Press militar", "Barra"), ("Elevaciones laterales", "Mancuernas"),
+                       ("Plancha", "Ninguno"), ("Rueda abdominal", "Rueda abdominal")]
+}
+FAKE_DAY_NAMES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+
+class FakeBackend(LLMBackend):
+    """
+    Backend local determinista: la misma petición produce siempre la misma
+    respuesta. La latencia hasta el primer token sigue una log-normal y el
+    resto de la respuesta llega al ritmo de tokens configurado.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: float = FAKE_LLM_LATENCY,
+        latency_sigma: float = FAKE_LLM_LATENCY_SIGMA,
+        error_rate: float = FAKE_LLM_ERROR_RATE,
+        tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+        seed: Optional[int] = int(FAKE_LLM_SEED) if FAKE_LLM_SEED else None,
+        model_name: str = "fake-routine-model"
+    ):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self.model_name = model_name
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs) -> Any:
+        self.calls += 1
+        text = self.respond(contents)
+        if stream:
+            return self._stream(text)
+
+        self._wait_first_token()
+        self._sleep(self._generation_time(len(text) / CHARS_PER_TOKEN))
+        return FakeResponse(text)
+
+    def _wait_first_token(self):
+        """Latencia hasta el primer token y error simulado"""
+        if self.latency > 0:
+            self._sleep(self._random.lognormvariate(0, self.latency_sigma) * self.latency)
+        if self._random.random() < self.error_rate:
+            raise FakeBackendError("Error simulado del backend falso (503)")
+
+    def _stream(self, text: str) -> Iterator[FakeResponse]:
+        self._wait_first_token()
+        size = FAKE_CHUNK_TOKENS * CHARS_PER_TOKEN
+        for start in range(0, len(text), size):
+            if start:
+                self._sleep(self._generation_time(FAKE_CHUNK_TOKENS))
+            yield FakeResponse(text[start:start + size])
+
+    def _generation_time(self, tokens: float) -> float:
+        """Tiempo que tarda en generarse el número de tokens indicado"""
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    @staticmethod
+    def _sleep(seconds: float):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # --- Contenido de las respuestas ---
+
+    def respond(self, contents: Any) -> str:
+        """Texto de la respuesta según el tipo de prompt"""
+        if not isinstance(contents, str):
+            # Prompt con imagen (análisis de ejercicios)
+            return ("La postura es correcta en general. Mantén la espalda neutra, "
+                    "controla la bajada y evita bloquear las articulaciones al final del movimiento.")
+
+        current = self._current_routine(contents)
+        if '"operations"' in contents and current is not None:
+            return json.dumps(self._patch(current), ensure_ascii=False)
+        if current is not None:
+            routine = self._modified(current)
+            if '"explanation"' in contents:
+                return json.dumps({"routine": routine, "explanation": "He ajustado las series del primer ejercicio."},
+                                  ensure_ascii=False)
+            return json.dumps(routine, ensure_ascii=False)
+        if "Día a completar:" in contents:
+            return json.dumps(self._skeleton_day(contents), ensure_ascii=False)
+        day = self._current_day(contents)
+        if day is not None:
+            return json.dumps(self._modified_day(day), ensure_ascii=False)
+        if '"routine_name"' in contents:
+            return "```json\n" + json.dumps(self._routine(contents), ensure_ascii=False, indent=2) + "\n```"
+        return "He revisado los cambios: la rutina mantiene el equilibrio entre grupos musculares. ¡Sigue así!"
+
+    @staticmethod
+    def _current_routine(prompt: str) -> Optional[Dict[str, Any]]:
+        """Rutina actual incluida en un prompt de modificación"""
+        match = re.search(r"```json\s*(\{.*?\})\s*```", prompt, re.S)
+        if not match:
+            return None
+        try:
+            routine = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            return None
+        return routine if isinstance(routine, dict) and isinstance(routine.get("days"), list) else None
+
+    @staticmethod
+    def _current_day(prompt: str) -> Optional[Dict[str, Any]]:
+        """Día incluido en un prompt de modificación de un solo día"""
+        match = re.search(r"```json\s*(\{.*?\})\s*```", prompt, re.S)
+        if not match:
+            return None
+        try:
+            day = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            return None
+        return day if isinstance(day, dict) and isinstance(day.get("exercises"), list) else None
+
+    @staticmethod
+    def _modified_day(day: Dict[str, Any]) -> Dict[str, Any]:
+        """El día con una serie más en su primer ejercicio"""
+        day = json.loads(json.dumps(day))
+        if day["exercises"]:
+            sets = day["exercises"][0].get("sets", 3)
+            day["exercises"][0]["sets"] = (sets if isinstance(sets, int) else 3) + 1
+        return day
+
+    @staticmethod
+    def _patch(routine: Dict[str, Any]) -> Dict[str, Any]:
+        """Parche mínimo: una serie más en el primer ejercicio"""
+        operations: List[Dict[str, Any]] = []
+        days = routine.get("days") or []
+        if days and days[0].get("exercises"):
+            sets = days[0]["exercises"][0].get("sets", 3)
+            operations.append({"op": "replace", "path": "/days/0/exercises/0/sets",
+                               "value": (sets if isinstance(sets, int) else 3) + 1})
+        return {"operations": operations, "explanation": "He añadido una serie al primer ejercicio."}
+
+    def _modified(self, routine: Dict[str, Any]) -> Dict[str, Any]:
+        """Rutina completa con el mismo cambio que el parche"""
+        routine = json.loads(json.dumps(routine))
+        for operation in self._patch(routine)["operations"]:
+            routine["days"][0]["exercises"][0]["sets"] = operation["value"]
+        return routine
+
+    @staticmethod
+    def _skeleton_day(prompt: str) -> Dict[str, Any]:
+        """Ejercicios deterministas para un día de una estructura ya planificada"""
+        match = re.search(r"Día a completar: (.+) \((.+)\)", prompt)
+        day_name, focus = match.groups() if match else ("Lunes", "General")
+        focuses = list(FAKE_EXERCISES)
+        seed = int(hashlib.sha256(focus.encode("utf-8")).hexdigest()[:8], 16)
+        exercises = FAKE_EXERCISES.get(focus) or FAKE_EXERCISES[focuses[seed % len(focuses)]]
+        return {
+            "day_name": day_name,
+            "focus": focus,
+            "exercises": [{"name": name, "sets": 3, "reps": "8-12", "rest": "60-90 seg", "equipment": equipment}
+                          for name, equipment in exercises]
+        }
+
+    @staticmethod
+    def _routine(prompt: str) -> Dict[str, Any]:
+        """Rutina nueva determinista a partir del prompt"""
+        match = re.search(r"exactamente (\d+) días", prompt) or re.search(r"(\d+) días a la semana", prompt)
+        days = max(1, min(7, int(match.group(1)))) if match else 3
+        goals = re.search(r"Objetivos: (.+)", prompt)
+        goal = goals.group(1).strip() if goals else "General"
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        focuses = list(FAKE_EXERCISES)
+
+        routine_days = []
+        for index in range(days):
+            focus = focuses[(seed + index) % len(focuses)]
+            routine_days.append({
+                "day_name": FAKE_DAY_NAMES[index],
+                "focus": focus,
+                "exercises": [
+                    {"name": name, "sets": 3 + (seed + index + position) % 2, "reps": "8-12",
+                     "rest": "60-90 seg", "equipment": equipment}
+                    for position, (name, equipment) in enumerate(FAKE_EXERCISES[focus])
+                ]
+            })
+        return {"routine_name": f"Rutina de {goal} ({days} días)", "days": routine_days}
+
+
+# Registro de clientes de Gemini del proceso, uno por modelo
+_gemini_backends: Dict[str, GeminiBackend] = {}
+_registry_lock = threading.Lock()
+
+
+def get_gemini_backend(model_name: str = GEMINI_MODEL_NAME) -> GeminiBackend:
+    """Cliente de Gemini compartido del modelo indicado"""
+    with _registry_lock:
+        gemini_backend = _gemini_backends.get(model_name)
+        if gemini_backend is None:
+            gemini_backend = GeminiBackend(model_name)
+            _gemini_backends[model_name] = gemini_backend
+        return gemini_backend
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    """Crea el backend indicado (por defecto el de `LLM_BACKEND`)"""
+    from app.services.cassette import LLM_CASSETTE_RECORD, RecordingBackend, ReplayBackend
+    name = (name or LLM_BACKEND).lower()
+    if name == "replay":
+        print("📼 Reproduciendo llamadas grabadas (LLM_BACKEND=replay)")
+        return ReplayBackend()
+    if name == "fake":
+        print("🧪 Usando el backend de IA falso (LLM_BACKEND=fake)")
+        selected: LLMBackend = FakeBackend()
+    else:
+        selected = get_gemini_backend()
+    if LLM_CASSETTE_RECORD:
+        print("📼 Grabando las llamadas al modelo en la cassette (LLM_CASSETTE_RECORD=true)")
+        return RecordingBackend(selected)
+    return selected
+
+
+_default_backend: Optional[LLMBackend] = None
+
+
+def get_default_backend() -> LLMBackend:
+    """Backend compartido por los servicios de IA del proceso"""
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = create_backend()
+    return _default_backend
@@ -0,0 +1,150 @@
+"""
+Ejecución no bloqueante de las llamadas síncronas al SDK de Gemini.
+
+`model.generate_content` es bloqueante: si se llama directamente desde una
+corrutina congela el bucle de eventos del worker de uvicorn mientras dura la
+petición. Este módulo delega esas llamadas en un pool de hilos dedicado y
+acotado, y limita cuántas llamadas simultáneas admite cada worker.
+
+Un hilo no se puede interrumpir: si quien espera la llamada se cancela (plazo
+agotado o petición duplicada perdedora) el hilo sigue hasta que el SDK
+responde o agota su propio `timeout`. Por eso el permiso de concurrencia se
+libera cuando termina el hilo y no cuando se cancela la espera, y un stream
+abandonado deja de leer fragmentos en cuanto llega el siguiente.
+"""
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable
+
+# Número máximo de llamadas simultáneas a la API de IA por worker
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+
+class _StreamError:
+    """Envuelve una excepción producida en el hilo de streaming"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class LLMExecutor:
+    """Pool de hilos acotado para ejecutar llamadas bloqueantes al modelo"""
+
+    def __init__(self, max_concurrency: int = GEMINI_MAX_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="gemini"
+        )
+        # Los semáforos se crean por bucle de eventos (en Python 3.9 quedan
+        # ligados al bucle activo al crearse)
+        self._semaphores: Dict[int, asyncio.Semaphore] = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Obtiene el semáforo asociado al bucle de eventos en ejecución"""
+        loop_id = id(asyncio.get_running_loop())
+        semaphore = self._semaphores.get(loop_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop_id] = semaphore
+        return semaphore
+
+    def _finish(self, semaphore: asyncio.Semaphore):
+        """El hilo terminó: se devuelve su permiso"""
+        self.in_flight -= 1
+        self.completed += 1
+        semaphore.release()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Ejecuta `func` en el pool sin bloquear el bucle de eventos. El permiso
+        se mantiene hasta que el hilo termina aunque se cancele la espera.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
+
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._finish(semaphore)
+            raise
+
+        def finished(_):
+            try:
+                loop.call_soon_threadsafe(self._finish, semaphore)
+            except RuntimeError:
+                # El bucle ya se cerró (fin del proceso o de una prueba)
+                pass
+
+        future.add_done_callback(finished)
+        return await asyncio.wrap_future(future, loop=loop)
+
+    async def stream(self, func: Callable[..., Iterable[Any]], *args, **kwargs) -> AsyncIterator[Any]:
+        """
+        Ejecuta en el pool una función que devuelve un iterable bloqueante
+        (p. ej. una respuesta en streaming del SDK) y entrega cada elemento
+        al bucle de eventos en cuanto está disponible.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        # El consumidor ya no quiere más fragmentos (terminó, falló o se canceló)
+        stopped = threading.Event()
+
+        def produce():
+            items = None
+            try:
+                items = func(*args, **kwargs)
+                for item in items:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, _StreamError(e))
+            finally:
+                if stopped.is_set() and hasattr(items, "close"):
+                    items.close()
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, done)
+                except RuntimeError:
+                    pass
+
+        producer = asyncio.ensure_future(self.run(produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, _StreamError):
+                    raise item.error
+                yield item
+        finally:
+            stopped.set()
+            if producer.done() and not producer.cancelled():
+                producer.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Devuelve el estado actual del pool"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed
+        }
+
+
+# Instancia compartida por todos los servicios de IA del worker
+llm_executor = LLMExecutor()
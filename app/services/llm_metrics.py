@@ -0,0 +1,334 @@
+"""
+Instrumentación de las llamadas al modelo.
+
+Cada operación de IA (crear, modificar, explicar, analizar una imagen o
+sugerir variaciones) registra en qué se le va el tiempo: espera en la cola del
+limitador, tiempo de red del modelo, extracción del JSON y validación con
+Pydantic, junto con el tamaño del prompt y de la respuesta (caracteres y
+tokens) y el resultado. Los registros se agregan en histogramas en memoria por
+operación que se consultan en `/api/llm/metrics`.
+"""
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+from pydantic import ValidationError
+from app.services.resilience import LLMUnavailableError
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.llm_backend import CHARS_PER_TOKEN, text_chars
+
+LLM_METRICS_ENABLED = os.getenv("LLM_METRICS_ENABLED", "true").lower() == "true"
+
+# Escribir una línea con el desglose de tiempos de cada llamada
+LLM_METRICS_LOG = os.getenv("LLM_METRICS_LOG", "true").lower() == "true"
+
+# Límites superiores de los buckets de los histogramas
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 90)  # segundos
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)  # caracteres o tokens
+
+# Fases medidas en cada operación
+PHASES = ("queue_wait", "network", "first_chunk", "json_extraction", "validation", "total")
+
+# Resultado de una operación que falla según la fase en la que falló
+PHASE_OUTCOMES = {
+    "queue_wait": "rate_limited",
+    "network": "network_error",
+    "json_extraction": "parse_error",
+    "validation": "validation_error"
+}
+
+
+class Histogram:
+    """Histograma de buckets fijos con recuento, suma, mínimo y máximo"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Límite superior del bucket que contiene el percentil (acotado al máximo observado)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        def rounded(value: Optional[float]) -> Optional[float]:
+            return round(value, 4) if value is not None else None
+
+        buckets = {f"le_{bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": rounded(self.total),
+            "avg": rounded(self.total / self.count) if self.count else None,
+            "min": rounded(self.min),
+            "max": rounded(self.max),
+            "p50": rounded(self.percentile(0.5)),
+            "p90": rounded(self.percentile(0.9)),
+            "p99": rounded(self.percentile(0.99)),
+            "buckets": buckets
+        }
+
+
+class LLMCall:
+    """Desglose de tiempos y tamaños de una operación de IA"""
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.prompt_chars = 0
+        self.response_chars = 0
+        self.prompt_tokens: Optional[int] = None
+        self.response_tokens: Optional[int] = None
+        # "model" (llamada propia), "cache" o "shared" (llamada idéntica en curso)
+        self.source: Optional[str] = None
+        self.model_calls = 0
+        self.outcome: Optional[str] = None
+        self.failed_phase: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+    def add(self, phase: str, seconds: float):
+        """Acumula tiempo en una fase (una operación puede llamar varias veces al modelo)"""
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator["LLMCall"]:
+        """Mide el bloque como parte de la fase indicada"""
+        start = time.perf_counter()
+        try:
+            yield self
+        except BaseException:
+            self.failed_phase = name
+            raise
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    async def timed(self, name: str, chunks: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        """Itera los fragmentos acumulando en la fase el tiempo de espera de cada uno"""
+        iterator = chunks.__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            except BaseException:
+                self.add(name, time.perf_counter() - start)
+                self.failed_phase = name
+                raise
+            self.add(name, time.perf_counter() - start)
+            if "first_chunk" not in self.timings:
+                self.timings["first_chunk"] = time.perf_counter() - self.started
+            yield chunk
+
+    def fail(self, phase: str):
+        """Marca la fase en la que falló la operación aunque no se lance una excepción"""
+        self.failed_phase = phase
+
+    def set_prompt(self, contents: Any):
+        self.prompt_chars += text_chars(contents)
+
+    def set_response(self, response: Any):
+        """Tamaño de la respuesta y, si el SDK lo informa, tokens reales"""
+        if isinstance(response, str):
+            text = response
+        else:
+            try:
+                text = response.text
+            except (AttributeError, ValueError):
+                text = ""
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                prompt_tokens = getattr(usage, "prompt_token_count", None)
+                response_tokens = getattr(usage, "candidates_token_count", None)
+                if isinstance(prompt_tokens, int):
+                    self.prompt_tokens = (self.prompt_tokens or 0) + prompt_tokens
+                if isinstance(response_tokens, int):
+                    self.response_tokens = (self.response_tokens or 0) + response_tokens
+        self.response_chars += len(text) if isinstance(text, str) else 0
+
+    def tokens(self) -> Dict[str, int]:
+        """Tokens del prompt y de la respuesta (estimados si el SDK no los informa)"""
+        return {
+            "prompt": self.prompt_tokens if self.prompt_tokens is not None else self.prompt_chars // CHARS_PER_TOKEN,
+            "response": (self.response_tokens if self.response_tokens is not None
+                         else self.response_chars // CHARS_PER_TOKEN)
+        }
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Cierra la operación: tiempo total y resultado"""
+        self.timings["total"] = time.perf_counter() - self.started
+        error = error or self.error
+        if self.outcome is not None:
+            return
+        if error is None:
+            self.outcome = {"cache": "cache_hit", "similar": "similar_hit", "shared": "shared", "offline": "offline"}.get(self.source, "ok")
+        elif isinstance(error, RateLimitExceeded):
+            self.outcome = "rate_limited"
+        elif isinstance(error, LLMUnavailableError):
+            self.outcome = "unavailable"
+        elif isinstance(error, ValidationError):
+            self.outcome = "validation_error"
+        else:
+            self.outcome = PHASE_OUTCOMES.get(self.failed_phase, "error")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "operation": self.operation,
+            "outcome": self.outcome,
+            "source": self.source,
+            "model_calls": self.model_calls,
+            "timings": {phase: round(seconds, 4) for phase, seconds in self.timings.items()},
+            "prompt_chars": self.prompt_chars,
+            "response_chars": self.response_chars,
+            "tokens": self.tokens()
+        }
+
+
+class _OperationStats:
+    """Histogramas agregados de una operación"""
+
+    def __init__(self):
+        self.calls = 0
+        self.model_calls = 0
+        self.outcomes: Dict[str, int] = {}
+        self.timings = {phase: Histogram(TIME_BUCKETS) for phase in PHASES}
+        self.sizes = {name: Histogram(SIZE_BUCKETS)
+                      for name in ("prompt_chars", "response_chars", "prompt_tokens", "response_tokens")}
+
+    def observe(self, call: LLMCall):
+        self.calls += 1
+        self.model_calls += call.model_calls
+        self.outcomes[call.outcome] = self.outcomes.get(call.outcome, 0) + 1
+        for phase, seconds in call.timings.items():
+            self.timings[phase].observe(seconds)
+        if call.prompt_chars:
+            tokens = call.tokens()
+            self.sizes["prompt_chars"].observe(call.prompt_chars)
+            self.sizes["prompt_tokens"].observe(tokens["prompt"])
+            if call.response_chars:
+                self.sizes["response_chars"].observe(call.response_chars)
+                self.sizes["response_tokens"].observe(tokens["response"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "model_calls": self.model_calls,
+            "outcomes": dict(self.outcomes),
+            "timings": {phase: histogram.to_dict() for phase, histogram in self.timings.items() if histogram.count},
+            "sizes": {name: histogram.to_dict() for name, histogram in self.sizes.items() if histogram.count}
+        }
+
+
+# Operación en curso de la tarea actual
+_current_call: contextvars.ContextVar = contextvars.ContextVar("llm_call", default=None)
+
+
+def current_llm_call() -> LLMCall:
+    """Operación en curso o, si no hay ninguna, un registro que no se agrega"""
+    call = _current_call.get()
+    return call if call is not None else LLMCall("untracked")
+
+
+@contextmanager
+def use_llm_call(call: LLMCall) -> Iterator[LLMCall]:
+    """
+    Deja `call` como operación en curso dentro del bloque, sin registrarla al
+    salir. Sirve para las tareas y generadores que trabajan para una operación
+    iniciada en otro sitio (p. ej. con `LLMMetrics.start`).
+    """
+    token = _current_call.set(call)
+    try:
+        yield call
+    finally:
+        _current_call.reset(token)
+
+
+class LLMMetrics:
+    """Registro de las operaciones de IA del worker agregado por operación"""
+
+    def __init__(self, enabled: bool = LLM_METRICS_ENABLED, log: bool = LLM_METRICS_LOG):
+        self.enabled = enabled
+        self.log = log
+        self._operations: Dict[str, _OperationStats] = {}
+
+    @contextmanager
+    def track(self, operation: str) -> Iterator[LLMCall]:
+        """
+        Registra el bloque como una operación y la deja como operación en curso.
+        Si ya hay una operación del mismo tipo en curso (p. ej. una modificación
+        que recurre a otro modo) se reutiliza en lugar de contarla dos veces.
+        """
+        parent = _current_call.get()
+        if parent is not None and parent.operation == operation:
+            yield parent
+            return
+
+        call = LLMCall(operation)
+        token = _current_call.set(call)
+        try:
+            yield call
+        except BaseException as e:
+            self.record(call, e)
+            raise
+        else:
+            self.record(call)
+        finally:
+            _current_call.reset(token)
+
+    def start(self, operation: str) -> LLMCall:
+        """Inicia una operación sin asociarla a la tarea (generadores en streaming)"""
+        return LLMCall(operation)
+
+    def record(self, call: LLMCall, error: Optional[BaseException] = None):
+        """Cierra la operación y la agrega a los histogramas"""
+        call.finish(error)
+        if not self.enabled:
+            return
+        self._operations.setdefault(call.operation, _OperationStats()).observe(call)
+        if self.log:
+            timings = " ".join(f"{phase}={seconds:.3f}s" for phase, seconds in call.timings.items())
+            tokens = call.tokens()
+            print(f"📊 LLM {call.operation} {call.outcome} {timings} "
+                  f"prompt={call.prompt_chars}c/{tokens['prompt']}t "
+                  f"response={call.response_chars}c/{tokens['response']}t")
+
+    def operations(self) -> List[str]:
+        return sorted(self._operations)
+
+    def stats(self, operation: Optional[str] = None) -> Dict[str, Any]:
+        """Histogramas de todas las operaciones o de una sola (vacío si no hay registros)"""
+        if operation is not None:
+            stats = self._operations.get(operation)
+            return stats.to_dict() if stats is not None else {}
+        return {name: stats.to_dict() for name, stats in sorted(self._operations.items())}
+
+    def reset(self):
+        self._operations.clear()
+
+
+# Instancia compartida por los servicios de IA del worker
+llm_metrics = LLMMetrics()
@@ -0,0 +1,222 @@
+"""
+Enrutado de cada operación a un modelo con respaldo adaptativo.
+
+Todas las llamadas usaban el mismo modelo, ya fuera para crear una rutina de
+seis días o para redactar una explicación de una frase. La tabla de rutas
+asigna a cada operación (create, modify, explain, analyze, variations) un
+modelo principal y, si se configura, uno de respaldo más rápido o más barato.
+Si el p95 de latencia o la tasa de errores del principal en esa operación
+supera el umbral, la operación pasa al respaldo; mientras tanto una petición
+de prueba cada cierto tiempo va al principal y, tras varias pruebas sanas
+seguidas, vuelve.
+
+La tabla se configura con `LLM_ROUTES` (JSON), por ejemplo:
+    {"create": {"primary": "gemini-1.5-pro", "fallback": "gemini-1.5-flash"},
+     "explain": {"primary": "gemini-1.5-flash-8b"}}
+El respaldo se activa por operación: las que no declaran `fallback` no
+cambian nunca de modelo, salvo que `GEMINI_FALLBACK_MODEL` fije uno para
+todas. Las operaciones que no aparecen usan `GEMINI_MODEL`.
+"""
+import os
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+from app.services.resilience import LatencyTracker
+from app.services.llm_backend import GEMINI_MODEL_NAME
+
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+
+# Modelo de respaldo de las operaciones que no declaran uno (vacío = sin respaldo)
+GEMINI_FALLBACK_MODEL = os.getenv("GEMINI_FALLBACK_MODEL", "")
+
+# Tabla de rutas en JSON: {"operación": {"primary": modelo, "fallback": modelo}}
+LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+
+# Umbrales que mueven una operación al modelo de respaldo
+MODEL_ROUTER_P95_THRESHOLD = float(os.getenv("MODEL_ROUTER_P95_THRESHOLD", "20"))  # segundos
+MODEL_ROUTER_ERROR_THRESHOLD = float(os.getenv("MODEL_ROUTER_ERROR_THRESHOLD", "0.3"))
+
+# Ventana de llamadas observadas por operación y modelo, y mínimo para decidir
+MODEL_ROUTER_WINDOW = int(os.getenv("MODEL_ROUTER_WINDOW", "50"))
+MODEL_ROUTER_MIN_SAMPLES = int(os.getenv("MODEL_ROUTER_MIN_SAMPLES", "10"))
+
+# Segundos entre peticiones de prueba al principal y pruebas sanas seguidas para volver
+MODEL_ROUTER_PROBE_INTERVAL = float(os.getenv("MODEL_ROUTER_PROBE_INTERVAL", "30"))
+MODEL_ROUTER_RECOVERY_PROBES = int(os.getenv("MODEL_ROUTER_RECOVERY_PROBES", "3"))
+
+OPERATIONS = ("create", "modify", "explain", "analyze", "variations")
+
+
+class ModelRoute:
+    """Modelos de una operación y modelo activo"""
+
+    def __init__(self, operation: str, primary: str, fallback: Optional[str] = None):
+        self.operation = operation
+        self.primary = primary
+        self.fallback = fallback if fallback and fallback != primary else None
+        self.active = primary
+        self.switches = 0
+        self.last_probe = 0.0
+        self.healthy_probes = 0
+
+
+class _ModelHealth:
+    """Latencias y errores recientes de un modelo en una operación"""
+
+    def __init__(self, window: int):
+        self.latencies = LatencyTracker(window)
+        self.results: Deque[bool] = deque(maxlen=window)
+
+    def record(self, seconds: float, ok: bool):
+        self.results.append(ok)
+        if ok:
+            self.latencies.record(seconds)
+
+    def error_rate(self) -> float:
+        return self.results.count(False) / len(self.results) if self.results else 0.0
+
+    def clear(self):
+        self.latencies.samples.clear()
+        self.results.clear()
+
+
+def parse_routes(config: str, default_model: str = GEMINI_MODEL_NAME,
+                 default_fallback: Optional[str] = GEMINI_FALLBACK_MODEL) -> Dict[str, ModelRoute]:
+    """Construye la tabla de rutas a partir del JSON de configuración"""
+    table: Dict[str, Any] = {}
+    if config:
+        try:
+            table = json.loads(config)
+            if not isinstance(table, dict):
+                raise ValueError("se esperaba un objeto")
+        except ValueError as e:
+            print(f"⚠️ LLM_ROUTES no es válido ({str(e)}), usando las rutas por defecto")
+            table = {}
+
+    routes = {}
+    for operation in set(OPERATIONS) | set(table):
+        entry = table.get(operation) or {}
+        if isinstance(entry, str):
+            entry = {"primary": entry}
+        elif isinstance(entry, (list, tuple)):
+            entry = {"primary": entry[0], "fallback": entry[1] if len(entry) > 1 else None}
+        primary = entry.get("primary") or default_model
+        fallback = entry.get("fallback", default_fallback)
+        routes[operation] = ModelRoute(operation, primary, fallback)
+    return routes
+
+
+class ModelRouter:
+    """Elige el modelo de cada operación según la salud observada del principal"""
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, ModelRoute]] = None,
+        enabled: bool = MODEL_ROUTING_ENABLED,
+        p95_threshold: float = MODEL_ROUTER_P95_THRESHOLD,
+        error_threshold: float = MODEL_ROUTER_ERROR_THRESHOLD,
+        window: int = MODEL_ROUTER_WINDOW,
+        min_samples: int = MODEL_ROUTER_MIN_SAMPLES,
+        probe_interval: float = MODEL_ROUTER_PROBE_INTERVAL,
+        recovery_probes: int = MODEL_ROUTER_RECOVERY_PROBES,
+        default_model: str = GEMINI_MODEL_NAME,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.routes = routes if routes is not None else parse_routes(LLM_ROUTES)
+        self.enabled = enabled
+        self.p95_threshold = p95_threshold
+        self.error_threshold = error_threshold
+        self.window = window
+        self.min_samples = max(1, min_samples)
+        self.probe_interval = probe_interval
+        self.recovery_probes = max(1, recovery_probes)
+        self.default_model = default_model
+        self._clock = clock
+        self._health: Dict[Tuple[str, str], _ModelHealth] = {}
+
+    def _route(self, operation: str) -> ModelRoute:
+        route = self.routes.get(operation)
+        if route is None:
+            route = self.routes[operation] = ModelRoute(operation, self.default_model)
+        return route
+
+    def _model_health(self, operation: str, model: str) -> _ModelHealth:
+        key = (operation, model)
+        health = self._health.get(key)
+        if health is None:
+            health = self._health[key] = _ModelHealth(self.window)
+        return health
+
+    def choose(self, operation: str) -> str:
+        """Modelo que debe atender la operación"""
+        route = self._route(operation)
+        if not self.enabled or route.fallback is None or route.active == route.primary:
+            return route.primary
+        # En respaldo: cada cierto tiempo una petición comprueba si el principal se recuperó
+        now = self._clock()
+        if now - route.last_probe >= self.probe_interval:
+            route.last_probe = now
+            return route.primary
+        return route.fallback
+
+    def record(self, operation: str, model: str, seconds: float, ok: bool):
+        """Registra el resultado de una llamada y cambia de modelo si hace falta"""
+        route = self._route(operation)
+        health = self._model_health(operation, model)
+        health.record(seconds, ok)
+        if not self.enabled or route.fallback is None or model != route.primary:
+            return
+
+        if route.active == route.primary:
+            p95 = health.latencies.percentile(0.95)
+            degraded = len(health.results) >= self.min_samples and (
+                health.error_rate() > self.error_threshold or (p95 is not None and p95 > self.p95_threshold)
+            )
+            if degraded:
+                self._switch(route, route.fallback, f"p95={p95 or 0:.1f}s errores={health.error_rate():.0%}")
+                route.last_probe = self._clock()
+                route.healthy_probes = 0
+            return
+
+        # Resultado de una petición de prueba mientras se usa el respaldo
+        if ok and seconds <= self.p95_threshold:
+            route.healthy_probes += 1
+        else:
+            route.healthy_probes = 0
+        if route.healthy_probes >= self.recovery_probes:
+            # La ventana anterior refleja la degradación, no el estado actual
+            health.clear()
+            self._switch(route, route.primary, f"{route.healthy_probes} pruebas correctas")
+
+    def _switch(self, route: ModelRoute, model: str, reason: str):
+        print(f"🔀 Operación '{route.operation}': {route.active} -> {model} ({reason})")
+        route.active = model
+        route.switches += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Modelo activo de cada operación y salud de sus modelos"""
+        result = {}
+        for operation, route in sorted(self.routes.items()):
+            models = {}
+            for model in filter(None, (route.primary, route.fallback)):
+                health = self._health.get((operation, model))
+                if health is not None and health.results:
+                    p95 = health.latencies.percentile(0.95)
+                    models[model] = {
+                        "calls": len(health.results),
+                        "p95": round(p95, 3) if p95 is not None else None,
+                        "error_rate": round(health.error_rate(), 3)
+                    }
+            result[operation] = {
+                "primary": route.primary,
+                "fallback": route.fallback,
+                "active": route.active,
+                "switches": route.switches,
+                "models": models
+            }
+        return {"enabled": self.enabled, "routes": result}
+
+
+# Instancia compartida por los servicios de IA del worker
+model_router = ModelRouter()
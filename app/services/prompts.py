@@ -0,0 +1,217 @@
+"""
+Prompts del generador de rutinas.
+
+Cada prompt se divide en una parte estática (rol, formato y reglas), que es
+idéntica en todas las llamadas y se construye una sola vez, y una parte
+dinámica con los datos de la petición. La parte estática va siempre al
+principio para que el prefijo sea estable y pueda aprovechar la caché de
+prefijos del proveedor; las dos partes se minifican (sin la sangría de los
+f-strings, sin líneas vacías y con el JSON compacto) porque los espacios
+también cuentan como tokens de entrada.
+
+`scripts/prompt_size_report.py` compara el tamaño con los prompts anteriores.
+"""
+import json
+import textwrap
+from typing import Any, Dict, List
+from app.models.models import Routine, RoutineRequest
+
+
+def minify_prompt(text: str) -> str:
+    """Elimina la sangría, los espacios al final de línea y las líneas vacías"""
+    return "\n".join(line.strip() for line in textwrap.dedent(text).splitlines() if line.strip())
+
+
+def compact_json(data) -> str:
+    """JSON sin espacios, manteniendo los acentos"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+EXERCISE_EXAMPLE = {
+    "name": "Nombre del ejercicio",
+    "sets": 3,
+    "reps": "8-12",
+    "rest": "60-90 seg",
+    "equipment": "Equipamiento necesario"
+}
+
+DAY_EXAMPLE = {
+    "day_name": "Lunes",
+    "focus": "Parte del cuerpo que se trabaja ese día",
+    "exercises": [EXERCISE_EXAMPLE]
+}
+
+ROUTINE_SCHEMA = compact_json({
+    "routine_name": "Nombre descriptivo de la rutina",
+    "days": [DAY_EXAMPLE]
+})
+
+PATCH_SCHEMA = compact_json({
+    "operations": [
+        {"op": "replace", "path": "/days/0/exercises/1/sets", "value": 4},
+        {"op": "add", "path": "/days/2/exercises/-", "value": EXERCISE_EXAMPLE},
+        {"op": "remove", "path": "/days/1/exercises/0"}
+    ],
+    "explanation": "Explicación breve, profesional y motivadora de los cambios realizados"
+})
+
+SKELETON_SCHEMA = compact_json({
+    "routine_name": "Nombre descriptivo de la rutina",
+    "days": [{key: DAY_EXAMPLE[key] for key in ("day_name", "focus")}]
+})
+
+# --- Partes estáticas ---
+
+INITIAL_PROMPT_PREFIX = minify_prompt(f"""
+    Actúa como un entrenador personal profesional y crea una rutina de entrenamiento detallada.
+    La rutina debe seguir ESTRICTAMENTE este formato JSON:
+    {ROUTINE_SCHEMA}
+    IMPORTANTE: devuelve SOLO el JSON válido, sin texto explicativo, con exactamente los días indicados.
+""")
+
+SKELETON_PROMPT_PREFIX = minify_prompt(f"""
+    Actúa como un entrenador personal profesional y planifica la estructura de una rutina de entrenamiento.
+    Devuelve SOLO un JSON con el nombre de la rutina y el enfoque de cada día, sin ejercicios:
+    {SKELETON_SCHEMA}
+    Reparte los grupos musculares de forma equilibrada, con descanso entre días que trabajan los mismos músculos.
+""")
+
+SKELETON_DAY_PROMPT_PREFIX = minify_prompt(f"""
+    Actúa como un entrenador personal profesional y completa con ejercicios UN día de una rutina de entrenamiento ya planificada.
+    Devuelve SOLO el JSON del día, con este formato:
+    {compact_json(DAY_EXAMPLE)}
+    Mantén el nombre y el enfoque del día; no repitas el trabajo de los otros días.
+""")
+
+_MODIFICATION_ROLE = "Actúa como un entrenador personal. Modifica la rutina de entrenamiento del usuario según su solicitud."
+
+MODIFICATION_PROMPT_PREFIX = minify_prompt(f"""
+    {_MODIFICATION_ROLE}
+    Devuelve SOLO el JSON de la rutina actualizada, con el mismo formato que la original.
+""")
+
+COMBINED_PROMPT_PREFIX = minify_prompt(f"""
+    {_MODIFICATION_ROLE}
+    Devuelve SOLO un JSON con este formato:
+    {{"routine":{{la rutina completa actualizada, con el mismo formato que la original}},"explanation":"Explicación breve, profesional y motivadora de los cambios realizados"}}
+    La explicación no debe incluir código JSON, solo texto.
+""")
+
+PATCH_PROMPT_PREFIX = minify_prompt(f"""
+    {_MODIFICATION_ROLE}
+    NO devuelvas la rutina completa. Devuelve SOLO un JSON con la lista mínima de operaciones (estilo JSON Patch) que aplican la solicitud y una explicación:
+    {PATCH_SCHEMA}
+    IMPORTANTE:
+    1. Las operaciones permitidas son "add", "remove" y "replace".
+    2. Las rutas usan índices que empiezan en 0 sobre "days" y "exercises"; "-" añade al final de la lista.
+    3. Solo se pueden modificar "routine_name" y el contenido de "days".
+    4. Las operaciones se aplican en orden, así que los índices deben tener en cuenta las operaciones anteriores.
+""")
+
+DAY_PROMPT_PREFIX = minify_prompt(f"""
+    Actúa como un entrenador personal. Modifica UN día de la rutina de entrenamiento del usuario según su solicitud.
+    Devuelve SOLO el JSON del día actualizado, con este formato:
+    {compact_json(DAY_EXAMPLE)}
+    Cambia solo lo que pide la solicitud para este día; el resto de días no se modifica.
+""")
+
+EXPLANATION_PROMPT_PREFIX = minify_prompt("""
+    Explica brevemente los cambios realizados a la rutina del usuario de forma profesional y motivadora.
+    No incluyas código JSON, solo texto explicando los cambios principales.
+""")
+
+# Campos opcionales de la petición que se envían solo si tienen valor: (atributo, etiqueta)
+OPTIONAL_REQUEST_FIELDS = (
+    ("experience_level", "Nivel de experiencia"),
+    ("time_per_session", "Tiempo por sesión"),
+    ("health_conditions", "Condiciones de salud")
+)
+
+# --- Prompts completos ---
+
+
+def _request_lines(request: RoutineRequest) -> List[str]:
+    """Datos de la petición de creación que se envían al modelo"""
+    lines = [
+        f"Objetivos: {request.goals}",
+        f"Días de entrenamiento: {request.days} días a la semana",
+        f"Equipo disponible: {request.equipment or 'No especificado'}"
+    ]
+    for attribute, label in OPTIONAL_REQUEST_FIELDS:
+        value = getattr(request, attribute, None)
+        if value:
+            lines.append(f"{label}: {value}")
+    return lines
+
+
+def build_initial_prompt(request: RoutineRequest) -> str:
+    """Prompt para crear una rutina"""
+    lines = _request_lines(request) + [f"Incluye exactamente {request.days} días en la rutina."]
+    return INITIAL_PROMPT_PREFIX + "\n" + minify_prompt("\n".join(lines))
+
+
+def build_skeleton_prompt(request: RoutineRequest) -> str:
+    """Prompt para planificar solo el nombre y el enfoque de cada día"""
+    lines = _request_lines(request) + [f"Incluye exactamente {request.days} días en la estructura."]
+    return SKELETON_PROMPT_PREFIX + "\n" + minify_prompt("\n".join(lines))
+
+
+def build_skeleton_day_prompt(request: RoutineRequest, skeleton: Dict[str, Any], index: int) -> str:
+    """Prompt para generar los ejercicios de un día de la estructura planificada"""
+    days = skeleton["days"]
+    week = ", ".join(f"{day['day_name']} ({day['focus']})" for day in days)
+    lines = _request_lines(request) + [
+        f"Rutina: {skeleton['routine_name']}",
+        f"Semana: {week}",
+        f"Día a completar: {days[index]['day_name']} ({days[index]['focus']})"
+    ]
+    return SKELETON_DAY_PROMPT_PREFIX + "\n" + minify_prompt("\n".join(lines))
+
+
+def _modification_body(current_routine: Routine, user_request: str, history: str) -> str:
+    """Parte dinámica de los prompts de modificación: rutina actual, contexto y solicitud"""
+    routine_json = compact_json(current_routine.model_dump(include={"routine_name", "days"}))
+    parts = [f"Rutina actual:\n```json\n{routine_json}\n```"]
+    if history:
+        parts.append("Contexto de la conversación con el usuario (tenlo en cuenta para interpretar la solicitud):\n"
+                     + minify_prompt(history))
+    parts.append(f'El usuario ha solicitado: "{" ".join(user_request.split())}"')
+    return "\n".join(parts)
+
+
+def build_modification_prompt(current_routine: Routine, user_request: str, history: str = "") -> str:
+    """Prompt para obtener la rutina completa modificada"""
+    return MODIFICATION_PROMPT_PREFIX + "\n" + _modification_body(current_routine, user_request, history)
+
+
+def build_combined_modification_prompt(current_routine: Routine, user_request: str, history: str = "") -> str:
+    """Prompt para obtener la rutina modificada y la explicación en una sola respuesta"""
+    return COMBINED_PROMPT_PREFIX + "\n" + _modification_body(current_routine, user_request, history)
+
+
+def build_patch_prompt(current_routine: Routine, user_request: str, history: str = "") -> str:
+    """Prompt para obtener solo las operaciones de modificación"""
+    return PATCH_PROMPT_PREFIX + "\n" + _modification_body(current_routine, user_request, history)
+
+
+def build_day_prompt(current_routine: Routine, index: int, user_request: str, history: str = "") -> str:
+    """Prompt para modificar un solo día, con el resto de la semana como referencia"""
+    others = ", ".join(f"{day.day_name} ({day.focus})"
+                       for position, day in enumerate(current_routine.days) if position != index)
+    day_json = compact_json(current_routine.days[index].model_dump())
+    parts = [f"Rutina: {current_routine.routine_name}"]
+    if others:
+        parts.append(f"Otros días (no los devuelvas): {others}")
+    parts.append(f"Día a modificar:\n```json\n{day_json}\n```")
+    if history:
+        parts.append("Contexto de la conversación con el usuario (tenlo en cuenta para interpretar la solicitud):\n"
+                     + minify_prompt(history))
+    parts.append(f'El usuario ha solicitado: "{" ".join(user_request.split())}"')
+    return DAY_PROMPT_PREFIX + "\n" + "\n".join(parts)
+
+
+def build_explanation_prompt(user_request: str, summary: str) -> str:
+    """Prompt para redactar la explicación de unos cambios ya calculados"""
+    return (EXPLANATION_PROMPT_PREFIX + "\n" + f'El usuario solicitó: "{" ".join(user_request.split())}"\n'
+            + "Cambios realizados:\n" + minify_prompt(summary))
+
@@ -0,0 +1,271 @@
+"""
+Limitador de peticiones al modelo con token buckets y prioridades.
+
+En los picos se agotaba la cuota de Gemini y todas las peticiones competían
+por igual. Antes de llamar al modelo cada petición toma un token del bucket
+global y del bucket de su usuario. El estado de los buckets vive en el mismo
+archivo SQLite local que la caché de respuestas, así que lo comparten todos
+los workers de gunicorn.
+
+Las peticiones que esperan forman una cola con prioridad: las ediciones del
+chat pasan antes que la creación de rutinas, y esta antes que el análisis de
+imágenes. Dentro de un worker una prioridad solo intenta tomar tokens si no
+hay peticiones más prioritarias esperando por el bucket global; entre workers,
+cada nivel de prioridad deja una reserva de tokens para los niveles superiores.
+
+El almacén se consulta en un hilo (`asyncio.to_thread`) para que la espera del
+bloqueo de SQLite entre workers no detenga el bucle de eventos. Una petición
+sin token no vuelve a intentarlo hasta que se estima que habrá uno, con un
+retroceso exponencial y aleatorio si otros workers se lo llevan antes.
+"""
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import itertools
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.response_cache import default_cache_path
+from app.services.resilience import LLMUnavailableError
+
+GEMINI_RATE_LIMIT_ENABLED = os.getenv("GEMINI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# Bucket global compartido por todos los workers (peticiones por minuto y ráfaga)
+GEMINI_RATE_LIMIT_RPM = float(os.getenv("GEMINI_RATE_LIMIT_RPM", "60"))
+GEMINI_RATE_LIMIT_BURST = float(os.getenv("GEMINI_RATE_LIMIT_BURST", "10"))
+
+# Bucket de cada usuario
+GEMINI_USER_RATE_LIMIT_RPM = float(os.getenv("GEMINI_USER_RATE_LIMIT_RPM", "20"))
+GEMINI_USER_RATE_LIMIT_BURST = float(os.getenv("GEMINI_USER_RATE_LIMIT_BURST", "5"))
+
+# Tokens del bucket global que cada nivel de prioridad deja a los niveles superiores
+GEMINI_RATE_LIMIT_RESERVE = float(os.getenv("GEMINI_RATE_LIMIT_RESERVE", "1"))
+
+# Espera máxima en la cola antes de responder que el servicio está saturado
+GEMINI_RATE_LIMIT_MAX_WAIT = float(os.getenv("GEMINI_RATE_LIMIT_MAX_WAIT", "30"))
+
+# Prioridades (menor valor = más prioritario)
+PRIORITY_CHAT = 0
+PRIORITY_CREATE = 1
+PRIORITY_IMAGE = 2
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_CREATE: "create", PRIORITY_IMAGE: "image"}
+
+# Intervalo entre comprobaciones de la cola local mientras esperan peticiones más prioritarias,
+# y primer retroceso cuando el bucket no tiene tokens
+POLL_INTERVAL = 0.1
+
+# Retroceso máximo entre intentos de tomar un token del almacén compartido
+MAX_BACKOFF = 2.0
+
+GLOBAL_BUCKET = "global"
+
+
+class RateLimitExceeded(LLMUnavailableError):
+    """La petición esperó en la cola más de lo permitido"""
+
+
+class TokenBucketStore:
+    """Token buckets persistidos en SQLite y actualizados de forma atómica"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        rate: float = GEMINI_RATE_LIMIT_RPM / 60,
+        capacity: float = GEMINI_RATE_LIMIT_BURST,
+        user_rate: float = GEMINI_USER_RATE_LIMIT_RPM / 60,
+        user_capacity: float = GEMINI_USER_RATE_LIMIT_BURST,
+        reserve: float = GEMINI_RATE_LIMIT_RESERVE
+    ):
+        self._path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.user_rate = user_rate
+        self.user_capacity = user_capacity
+        self.reserve = reserve
+        self._initialized = False
+        self._grants = 0
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = os.getenv("GEMINI_RATE_LIMIT_PATH") or default_cache_path()
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        """Abre una conexión en modo autocommit (y crea la tabla la primera vez)"""
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _buckets(self, user_id: Optional[int]) -> List[Tuple[str, float, float]]:
+        """Buckets que consume una petición: (nombre, tokens por segundo, capacidad)"""
+        buckets = [(GLOBAL_BUCKET, self.rate, self.capacity)]
+        if user_id is not None:
+            buckets.append((f"user:{user_id}", self.user_rate, self.user_capacity))
+        return buckets
+
+    def try_acquire(self, user_id: Optional[int], priority: int) -> Tuple[float, Optional[str]]:
+        """
+        Intenta tomar un token de cada bucket. Devuelve (0, None) si lo consigue
+        o (segundos de espera estimados, bucket que falta) si no.
+        """
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                levels = []
+                wait, blocked_by = 0.0, None
+                for name, rate, capacity in self._buckets(user_id):
+                    row = conn.execute(
+                        "SELECT tokens, updated_at FROM llm_rate_buckets WHERE name = ?", (name,)
+                    ).fetchone()
+                    tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                    needed = 1.0
+                    if name == GLOBAL_BUCKET:
+                        needed = min(capacity, 1.0 + priority * self.reserve)
+                    if tokens < needed:
+                        bucket_wait = (needed - tokens) / rate if rate > 0 else float("inf")
+                        if bucket_wait > wait:
+                            wait = bucket_wait
+                            blocked_by = "global" if name == GLOBAL_BUCKET else "user"
+                    levels.append((name, tokens))
+
+                if blocked_by is not None:
+                    conn.execute("ROLLBACK")
+                    return wait, blocked_by
+
+                conn.executemany(
+                    "INSERT OR REPLACE INTO llm_rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    [(name, tokens - 1, now) for name, tokens in levels]
+                )
+                self._grants += 1
+                if self._grants % 100 == 0 and self.user_rate > 0:
+                    # Los buckets de usuario ya rellenos equivalen a no tener fila
+                    conn.execute(
+                        "DELETE FROM llm_rate_buckets WHERE name != ? AND updated_at < ?",
+                        (GLOBAL_BUCKET, now - self.user_capacity / self.user_rate)
+                    )
+                conn.execute("COMMIT")
+                return 0.0, None
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            # Si el almacén local falla no se bloquean las peticiones
+            print(f"⚠️ Error en el limitador de peticiones: {str(e)}")
+            return 0.0, None
+
+    def available(self) -> float:
+        """Tokens disponibles ahora mismo en el bucket global"""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM llm_rate_buckets WHERE name = ?", (GLOBAL_BUCKET,)
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return 0.0
+        if row is None:
+            return self.capacity
+        return min(self.capacity, row[0] + (time.time() - row[1]) * self.rate)
+
+
+class RateLimiter:
+    """Cola con prioridad delante de los token buckets compartidos"""
+
+    def __init__(
+        self,
+        store: Optional[TokenBucketStore] = None,
+        enabled: bool = GEMINI_RATE_LIMIT_ENABLED,
+        max_wait: float = GEMINI_RATE_LIMIT_MAX_WAIT
+    ):
+        self.store = store or TokenBucketStore()
+        self.enabled = enabled
+        self.max_wait = max_wait
+        self._sequence = itertools.count()
+        # Peticiones en espera de este worker: id -> {"priority", "blocked_by"}
+        self._waiting: Dict[int, Dict[str, Any]] = {}
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+
+    def _yields_to_others(self, ticket: int, priority: int) -> bool:
+        """Hay una petición más prioritaria esperando por el bucket global"""
+        return any(
+            waiter["priority"] < priority and waiter["blocked_by"] != "user"
+            for other, waiter in self._waiting.items() if other != ticket
+        )
+
+    async def acquire(self, user_id: Optional[int] = None, priority: int = PRIORITY_CREATE) -> float:
+        """
+        Espera hasta obtener permiso para llamar al modelo y devuelve los
+        segundos de espera. Lanza RateLimitExceeded si se supera la espera máxima.
+        """
+        if not self.enabled:
+            return 0.0
+
+        ticket = next(self._sequence)
+        waiter = {"priority": priority, "blocked_by": None}
+        self._waiting[ticket] = waiter
+        start = time.monotonic()
+        backoff = POLL_INTERVAL
+        try:
+            while True:
+                if self._yields_to_others(ticket, priority):
+                    wait, waiter["blocked_by"] = POLL_INTERVAL, "queue"
+                else:
+                    wait, waiter["blocked_by"] = await asyncio.to_thread(self.store.try_acquire, user_id, priority)
+                    if waiter["blocked_by"] is None:
+                        waited = time.monotonic() - start
+                        self.granted += 1
+                        self.total_wait += waited
+                        self.max_observed_wait = max(self.max_observed_wait, waited)
+                        return waited
+
+                waited = time.monotonic() - start
+                if waited + wait > self.max_wait:
+                    self.rejected += 1
+                    raise RateLimitExceeded(
+                        "Hay mucha demanda en el servicio de IA. Inténtalo de nuevo en unos segundos.",
+                        retry_after=wait
+                    )
+                if waiter["blocked_by"] != "queue":
+                    # Esperar a que se estime un token libre y, si otro worker se lo lleva, cada vez más
+                    wait = max(wait, backoff) * random.uniform(1.0, 1.5)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                await asyncio.sleep(min(wait, MAX_BACKOFF, max(0.0, self.max_wait - waited)))
+        finally:
+            del self._waiting[ticket]
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidad de la cola de este worker, esperas y tokens globales disponibles"""
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._waiting.values():
+            name = PRIORITY_NAMES.get(waiter["priority"], str(waiter["priority"]))
+            depth[name] = depth.get(name, 0) + 1
+        return {
+            "enabled": self.enabled,
+            "queue_depth": depth,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "avg_wait": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            "max_wait": round(self.max_observed_wait, 3),
+            "global_tokens": round(self.store.available(), 2) if self.enabled else None
+        }
+
+
+# Instancia compartida por los servicios de IA del worker
+rate_limiter = RateLimiter()
@@ -0,0 +1,365 @@
+"""
+Resiliencia de las llamadas al modelo: plazos, reintentos, cortocircuito y
+peticiones duplicadas ("hedging").
+
+Los errores transitorios de Gemini (429, 5xx, plazos agotados) llegaban tal
+cual al usuario y una llamada colgada en `generate_content` podía agotar el
+`--timeout` de gunicorn y matar el worker. Cada llamada tiene ahora un plazo
+por intento y un plazo total, los errores reintentables se repiten con
+espera exponencial aleatoria, y tras varios fallos seguidos el circuito se
+abre y las llamadas fallan al instante hasta que pasa el tiempo de espera.
+Opcionalmente, si un intento tarda más que el p95 observado se lanza una
+segunda petición y se usa la que responda primero.
+"""
+import os
+import math
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+# Plazo de cada intento y plazo total de la llamada (por debajo del --timeout 120 de gunicorn)
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "40"))
+GEMINI_TOTAL_TIMEOUT = float(os.getenv("GEMINI_TOTAL_TIMEOUT", "90"))
+
+# Reintentos de errores transitorios con espera exponencial aleatoria
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+
+# Fallos seguidos que abren el circuito y segundos que permanece abierto
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+# Petición duplicada cuando un intento supera el p95 (duplica el coste de las llamadas lentas)
+GEMINI_HEDGING = os.getenv("GEMINI_HEDGING", "false").lower() == "true"
+GEMINI_HEDGE_MIN_SAMPLES = int(os.getenv("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+
+# Códigos HTTP de los errores de la API que merece la pena reintentar
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class LLMUnavailableError(RuntimeError):
+    """El modelo no está disponible: circuito abierto o reintentos agotados"""
+
+    def __init__(self, message: str, retry_after: float = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Indica si el error es transitorio (plazo agotado, red, 429 o 5xx)"""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    # Las excepciones de google.api_core exponen el código HTTP en `code`
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS
+
+
+class CircuitBreaker:
+    """Circuito de tres estados: cerrado, abierto y semiabierto (una llamada de prueba)"""
+
+    def __init__(
+        self,
+        threshold: int = GEMINI_BREAKER_THRESHOLD,
+        cooldown: float = GEMINI_BREAKER_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        """Segundos que faltan para volver a probar la API"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - self._clock())
+
+    def allow(self) -> bool:
+        """Indica si una llamada puede salir (y reserva la de prueba si está semiabierto)"""
+        if self.state == "open":
+            if self._clock() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self._trial_in_flight = False
+
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                self.rejected += 1
+                return False
+            self._trial_in_flight = True
+
+        return True
+
+    def release_trial(self):
+        """La llamada de prueba se canceló sin resultado: la siguiente puede volver a probar"""
+        if self.state == "half_open":
+            self._trial_in_flight = False
+
+    def record_success(self):
+        """La API respondió: se cierra el circuito"""
+        if self.state != "closed":
+            print("✅ Circuito de Gemini cerrado, la API vuelve a responder")
+        self.state = "closed"
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        """Fallo transitorio: se abre el circuito al llegar al umbral o si falla la prueba"""
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"⚠️ Circuito de Gemini abierto tras {self.failures} fallos, "
+                      f"se volverá a probar en {self.cooldown:.0f} s")
+            self.state = "open"
+            self.opened_at = self._clock()
+
+
+class LatencyTracker:
+    """Ventana de las últimas latencias correctas para calcular percentiles"""
+
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentil `q` (0-1) de la ventana, o None si no hay muestras"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+class ResiliencePolicy:
+    """Plazos, reintentos, circuito y hedging para un proveedor de IA"""
+
+    def __init__(
+        self,
+        name: str = "gemini",
+        timeout: float = GEMINI_TIMEOUT,
+        total_timeout: float = GEMINI_TOTAL_TIMEOUT,
+        max_retries: int = GEMINI_MAX_RETRIES,
+        base_delay: float = GEMINI_RETRY_BASE_DELAY,
+        max_delay: float = GEMINI_RETRY_MAX_DELAY,
+        breaker: Optional[CircuitBreaker] = None,
+        hedging: bool = GEMINI_HEDGING,
+        hedge_min_samples: int = GEMINI_HEDGE_MIN_SAMPLES,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.hedging = hedging
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        self._clock = clock
+        self.calls = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _check_breaker(self) -> bool:
+        """Falla al instante si el circuito está abierto; indica si la llamada es la de prueba"""
+        if not self.breaker.allow():
+            retry_after = self.breaker.retry_after()
+            raise LLMUnavailableError(
+                f"El servicio de IA no está disponible temporalmente. "
+                f"Vuelve a intentarlo en {max(1, math.ceil(retry_after))} s.",
+                retry_after=retry_after
+            )
+        return self.breaker.state == "half_open"
+
+    def _backoff(self, attempt: int) -> float:
+        """Espera exponencial con jitter completo"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def hedge_delay(self) -> Optional[float]:
+        """Tiempo tras el que se lanza la petición duplicada (p95 observado)"""
+        if not self.hedging or len(self.latency.samples) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(0.95)
+
+    def _handle_failure(self, error: Exception, attempt: int, deadline: float, retriable: bool = True) -> float:
+        """
+        Registra un fallo y devuelve cuánto esperar antes del siguiente intento.
+        Relanza el error si no es transitorio y LLMUnavailableError si se agotan
+        los reintentos o el plazo total.
+        """
+        if not is_retryable(error):
+            # La API respondió (p. ej. 400): el servicio está disponible
+            self.breaker.record_success()
+            raise error
+
+        self.breaker.record_failure()
+        if isinstance(error, asyncio.TimeoutError):
+            self.timeouts += 1
+
+        delay = self._backoff(attempt)
+        if not retriable or attempt >= self.max_retries or self._clock() + delay >= deadline:
+            self.failures += 1
+            raise LLMUnavailableError(
+                "El servicio de IA no responde en este momento. Inténtalo de nuevo en unos segundos.",
+                retry_after=self.breaker.retry_after()
+            ) from error
+
+        self.retries += 1
+        reason = "plazo agotado" if isinstance(error, asyncio.TimeoutError) else str(error) or type(error).__name__
+        print(f"⚠️ Llamada a {self.name} fallida ({reason}), reintento {attempt + 1}/{self.max_retries} en {delay:.1f} s")
+        return delay
+
+    async def call(self, func: Callable[[], Awaitable[Any]],
+                   on_attempt: Optional[Callable[[float, bool], None]] = None) -> Any:
+        """
+        Ejecuta `func()` (una corrutina nueva por intento) con toda la política.
+        `on_attempt(segundos, ok)` recibe la duración de cada intento, sin las
+        esperas entre reintentos.
+        """
+        self.calls += 1
+        deadline = self._clock() + self.total_timeout
+        attempt = 0
+        while True:
+            trial = self._check_breaker()
+            start = self._clock()
+            timeout = max(0.0, min(self.timeout, deadline - start))
+            try:
+                result = await self._attempt(func, timeout)
+            except Exception as e:
+                if on_attempt is not None:
+                    on_attempt(self._clock() - start, False)
+                delay = self._handle_failure(e, attempt, deadline)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelada: sin liberar la prueba el circuito rechazaría todo para siempre
+                if trial:
+                    self.breaker.release_trial()
+                raise
+
+            self.breaker.record_success()
+            self.latency.record(self._clock() - start)
+            if on_attempt is not None:
+                on_attempt(self._clock() - start, True)
+            return result
+
+    async def _attempt(self, func: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+        """Un intento con su plazo, duplicado si supera el p95"""
+        hedge_after = self.hedge_delay()
+        if hedge_after is None or hedge_after >= timeout:
+            return await asyncio.wait_for(func(), timeout)
+        return await asyncio.wait_for(self._hedged(func, hedge_after), timeout)
+
+    async def _hedged(self, func: Callable[[], Awaitable[Any]], hedge_after: float) -> Any:
+        """Lanza una segunda petición si la primera tarda más de `hedge_after`"""
+        primary = asyncio.ensure_future(func())
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_after)
+            if not done:
+                self.hedges += 1
+                pending.add(asyncio.ensure_future(func()))
+
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # La petición perdedora se abandona: su hilo sigue hasta que el SDK responde o
+            # agota su plazo, y conserva mientras tanto su permiso en `llm_executor`
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, factory: Callable[[], AsyncIterator[Any]],
+                     on_attempt: Optional[Callable[[float, bool], None]] = None) -> AsyncIterator[Any]:
+        """
+        Versión en streaming: el plazo se aplica a cada fragmento y solo se
+        reintenta si el fallo llega antes del primer fragmento (después ya se
+        han entregado datos al cliente). `on_attempt` como en `call`.
+        """
+        self.calls += 1
+        deadline = self._clock() + self.total_timeout
+        attempt = 0
+        while True:
+            trial = self._check_breaker()
+            start = self._clock()
+            iterator = None
+            received = False
+            try:
+                iterator = factory().__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    received = True
+                    yield chunk
+            except Exception as e:
+                if on_attempt is not None:
+                    on_attempt(self._clock() - start, False)
+                delay = self._handle_failure(e, attempt, deadline, retriable=not received)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelada o abandonada por quien consume el stream
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            finally:
+                if hasattr(iterator, "aclose"):
+                    await iterator.aclose()
+
+            self.breaker.record_success()
+            self.latency.record(self._clock() - start)
+            if on_attempt is not None:
+                on_attempt(self._clock() - start, True)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado del circuito y contadores de la política"""
+        p50 = self.latency.percentile(0.5)
+        p95 = self.latency.percentile(0.95)
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "times_opened": self.breaker.times_opened,
+            "short_circuited": self.breaker.rejected,
+            "calls": self.calls,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "hedging": self.hedging,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None
+        }
+
+
+# Instancia compartida por los servicios de Gemini del worker (mismo circuito)
+gemini_resilience = ResiliencePolicy()
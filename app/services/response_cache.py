@@ -0,0 +1,282 @@
+"""
+Caché persistente de respuestas del modelo compartida entre workers.
+
+Gunicorn levanta varios workers y cada uno regeneraba desde cero las mismas
+rutinas. Las respuestas se guardan en un archivo SQLite local indexadas por
+el hash del prompt canonizado y el nombre del modelo, con caducidad (TTL),
+expulsión LRU cuando se supera el tamaño máximo y contadores de aciertos y
+fallos visibles desde cualquier worker.
+
+Las lecturas solo hacen un SELECT y se ejecutan en un hilo (`asyncio.to_thread`)
+para no bloquear el bucle de eventos. Los últimos accesos (para el LRU) y los
+contadores se acumulan en memoria y se escriben por lotes junto con la
+siguiente escritura, cada `LLM_CACHE_FLUSH_BATCH` lecturas o cada
+`LLM_CACHE_FLUSH_INTERVAL` segundos, así que un acierto no toma el bloqueo de
+escritura que comparten todos los workers.
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from typing import Dict, Optional
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+# Lecturas y segundos máximos antes de escribir los accesos y contadores pendientes
+LLM_CACHE_FLUSH_BATCH = int(os.getenv("LLM_CACHE_FLUSH_BATCH", "100"))
+LLM_CACHE_FLUSH_INTERVAL = float(os.getenv("LLM_CACHE_FLUSH_INTERVAL", "30"))
+
+
+def default_cache_path() -> str:
+    """Ruta por defecto del archivo de caché (mismo criterio que sqlite_helper)"""
+    if os.getenv("LLM_CACHE_PATH"):
+        return os.getenv("LLM_CACHE_PATH")
+    if os.environ.get("VERCEL"):
+        db_dir = "/tmp"
+    else:
+        db_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db")
+    os.makedirs(db_dir, exist_ok=True)
+    return os.path.join(db_dir, "llm_cache.db")
+
+
+def canonicalize_prompt(prompt: str) -> str:
+    """Normaliza el prompt para que diferencias de espaciado no cambien la clave"""
+    return " ".join(prompt.split())
+
+
+def make_cache_key(prompt: str, model_name: str) -> str:
+    """Clave de caché: hash del nombre del modelo y el prompt canonizado"""
+    payload = f"{model_name}\n{canonicalize_prompt(prompt)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Caché LRU con TTL sobre SQLite, segura para varios procesos"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: int = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        enabled: bool = LLM_CACHE_ENABLED,
+        flush_batch: int = LLM_CACHE_FLUSH_BATCH,
+        flush_interval: float = LLM_CACHE_FLUSH_INTERVAL
+    ):
+        self._path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._initialized = False
+        # Accesos (clave -> último acceso) y contadores pendientes de escribir
+        self._lock = threading.Lock()
+        self._pending_access: Dict[str, float] = {}
+        self._pending_counts: Dict[str, int] = {}
+        self._pending_reads = 0
+        self._last_flush = time.monotonic()
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = default_cache_path()
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        """Abre una conexión (y crea las tablas la primera vez)"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache (last_access)")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            ''')
+            conn.commit()
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _increment(conn: sqlite3.Connection, name: str, amount: int = 1):
+        """Incrementa un contador compartido"""
+        conn.execute(
+            "INSERT INTO llm_cache_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _note(self, key: Optional[str], now: float, *counters: str) -> bool:
+        """Anota un acceso y sus contadores; indica si toca escribir los pendientes"""
+        with self._lock:
+            if key is not None:
+                self._pending_access[key] = now
+            for name in counters:
+                self._pending_counts[name] = self._pending_counts.get(name, 0) + 1
+            self._pending_reads += 1
+            return (self._pending_reads >= self.flush_batch
+                    or time.monotonic() - self._last_flush >= self.flush_interval)
+
+    def _flush(self, conn: sqlite3.Connection):
+        """Escribe los accesos y contadores pendientes (sin confirmar la transacción)"""
+        with self._lock:
+            accesses = list(self._pending_access.items())
+            counts = list(self._pending_counts.items())
+            self._pending_access.clear()
+            self._pending_counts.clear()
+            self._pending_reads = 0
+            self._last_flush = time.monotonic()
+        if accesses:
+            conn.executemany(
+                "UPDATE llm_cache SET last_access = MAX(last_access, ?) WHERE key = ?",
+                [(accessed, key) for key, accessed in accesses]
+            )
+        for name, amount in counts:
+            self._increment(conn, name, amount)
+
+    def flush(self):
+        """Escribe ya los accesos y contadores pendientes de este worker"""
+        try:
+            conn = self._connect()
+            try:
+                self._flush(conn)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al guardar los contadores de la caché: {str(e)}")
+
+    def _read(self, key: str) -> Optional[str]:
+        """Consulta bloqueante de solo lectura (los accesos se escriben por lotes)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row and now - row[1] <= self.ttl:
+            due = self._note(key, now, "hits")
+            response = row[0]
+        else:
+            # Las entradas caducadas se borran en la siguiente escritura
+            due = self._note(None, now, "misses", *(["expired"] if row else []))
+            response = None
+        if due:
+            self.flush()
+        return response
+
+    async def get(self, prompt: str, model_name: str) -> Optional[str]:
+        """Devuelve la respuesta guardada para el prompt o None si no existe o caducó"""
+        if not self.enabled:
+            return None
+
+        key = make_cache_key(prompt, model_name)
+        try:
+            return await asyncio.to_thread(self._read, key)
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al leer la caché de respuestas: {str(e)}")
+            return None
+
+    async def set(self, prompt: str, model_name: str, response: str):
+        """Guarda una respuesta y expulsa las entradas menos usadas si hace falta"""
+        if not self.enabled:
+            return
+
+        key = make_cache_key(prompt, model_name)
+        try:
+            await asyncio.to_thread(self._write, key, model_name, response)
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al escribir en la caché de respuestas: {str(e)}")
+
+    def _write(self, key: str, model_name: str, response: str):
+        """Escritura bloqueante de una respuesta junto con los accesos pendientes"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            self._flush(conn)
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, now, now)
+            )
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+
+            count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._increment(conn, "evictions", overflow)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def clear(self):
+        """Elimina todas las entradas y reinicia los contadores"""
+        with self._lock:
+            self._pending_access.clear()
+            self._pending_counts.clear()
+            self._pending_reads = 0
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM llm_cache")
+            conn.execute("DELETE FROM llm_cache_stats")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, object]:
+        """Contadores compartidos por todos los workers más los pendientes de este"""
+        result: Dict[str, object] = {
+            "enabled": self.enabled,
+            "entries": 0,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0
+        }
+        if not self.enabled:
+            return result
+        try:
+            conn = self._connect()
+            try:
+                result["entries"] = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                for name, value in conn.execute("SELECT name, value FROM llm_cache_stats"):
+                    result[name] = value
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al leer estadísticas de la caché: {str(e)}")
+        with self._lock:
+            for name, amount in self._pending_counts.items():
+                result[name] = result.get(name, 0) + amount
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+        return result
+
+
+# Instancia compartida por los servicios de IA del proceso
+response_cache = ResponseCache()
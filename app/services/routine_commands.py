@@ -0,0 +1,319 @@
+"""
+Comandos locales para las ediciones mecánicas de una rutina.
+
+Muchos mensajes del chat son cambios concretos que no necesitan al modelo:
+"pon 4 series en sentadilla", "quita el press militar", "descanso de 90
+segundos en todo". El intérprete reconoce series, repeticiones, descanso,
+quitar o añadir un ejercicio por su nombre e intercambiar dos días, y los
+convierte en operaciones de `routine_patch` que se aplican al momento. La
+explicación se genera con `routine_diff`, también sin llamar al modelo.
+
+Solo se aplican los mensajes que encajan por completo en una de las formas
+conocidas y cuyas referencias (ejercicios y días) se resuelven sin
+ambigüedad; cualquier otro mensaje sigue el camino normal con el modelo.
+Las ediciones destructivas o que admiten otra lectura tampoco se aplican
+aquí: quitar toda la rutina o dejar un día sin ejercicios lo confirma el
+modelo, y solo "intercambia" se entiende como intercambio de días ("cambia
+el lunes por el viernes" puede querer decir otra cosa).
+"""
+import os
+import re
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+from app.models.models import Routine
+from app.services.routine_patch import PatchError, apply_routine_patch
+from app.services.routine_diff import diff_routines, render_explanation
+
+LOCAL_COMMANDS_ENABLED = os.getenv("LOCAL_COMMANDS_ENABLED", "true").lower() == "true"
+
+# Valores por defecto de un ejercicio nuevo que no aparece en la rutina
+DEFAULT_EXERCISE = {"sets": 3, "reps": "8-12", "rest": "60-90 seg", "equipment": "No especificado"}
+
+DAY_NAMES = ("lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo")
+
+# Referencias a la rutina completa
+ALL_TARGETS = ("todo", "todos", "toda la rutina", "la rutina", "todos los ejercicios", "todos los dias", "cada ejercicio")
+
+_ARTICLE = r"(?:(?:el|la|los|las|del|al|un|una)\s+)?"
+_VALUE = r"(?P<value>\d+(?:\s*-\s*\d+)?)"
+_SET_VERBS = r"(?:(?:pon|ponme|pone|cambia|sube|baja|ajusta|deja|haz|hazme|cambiame|subeme|bajame)\s+(?:a\s+)?)?"
+
+# Formas reconocidas: (intención, expresión sobre el texto normalizado)
+COMMAND_PATTERNS: Tuple[Tuple[str, str], ...] = (
+    ("sets", rf"{_SET_VERBS}(?P<value>\d+)\s+series\s+(?:en|de|a|para|al|del|el|la|los|las)\s+(?P<target>.+)"),
+    ("sets", rf"{_SET_VERBS}(?:las\s+)?series\s+(?:de|del|en|para)\s+(?P<target>.+?)\s+a\s+(?P<value>\d+)"),
+    ("reps", rf"{_SET_VERBS}{_VALUE}\s+(?:repeticiones|reps)\s+(?:en|de|a|para|al|del|el|la|los|las)\s+(?P<target>.+)"),
+    ("reps", rf"{_SET_VERBS}(?:las\s+)?(?:repeticiones|reps)\s+(?:de|del|en|para)\s+(?P<target>.+?)\s+a\s+{_VALUE}"),
+    ("rest", rf"{_SET_VERBS}(?:un\s+)?descanso\s+(?:de\s+)?{_VALUE}\s*(?P<unit>segundos|seg|s|minutos|min)"
+             rf"\s+(?:en|para|a|de|el|la)\s+(?P<target>.+)"),
+    ("rest", rf"descansa\s+{_VALUE}\s*(?P<unit>segundos|seg|s|minutos|min)\s+(?:en|para|a|de|el|la)\s+(?P<target>.+)"),
+    ("swap", r"(?:intercambia|intercambiame|intercambiar)\s+(?P<first>.+?)\s+(?:y|con|por)\s+(?P<second>.+)"),
+    ("remove", r"(?:quita|quitame|quitar|elimina|eliminame|eliminar|borra|borrame|borrar|saca|sacame)\s+(?P<target>.+)"),
+    ("add", r"(?:anade|anademe|agrega|agregame|incluye|incluyeme|mete|meteme)\s+(?:(?P<value>\d+)\s+series\s+de\s+)?"
+            r"(?P<name>.+?)\s+(?:al|el|en el|para el|en)\s+(?P<day>.+)"),
+)
+
+# Separadores de varias instrucciones en un mismo mensaje
+CLAUSE_SEPARATORS = r"\s*(?:[,;.]|\s+y\s+(?=(?:pon|ponme|quita|elimina|borra|saca|anade|agrega|incluye|mete|"\
+                    r"sube|baja|cambia|descanso|intercambia)\b))\s*"
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas, sin acentos ni puntuación (se conservan los guiones de los rangos)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"\bpor favor\b", " ", text)
+    return " ".join(re.sub(r"[^\w\s,;.\-]", " ", text).split()).strip(" ,;.")
+
+
+def _stem(text: str) -> str:
+    """Raíz aproximada de cada palabra para que singular y plural coincidan"""
+    words = []
+    for word in text.split():
+        if len(word) > 4 and word.endswith("es"):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        words.append(word)
+    return " ".join(words)
+
+
+def _strip_article(text: str) -> str:
+    return re.sub(rf"^{_ARTICLE}", "", text.strip()).strip()
+
+
+class _Resolver:
+    """Resuelve las referencias del mensaje a días y ejercicios de la rutina"""
+
+    def __init__(self, routine: Routine):
+        self.routine = routine
+        self.exercise_keys = [[_stem(_normalize(e.name)) for e in day.exercises] for day in routine.days]
+
+    def day(self, reference: str) -> Optional[int]:
+        """Índice del día nombrado por su nombre, su posición o su enfoque (solo si es único)"""
+        reference = _strip_article(re.sub(r"^(?:el|la)\s+de\s+", "", reference.strip()))
+        reference = _strip_article(re.sub(r"^dia\s+(?:de\s+)?", "", reference))
+        if not reference:
+            return None
+        for index, day in enumerate(self.routine.days):
+            if _normalize(day.day_name) == reference:
+                return index
+        match = re.fullmatch(r"(\d+)", reference)
+        if match and 1 <= int(match.group(1)) <= len(self.routine.days):
+            return int(match.group(1)) - 1
+        if reference in DAY_NAMES:
+            return None
+        stem = _stem(reference)
+        matches = [index for index, day in enumerate(self.routine.days) if _stem(_normalize(day.focus)) == stem
+                   or stem in _stem(_normalize(day.focus)).split()]
+        return matches[0] if len(matches) == 1 else None
+
+    def exercises(self, reference: str) -> Optional[List[Tuple[int, int]]]:
+        """
+        Posiciones (día, ejercicio) a las que se refiere el texto: todos, un día
+        completo o un ejercicio por su nombre, opcionalmente limitado a un día
+        ("sentadilla del lunes"). None si no se resuelve sin ambigüedad.
+        """
+        reference = _strip_article(reference)
+        if reference in ALL_TARGETS:
+            return [(d, e) for d, day in enumerate(self.routine.days) for e in range(len(day.exercises))]
+
+        day_only = self.day(reference)
+        if day_only is not None:
+            return [(day_only, e) for e in range(len(self.routine.days[day_only].exercises))]
+
+        days = list(range(len(self.routine.days)))
+        limited = re.fullmatch(r"(?P<name>.+?)\s+(?:del|el|en el|de el)\s+(?P<day>.+)", reference)
+        if limited:
+            day_index = self.day(limited.group("day"))
+            if day_index is not None:
+                reference, days = limited.group("name"), [day_index]
+
+        name = _stem(_strip_article(reference))
+        if not name:
+            return None
+        exact = [(d, e) for d in days for e, key in enumerate(self.exercise_keys[d]) if key == name]
+        if exact:
+            return exact
+        # Un nombre parcial vale si identifica a un único ejercicio ("banca" -> "Press de banca")
+        partial = [(d, e) for d in days for e, key in enumerate(self.exercise_keys[d])
+                   if re.search(rf"\b{re.escape(name)}\b", key)]
+        names = {self.exercise_keys[d][e] for d, e in partial}
+        return partial if len(names) == 1 else None
+
+    def known_exercise(self, name: str) -> Optional[Dict[str, Any]]:
+        """Ejercicio con ese nombre en cualquier día de la rutina"""
+        key = _stem(_normalize(name))
+        for d, day in enumerate(self.routine.days):
+            for e, exercise in enumerate(day.exercises):
+                if self.exercise_keys[d][e] == key:
+                    return exercise.model_dump()
+        return None
+
+
+def _format_rest(value: str, unit: str) -> str:
+    value = value.replace(" ", "")
+    return f"{value} min" if unit.startswith("min") else f"{value} seg"
+
+
+def _clause_operations(resolver: _Resolver, clause: str, original: str) -> Optional[List[Dict[str, Any]]]:
+    """Operaciones de una instrucción, o None si no encaja en ninguna forma conocida"""
+    for intent, pattern in COMMAND_PATTERNS:
+        match = re.fullmatch(pattern, clause)
+        if not match:
+            continue
+        groups = match.groupdict()
+
+        if intent in ("sets", "reps", "rest"):
+            positions = resolver.exercises(groups["target"])
+            if not positions:
+                continue
+            if intent == "sets":
+                field, value = "sets", int(groups["value"])
+                if not 1 <= value <= 20:
+                    return None
+            elif intent == "reps":
+                field, value = "reps", groups["value"].replace(" ", "")
+            else:
+                field, value = "rest", _format_rest(groups["value"], groups["unit"])
+            return [{"op": "replace", "path": f"/days/{d}/exercises/{e}/{field}", "value": value}
+                    for d, e in positions]
+
+        if intent == "remove":
+            if _strip_article(groups["target"]) in ALL_TARGETS:
+                # Vaciar la rutina no se hace sin confirmación: lo decide el modelo
+                continue
+            positions = resolver.exercises(groups["target"])
+            if not positions or resolver.day(groups["target"]) is not None:
+                # Quitar un día completo cambia la estructura de la rutina: lo decide el modelo
+                continue
+            # De atrás hacia delante para que los índices sigan siendo válidos
+            return [{"op": "remove", "path": f"/days/{d}/exercises/{e}"} for d, e in sorted(positions, reverse=True)]
+
+        if intent == "add":
+            day_index = resolver.day(groups["day"])
+            name = _strip_article(groups["name"])
+            if day_index is None or not name or re.search(r"\b(serie|series|repeticion|repeticiones|dia|dias)\b", name):
+                continue
+            exercise = resolver.known_exercise(name) or dict(DEFAULT_EXERCISE, name=_original_name(original, name))
+            if groups.get("value"):
+                exercise["sets"] = int(groups["value"])
+            return [{"op": "add", "path": f"/days/{day_index}/exercises/-", "value": exercise}]
+
+        if intent == "swap":
+            first, second = resolver.day(groups["first"]), resolver.day(groups["second"])
+            if first is None or second is None or first == second:
+                continue
+            days = resolver.routine.days
+            return [
+                {"op": "replace", "path": f"/days/{first}/focus", "value": days[second].focus},
+                {"op": "replace", "path": f"/days/{first}/exercises",
+                 "value": [e.model_dump() for e in days[second].exercises]},
+                {"op": "replace", "path": f"/days/{second}/focus", "value": days[first].focus},
+                {"op": "replace", "path": f"/days/{second}/exercises",
+                 "value": [e.model_dump() for e in days[first].exercises]}
+            ]
+    return None
+
+
+def _original_name(message: str, normalized_name: str) -> str:
+    """Nombre del ejercicio nuevo tal y como lo escribió el usuario (con acentos)"""
+    words = len(normalized_name.split())
+    for start in range(len(message.split())):
+        candidate = " ".join(message.split()[start:start + words]).strip(" ,;.")
+        if _normalize(candidate) == normalized_name:
+            return candidate[:1].upper() + candidate[1:]
+    return normalized_name[:1].upper() + normalized_name[1:]
+
+
+def _empties_a_day(routine: Routine, operations: List[Dict[str, Any]]) -> bool:
+    """Indica si las eliminaciones dejan algún día sin ejercicios"""
+    removed: Dict[int, int] = {}
+    for op in operations:
+        if op["op"] == "remove":
+            day = int(op["path"].split("/")[2])
+            removed[day] = removed.get(day, 0) + 1
+    added = {int(op["path"].split("/")[2]) for op in operations if op["op"] == "add"}
+    return any(count >= len(routine.days[day].exercises) and day not in added for day, count in removed.items())
+
+
+def parse_command(routine: Routine, message: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Operaciones de `routine_patch` equivalentes al mensaje, o None si alguna
+    parte del mensaje no se reconoce con seguridad
+    """
+    text = _normalize(message)
+    if not text or not routine.days:
+        return None
+    resolver = _Resolver(routine)
+    whole = _clause_operations(resolver, text.strip(" ,;."), message)
+    if whole is not None:
+        # Dejar un día vacío es destructivo: lo confirma el modelo
+        return None if _empties_a_day(routine, whole) else whole
+
+    operations: List[Dict[str, Any]] = []
+    clauses = [clause for clause in re.split(CLAUSE_SEPARATORS, text) if clause]
+    if len(clauses) < 2:
+        return None
+    for clause in clauses:
+        clause_operations = _clause_operations(resolver, clause, message)
+        if clause_operations is None:
+            return None
+        operations.extend(clause_operations)
+    if any(op["path"].endswith("/exercises") for op in operations) or _empties_a_day(routine, operations):
+        # Un intercambio de días junto a otras instrucciones es ambiguo y vaciar un día, destructivo
+        return None
+    # Las eliminaciones al final y de atrás hacia delante para no desplazar los índices de las demás
+    removals = sorted((op for op in operations if op["op"] == "remove"),
+                      key=lambda op: [int(part) for part in op["path"].split("/")[2::2]], reverse=True)
+    return [op for op in operations if op["op"] != "remove"] + removals
+
+
+class LocalCommands:
+    """Aplica los comandos locales y lleva la cuenta de la tasa de acierto"""
+
+    def __init__(self, enabled: bool = LOCAL_COMMANDS_ENABLED):
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def apply(self, routine: Routine, message: str) -> Optional[Tuple[Routine, str]]:
+        """Rutina modificada y explicación, o None si el mensaje necesita al modelo"""
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        operations = parse_command(routine, message)
+        result = None
+        if operations:
+            try:
+                modified = apply_routine_patch(routine, operations)
+                result = modified, render_explanation(diff_routines(routine, modified))
+            except PatchError as e:
+                print(f"⚠️ Comando local no aplicable ({str(e)}), usando el modelo")
+
+        if result is None:
+            self.misses += 1
+            print(f"💬 Mensaje sin comando local, se envía al modelo (tasa de acierto {self.hit_rate():.0%})")
+        else:
+            self.hits += 1
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"⚡ Comando local aplicado en {elapsed_ms:.2f} ms ({len(operations)} operaciones, "
+                  f"tasa de acierto {self.hit_rate():.0%})")
+        return result
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 3)
+        }
+
+
+# Instancia compartida por el generador del worker
+local_commands = LocalCommands()
@@ -0,0 +1,123 @@
+"""
+Diferencias estructurales entre dos versiones de una rutina.
+
+Compara `Routine`/`Day`/`Exercise` y genera una explicación en español con
+plantillas, sin llamar al modelo. Los días se emparejan por nombre y los
+ejercicios por nombre dentro de cada día.
+"""
+from typing import Any, Dict, List
+from app.models.models import Day, Exercise, Routine
+
+# Campos de un ejercicio que se comparan y cómo se nombran en la explicación
+EXERCISE_FIELDS = {
+    "sets": "series",
+    "reps": "repeticiones",
+    "rest": "descanso",
+    "equipment": "equipamiento"
+}
+
+Change = Dict[str, Any]
+
+
+def _key(name: str) -> str:
+    """Clave normalizada para emparejar días y ejercicios por nombre"""
+    return " ".join(name.lower().split())
+
+
+def _diff_exercises(day_name: str, old_day: Day, new_day: Day) -> List[Change]:
+    """Cambios entre los ejercicios de un mismo día"""
+    changes: List[Change] = []
+    old_exercises = {_key(e.name): e for e in old_day.exercises}
+    new_exercises = {_key(e.name): e for e in new_day.exercises}
+
+    for key, exercise in old_exercises.items():
+        if key not in new_exercises:
+            changes.append({"type": "exercise_removed", "day": day_name, "exercise": exercise.name})
+
+    for key, exercise in new_exercises.items():
+        if key not in old_exercises:
+            changes.append({"type": "exercise_added", "day": day_name, "exercise": exercise.name,
+                            "sets": exercise.sets, "reps": exercise.reps})
+            continue
+        old_exercise: Exercise = old_exercises[key]
+        for field in EXERCISE_FIELDS:
+            old_value = getattr(old_exercise, field)
+            new_value = getattr(exercise, field)
+            if old_value != new_value:
+                changes.append({"type": "exercise_field", "day": day_name, "exercise": exercise.name,
+                                "field": field, "old": old_value, "new": new_value})
+
+    # Orden relativo de los ejercicios que siguen en el día
+    old_order = [k for k in old_exercises if k in new_exercises]
+    new_order = [k for k in new_exercises if k in old_exercises]
+    if old_order != new_order:
+        changes.append({"type": "exercises_reordered", "day": day_name})
+
+    return changes
+
+
+def diff_routines(old: Routine, new: Routine) -> List[Change]:
+    """Lista de cambios estructurales entre dos rutinas"""
+    changes: List[Change] = []
+
+    if old.routine_name != new.routine_name:
+        changes.append({"type": "routine_name", "old": old.routine_name, "new": new.routine_name})
+
+    old_days = {_key(d.day_name): d for d in old.days}
+    new_days = {_key(d.day_name): d for d in new.days}
+
+    for key, day in old_days.items():
+        if key not in new_days:
+            changes.append({"type": "day_removed", "day": day.day_name})
+
+    for key, day in new_days.items():
+        if key not in old_days:
+            changes.append({"type": "day_added", "day": day.day_name, "focus": day.focus,
+                            "exercises": len(day.exercises)})
+            continue
+        old_day = old_days[key]
+        if old_day.focus != day.focus:
+            changes.append({"type": "focus", "day": day.day_name, "old": old_day.focus, "new": day.focus})
+        changes.extend(_diff_exercises(day.day_name, old_day, day))
+
+    old_order = [k for k in old_days if k in new_days]
+    new_order = [k for k in new_days if k in old_days]
+    if old_order != new_order:
+        changes.append({"type": "days_reordered"})
+
+    return changes
+
+
+def describe_change(change: Change) -> str:
+    """Frase en español para un cambio"""
+    kind = change["type"]
+    if kind == "routine_name":
+        return f"Cambié el nombre de la rutina a \"{change['new']}\"."
+    if kind == "day_added":
+        count = change["exercises"]
+        return f"Añadí el día {change['day']} ({change['focus']}) con {count} ejercicio{'' if count == 1 else 's'}."
+    if kind == "day_removed":
+        return f"Eliminé el día {change['day']}."
+    if kind == "days_reordered":
+        return "Reorganicé el orden de los días de entrenamiento."
+    if kind == "focus":
+        return f"El día {change['day']} ahora se centra en {change['new']} (antes: {change['old']})."
+    if kind == "exercise_added":
+        return f"Añadí {change['exercise']} al día {change['day']} ({change['sets']} series de {change['reps']})."
+    if kind == "exercise_removed":
+        return f"Quité {change['exercise']} del día {change['day']}."
+    if kind == "exercises_reordered":
+        return f"Cambié el orden de los ejercicios del día {change['day']}."
+    if kind == "exercise_field":
+        label = EXERCISE_FIELDS[change["field"]]
+        return f"{change['exercise']} ({change['day']}): {label} de {change['old']} a {change['new']}."
+    return ""
+
+
+def render_explanation(changes: List[Change]) -> str:
+    """Explicación con plantillas a partir de la lista de cambios"""
+    if not changes:
+        return "He revisado tu solicitud, pero no ha sido necesario cambiar la rutina."
+
+    lines = [f"- {describe_change(change)}" for change in changes]
+    return "He actualizado tu rutina:\n" + "\n".join(lines) + "\n¡Sigue así, cada ajuste te acerca a tu objetivo!"
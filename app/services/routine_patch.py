@@ -0,0 +1,123 @@
+"""
+Aplicación local de operaciones de modificación estilo JSON Patch (RFC 6902).
+
+En lugar de pedir al modelo que repita la rutina completa en cada mensaje del
+chat, se le pide una lista compacta de operaciones (`add`, `remove`,
+`replace`) sobre rutas de días y ejercicios. El servidor las aplica sobre una
+copia de la rutina y valida el resultado contra `Routine`.
+"""
+import copy
+from typing import Any, Dict, List, Union
+from pydantic import ValidationError
+from app.models.models import Routine
+from app.services.json_repair import coerce_routine_dict
+
+SUPPORTED_OPS = ("add", "remove", "replace")
+
+# Solo el nombre y los días pueden modificarse; el resto lo controla el servidor
+EDITABLE_ROOTS = ("routine_name", "days")
+
+
+class PatchError(ValueError):
+    """Operación de modificación no válida o que produce una rutina inválida"""
+
+
+def _parse_path(path: Any) -> List[str]:
+    """Convierte una ruta JSON Pointer en su lista de segmentos"""
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise PatchError(f"Ruta no válida: {path!r}")
+    tokens = [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+    if not tokens or tokens[0] not in EDITABLE_ROOTS:
+        raise PatchError(f"La ruta {path!r} no apunta a un campo editable")
+    return tokens
+
+
+def _list_index(container: list, token: str, allow_end: bool) -> int:
+    """Interpreta un segmento como índice de lista"""
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit():
+        raise PatchError(f"Índice de lista no válido: {token!r}")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise PatchError(f"Índice fuera de rango: {index}")
+    return index
+
+
+def _resolve_parent(document: Dict[str, Any], tokens: List[str]) -> Union[dict, list]:
+    """Devuelve el contenedor padre del último segmento de la ruta"""
+    node: Any = document
+    for token in tokens[:-1]:
+        if isinstance(node, list):
+            node = node[_list_index(node, token, allow_end=False)]
+        elif isinstance(node, dict):
+            if token not in node:
+                raise PatchError(f"La ruta no existe: {token!r}")
+            node = node[token]
+        else:
+            raise PatchError(f"No se puede navegar dentro de {token!r}")
+    if not isinstance(node, (dict, list)):
+        raise PatchError("La ruta no apunta a un contenedor")
+    return node
+
+
+def _apply_operation(document: Dict[str, Any], operation: Dict[str, Any]):
+    """Aplica una operación sobre el documento (modificándolo)"""
+    if not isinstance(operation, dict):
+        raise PatchError(f"Operación no válida: {operation!r}")
+
+    op = operation.get("op")
+    if op not in SUPPORTED_OPS:
+        raise PatchError(f"Operación no soportada: {op!r}")
+
+    tokens = _parse_path(operation.get("path"))
+    if op != "remove" and "value" not in operation:
+        raise PatchError(f"La operación {op!r} necesita un valor")
+
+    if len(tokens) == 1:
+        # Operación sobre un campo raíz (routine_name o days completo)
+        if op == "remove":
+            raise PatchError(f"No se puede eliminar el campo {tokens[0]!r}")
+        document[tokens[0]] = copy.deepcopy(operation["value"])
+        return
+
+    parent = _resolve_parent(document, tokens)
+    last = tokens[-1]
+
+    if isinstance(parent, list):
+        if op == "add":
+            parent.insert(_list_index(parent, last, allow_end=True), copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            del parent[_list_index(parent, last, allow_end=False)]
+        else:
+            parent[_list_index(parent, last, allow_end=False)] = copy.deepcopy(operation["value"])
+    else:
+        if op in ("remove", "replace") and last not in parent:
+            raise PatchError(f"El campo {last!r} no existe")
+        if op == "remove":
+            del parent[last]
+        else:
+            parent[last] = copy.deepcopy(operation["value"])
+
+
+def apply_routine_patch(routine: Routine, operations: List[Dict[str, Any]]) -> Routine:
+    """
+    Aplica la lista de operaciones sobre una copia de la rutina y valida el
+    resultado. Lanza PatchError si alguna operación o el resultado no es válido.
+    """
+    if not isinstance(operations, list):
+        raise PatchError("Las operaciones deben ser una lista")
+
+    document = routine.model_dump(mode="json")
+    for operation in operations:
+        _apply_operation(document, operation)
+
+    # El servidor conserva siempre los campos que no son editables
+    document["id"] = routine.id
+    document["user_id"] = routine.user_id
+
+    try:
+        return Routine.model_validate(coerce_routine_dict(document))
+    except ValidationError as e:
+        raise PatchError(f"La rutina resultante no es válida: {str(e)}")
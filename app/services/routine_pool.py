@@ -0,0 +1,473 @@
+"""
+Reserva de rutinas pregeneradas para las combinaciones más pedidas.
+
+Casi todas las peticiones de creación caen en unas pocas combinaciones de
+objetivo, días, nivel y equipamiento. Cada petición se clasifica en su
+combinación y suma a una puntuación de demanda que se reduce a la mitad cada
+`ROUTINE_POOL_DEMAND_HALF_LIFE`. En las horas valle (`ROUTINE_POOL_OFF_PEAK_HOURS`)
+una tarea en segundo plano genera y valida rutinas para las combinaciones con
+más demanda hasta tener `ROUTINE_POOL_SIZE` de cada una. Al crear una rutina,
+si hay una reserva para su combinación se sirve al instante y se repone en
+segundo plano.
+
+Solo se clasifican las peticiones cuyo objetivo es exactamente uno de los
+objetivos canónicos (`CANONICAL_GOALS`), con un nivel y un equipamiento también
+canónicos o sin indicar. Cualquier matiz en el texto ("...pero tengo una lesión
+de rodilla", "preparar una media maratón") cambia la rutina que espera el
+usuario, así que esas peticiones siempre van al modelo.
+
+La reserva, la demanda y los contadores viven en el mismo archivo SQLite que
+la caché de respuestas, así que los comparten todos los workers, y un
+arrendamiento evita que varios workers rellenen la reserva a la vez. Las
+consultas a SQLite se hacen en un hilo para no bloquear el bucle de eventos
+mientras se espera el bloqueo de escritura.
+"""
+import os
+import re
+import time
+import sqlite3
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+from app.models.models import Routine, RoutineRequest
+from app.services.response_cache import default_cache_path
+from app.services.resilience import LLMUnavailableError
+from app.services.exercise_library import (
+    BEGINNER, INTERMEDIATE, ADVANCED, GENERAL_GOAL,
+    equipment_label, normalize, parse_equipment, parse_level
+)
+
+ROUTINE_POOL_ENABLED = os.getenv("ROUTINE_POOL_ENABLED", "true").lower() == "true"
+
+# Rutinas listas que se mantienen de cada combinación
+ROUTINE_POOL_SIZE = int(os.getenv("ROUTINE_POOL_SIZE", "2"))
+
+# Combinaciones con más demanda que se mantienen en la reserva
+ROUTINE_POOL_TOP = int(os.getenv("ROUTINE_POOL_TOP", "20"))
+
+# Horas (locales) en las que se rellena la reserva, "inicio-fin" (p. ej. "2-7" o "23-6")
+ROUTINE_POOL_OFF_PEAK_HOURS = os.getenv("ROUTINE_POOL_OFF_PEAK_HOURS", "2-7")
+
+# Segundos entre comprobaciones de la tarea de relleno
+ROUTINE_POOL_REFILL_INTERVAL = float(os.getenv("ROUTINE_POOL_REFILL_INTERVAL", "600"))
+
+# Antigüedad máxima de una rutina de la reserva (segundos)
+ROUTINE_POOL_MAX_AGE = float(os.getenv("ROUTINE_POOL_MAX_AGE", str(7 * 24 * 60 * 60)))
+
+# Vida media de la puntuación de demanda (segundos)
+ROUTINE_POOL_DEMAND_HALF_LIFE = float(os.getenv("ROUTINE_POOL_DEMAND_HALF_LIFE", str(7 * 24 * 60 * 60)))
+
+# Usuario con el que se generan las rutinas de la reserva (tiene su propio bucket del limitador)
+POOL_USER_ID = 0
+
+# Textos de las peticiones con las que se generan las rutinas de cada combinación
+GOAL_LABELS = {
+    "fuerza": "Ganar fuerza",
+    "hipertrofia": "Ganar masa muscular (hipertrofia)",
+    "resistencia": "Mejorar la resistencia y perder grasa",
+    GENERAL_GOAL: "Mejorar la forma física general"
+}
+LEVEL_LABELS = {BEGINNER: "principiante", INTERMEDIATE: "intermedio", ADVANCED: "avanzado"}
+
+# Textos de objetivo (canonizados) que se sirven desde la reserva
+CANONICAL_GOALS = {
+    "fuerza": "fuerza",
+    "ganar fuerza": "fuerza",
+    "hipertrofia": "hipertrofia",
+    "ganar masa muscular": "hipertrofia",
+    "ganar masa muscular hipertrofia": "hipertrofia",
+    "mejorar la resistencia y perder grasa": "resistencia",
+    "forma fisica general": GENERAL_GOAL,
+    "mejorar la forma fisica general": GENERAL_GOAL
+}
+
+# Textos de equipamiento (canonizados) que admite la reserva, además de los de `equipment_label`
+CANONICAL_EQUIPMENT = {
+    "", "gimnasio", "gimnasio completo", "gym", "sin equipo", "ninguno", "peso corporal",
+    "mancuernas", "barra", "kettlebell", "bandas elasticas"
+}
+
+
+class PoolCombination(NamedTuple):
+    """Combinación de petición que comparte rutinas pregeneradas"""
+    goal: str
+    days: int
+    level: int
+    equipment: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.goal}|{self.days}|{self.level}|{self.equipment}"
+
+    def template(self) -> RoutineRequest:
+        """Petición con la que se generan las rutinas de la combinación"""
+        return RoutineRequest(
+            goals=GOAL_LABELS[self.goal],
+            equipment=self.equipment,
+            days=self.days,
+            experience_level=LEVEL_LABELS[self.level],
+            user_id=POOL_USER_ID
+        )
+
+
+def canonical_text(text: str) -> str:
+    """Texto sin acentos, mayúsculas, signos ni espacios repetidos"""
+    return re.sub(r"[^a-z0-9]+", " ", normalize(text)).strip()
+
+
+def combination_for(request: RoutineRequest) -> Optional[PoolCombination]:
+    """
+    Combinación de la petición, o None si algún campo no es exactamente un
+    valor canónico (la petición tiene matices que solo atiende el modelo).
+    """
+    goal = CANONICAL_GOALS.get(canonical_text(request.goals))
+    if goal is None or not 1 <= request.days <= 7:
+        return None
+    level = canonical_text(request.experience_level)
+    if level and level not in LEVEL_LABELS.values():
+        return None
+    equipment = equipment_label(parse_equipment(request.equipment))
+    text = canonical_text(request.equipment)
+    if text not in CANONICAL_EQUIPMENT and text != canonical_text(equipment):
+        return None
+    return PoolCombination(
+        goal=goal,
+        days=request.days,
+        level=parse_level(request.experience_level),
+        equipment=equipment
+    )
+
+
+def parse_hours(config: str) -> Tuple[int, int]:
+    """Rango de horas "inicio-fin" (el fin no se incluye)"""
+    start, _, end = config.partition("-")
+    return int(start) % 24, int(end or start) % 24
+
+
+class RoutinePool:
+    """Reserva de rutinas validadas por combinación, sobre SQLite"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        size: int = ROUTINE_POOL_SIZE,
+        top: int = ROUTINE_POOL_TOP,
+        off_peak_hours: str = ROUTINE_POOL_OFF_PEAK_HOURS,
+        max_age: float = ROUTINE_POOL_MAX_AGE,
+        half_life: float = ROUTINE_POOL_DEMAND_HALF_LIFE,
+        enabled: bool = ROUTINE_POOL_ENABLED
+    ):
+        self._path = path
+        self.size = size
+        self.top = top
+        self.off_peak = parse_hours(off_peak_hours)
+        self.max_age = max_age
+        self.half_life = half_life
+        self.enabled = enabled
+        self._initialized = False
+        self._generator = None
+        self._task: Optional[asyncio.Task] = None
+        self._refilling: Set[str] = set()
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = os.getenv("ROUTINE_POOL_PATH") or default_cache_path()
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        """Abre una conexión en modo autocommit (y crea las tablas la primera vez)"""
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS routine_pool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                combination TEXT NOT NULL,
+                routine TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_routine_pool_combination ON routine_pool (combination)")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS routine_pool_demand (
+                combination TEXT PRIMARY KEY,
+                goal TEXT NOT NULL,
+                days INTEGER NOT NULL,
+                level INTEGER NOT NULL,
+                equipment TEXT NOT NULL,
+                score REAL NOT NULL,
+                requests INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS routine_pool_stats (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            )
+            ''')
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _increment(conn: sqlite3.Connection, name: str, amount: int = 1):
+        """Incrementa un contador compartido"""
+        conn.execute(
+            "INSERT INTO routine_pool_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _decay(self, score: float, elapsed: float) -> float:
+        """Puntuación de demanda tras `elapsed` segundos"""
+        if self.half_life <= 0:
+            return score
+        return score * 0.5 ** (max(0.0, elapsed) / self.half_life)
+
+    def _take(self, combination: PoolCombination) -> Optional[str]:
+        """Escritura bloqueante: anota la demanda y saca una rutina de la reserva (JSON)"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT score, updated_at FROM routine_pool_demand WHERE combination = ?",
+                    (combination.key,)
+                ).fetchone()
+                score = self._decay(row[0], now - row[1]) + 1 if row else 1.0
+                conn.execute(
+                    "INSERT INTO routine_pool_demand "
+                    "(combination, goal, days, level, equipment, score, requests, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT(combination) DO UPDATE SET score = excluded.score, "
+                    "requests = requests + 1, updated_at = excluded.updated_at",
+                    (combination.key, *combination, score, now)
+                )
+                conn.execute("DELETE FROM routine_pool WHERE created_at < ?", (now - self.max_age,))
+                row = conn.execute(
+                    "SELECT id, routine FROM routine_pool WHERE combination = ? ORDER BY id LIMIT 1",
+                    (combination.key,)
+                ).fetchone()
+                if row:
+                    conn.execute("DELETE FROM routine_pool WHERE id = ?", (row[0],))
+                self._increment(conn, "hits" if row else "misses")
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al consultar la reserva de rutinas: {str(e)}")
+            return None
+        return row[1] if row else None
+
+    async def take(self, request: RoutineRequest) -> Optional[Routine]:
+        """
+        Anota la demanda de la combinación de la petición y, si hay una rutina
+        en reserva, la saca y la devuelve preparada para el usuario.
+        """
+        if not self.enabled:
+            return None
+        combination = combination_for(request)
+        if combination is None:
+            return None
+
+        stored = await asyncio.to_thread(self._take, combination)
+        if stored is None:
+            return None
+        print(f"📦 Rutina servida desde la reserva ({combination.key})")
+        self._schedule_refill(combination)
+        routine = Routine.model_validate_json(stored)
+        return routine.model_copy(update={"user_id": request.user_id, "created_at": datetime.now()})
+
+    async def put(self, combination: PoolCombination, routine: Routine):
+        """Guarda una rutina generada en la reserva de su combinación"""
+        await asyncio.to_thread(self._put, combination, routine)
+
+    def _put(self, combination: PoolCombination, routine: Routine):
+        """Escritura bloqueante de una rutina en la reserva"""
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT INTO routine_pool (combination, routine, created_at) VALUES (?, ?, ?)",
+                    (combination.key, routine.model_dump_json(exclude={"id", "created_at", "updated_at"}),
+                     time.time())
+                )
+                self._increment(conn, "refills")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al guardar en la reserva de rutinas: {str(e)}")
+
+    async def refill_plan(self) -> List[Tuple[PoolCombination, int]]:
+        """Combinaciones con más demanda y cuántas rutinas les faltan"""
+        return await asyncio.to_thread(self._refill_plan)
+
+    def _refill_plan(self) -> List[Tuple[PoolCombination, int]]:
+        """Consulta bloqueante de la demanda y de las rutinas guardadas"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            demand = conn.execute(
+                "SELECT goal, days, level, equipment, score, updated_at FROM routine_pool_demand"
+            ).fetchall()
+            stored = dict(conn.execute(
+                "SELECT combination, COUNT(*) FROM routine_pool WHERE created_at >= ? GROUP BY combination",
+                (now - self.max_age,)
+            ).fetchall())
+        finally:
+            conn.close()
+
+        ranked = sorted(demand, key=lambda row: self._decay(row[4], now - row[5]), reverse=True)
+        plan = []
+        for goal, days, level, equipment, _, _ in ranked[:self.top]:
+            combination = PoolCombination(goal, days, level, equipment)
+            missing = self.size - stored.get(combination.key, 0)
+            if missing > 0:
+                plan.append((combination, missing))
+        return plan
+
+    async def refill(self, generator, plan: Optional[List[Tuple[PoolCombination, int]]] = None) -> int:
+        """
+        Genera las rutinas que faltan, de una en una para no competir con el
+        tráfico de los usuarios. Si el modelo deja de estar disponible se para.
+        """
+        if not generator.configured:
+            return 0
+        plan = await self.refill_plan() if plan is None else plan
+        generated = 0
+        for combination, missing in plan:
+            for _ in range(missing):
+                try:
+                    routine = await generator.create_initial_routine(combination.template())
+                except LLMUnavailableError as e:
+                    print(f"⚠️ Relleno de la reserva detenido, el modelo no está disponible: {str(e)}")
+                    return generated
+                except Exception as e:
+                    print(f"⚠️ No se pudo pregenerar la rutina {combination.key}: {str(e)}")
+                    break
+                await self.put(combination, routine)
+                generated += 1
+        if generated:
+            print(f"📦 Reserva de rutinas: {generated} rutinas pregeneradas")
+        return generated
+
+    def _schedule_refill(self, combination: PoolCombination):
+        """Repone en segundo plano la rutina que se acaba de servir"""
+        if self._generator is None or combination.key in self._refilling:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refilling.add(combination.key)
+
+        async def refill_one():
+            try:
+                await self.refill(self._generator, [(combination, 1)])
+            finally:
+                self._refilling.discard(combination.key)
+
+        loop.create_task(refill_one())
+
+    def is_off_peak(self, hour: Optional[int] = None) -> bool:
+        """Indica si la hora (por defecto la actual) está en la franja valle"""
+        hour = datetime.now().hour if hour is None else hour
+        start, end = self.off_peak
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    async def claim_refill(self, seconds: float) -> bool:
+        """Reserva el relleno para este worker durante `seconds` (uno a la vez entre workers)"""
+        return await asyncio.to_thread(self._claim_refill, seconds)
+
+    def _claim_refill(self, seconds: float) -> bool:
+        """Escritura bloqueante del arrendamiento del relleno"""
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT value FROM routine_pool_stats WHERE name = 'lease_until'"
+                ).fetchone()
+                if row and row[0] > now:
+                    conn.execute("COMMIT")
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO routine_pool_stats (name, value) VALUES ('lease_until', ?)",
+                    (now + seconds,)
+                )
+                conn.execute("COMMIT")
+                return True
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al reservar el relleno de rutinas: {str(e)}")
+            return False
+
+    def start(self, generator, interval: float = ROUTINE_POOL_REFILL_INTERVAL):
+        """Empieza a reponer las rutinas servidas y lanza la tarea de relleno en horas valle"""
+        if not self.enabled or self._task is not None:
+            return
+        self._generator = generator
+        self._task = asyncio.ensure_future(self._run(generator, interval))
+
+    async def _run(self, generator, interval: float):
+        """Tarea en segundo plano que rellena la reserva en las horas valle"""
+        while True:
+            try:
+                if self.is_off_peak() and await self.claim_refill(interval):
+                    await self.refill(generator)
+            except Exception as e:
+                print(f"⚠️ Error en el relleno de la reserva de rutinas: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Tamaño de la reserva, aciertos y demanda de las combinaciones más pedidas"""
+        result: Dict[str, Any] = {
+            "enabled": self.enabled,
+            "entries": 0,
+            "hits": 0,
+            "misses": 0,
+            "refills": 0,
+            "off_peak_hours": "%d-%d" % self.off_peak,
+            "top": []
+        }
+        if not self.enabled:
+            return result
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                result["entries"] = conn.execute("SELECT COUNT(*) FROM routine_pool").fetchone()[0]
+                for name, value in conn.execute(
+                        "SELECT name, value FROM routine_pool_stats WHERE name IN ('hits', 'misses', 'refills')"):
+                    result[name] = int(value)
+                stored = dict(conn.execute(
+                    "SELECT combination, COUNT(*) FROM routine_pool GROUP BY combination"
+                ).fetchall())
+                demand = conn.execute(
+                    "SELECT combination, score, requests, updated_at FROM routine_pool_demand"
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al leer estadísticas de la reserva de rutinas: {str(e)}")
+            return result
+        ranked = sorted(demand, key=lambda row: self._decay(row[1], now - row[3]), reverse=True)
+        result["top"] = [
+            {"combination": key, "demand": round(self._decay(score, now - updated), 2),
+             "requests": requests, "ready": stored.get(key, 0)}
+            for key, score, requests, updated in ranked[:self.top]
+        ]
+        lookups = result["hits"] + result["misses"]
+        result["hit_rate"] = round(result["hits"] / lookups, 3) if lookups else 0.0
+        return result
+
+
+# Reserva compartida por los endpoints de creación
+routine_pool = RoutinePool()
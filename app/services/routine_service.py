@@ -1,24 +1,126 @@
 import random
-from typing import List, Dict, Any
+import hashlib
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from datetime import datetime
 from app.models.models import Exercise, Day, Routine, RoutineRequest
+from app.services.llm_backend import LLMBackend
+from app.services.exercise_library import (
+    BEGINNER, ADVANCED, GENERAL_GOAL, exercises_for, normalize, parse_equipment, parse_goal, parse_level
+)
+
+# Plantillas de día para la rutina sin conexión: (enfoque, grupos musculares en orden)
+PUSH_DAY = ("Pecho, hombros y tríceps", ["pecho", "pecho", "hombros", "hombros", "triceps"])
+PULL_DAY = ("Espalda y bíceps", ["espalda", "espalda", "espalda", "biceps", "core"])
+LEG_DAY = ("Piernas y glúteos", ["cuadriceps", "cuadriceps", "isquiotibiales", "gluteos", "gemelos"])
+UPPER_DAY = ("Tren superior", ["pecho", "espalda", "hombros", "biceps", "triceps"])
+LOWER_DAY = ("Tren inferior", ["cuadriceps", "isquiotibiales", "gluteos", "gemelos", "core"])
+FULL_BODY_DAY = ("Cuerpo completo", ["cuadriceps", "pecho", "espalda", "hombros", "isquiotibiales", "core"])
+CORE_DAY = ("Core y glúteos", ["core", "core", "gluteos", "hombros"])
+
+# División según los días de entrenamiento
+OFFLINE_SPLITS = {
+    1: [FULL_BODY_DAY],
+    2: [FULL_BODY_DAY, FULL_BODY_DAY],
+    3: [PUSH_DAY, PULL_DAY, LEG_DAY],
+    4: [UPPER_DAY, LOWER_DAY, UPPER_DAY, LOWER_DAY],
+    5: [PUSH_DAY, PULL_DAY, LEG_DAY, UPPER_DAY, LOWER_DAY],
+    6: [PUSH_DAY, PULL_DAY, LEG_DAY, PUSH_DAY, PULL_DAY, LEG_DAY],
+    7: [PUSH_DAY, PULL_DAY, LEG_DAY, CORE_DAY, PUSH_DAY, PULL_DAY, LEG_DAY]
+}
+
+# Días de la semana (índices) en los que se entrena según los días de la rutina
+OFFLINE_SCHEDULES = {
+    1: [0], 2: [0, 3], 3: [0, 2, 4], 4: [0, 1, 3, 4],
+    5: [0, 1, 2, 3, 4], 6: [0, 1, 2, 3, 4, 5], 7: [0, 1, 2, 3, 4, 5, 6]
+}
+
+# Esquema de series según el tipo de objetivo: (series, repeticiones, descanso)
+GOAL_SCHEMES = {
+    "fuerza": (5, "3-5", "2-3 min"),
+    "hipertrofia": (4, "8-12", "60-90 seg"),
+    "resistencia": (3, "12-15", "30-45 seg"),
+    GENERAL_GOAL: (3, "10-12", "60 seg")
+}
+
+async def routine_events(routine: Routine) -> AsyncIterator[Dict[str, Any]]:
+    """Eventos de streaming de una rutina ya completa (los mismos que al generarla con el modelo)"""
+    yield {"type": "routine_name", "routine_name": routine.routine_name}
+    for index, day in enumerate(routine.days):
+        yield {"type": "day", "index": index, "day": day.model_dump()}
+    yield {"type": "routine", "routine": routine, "explanation": None}
 
 class RoutineGenerator:
     """Servicio para generar rutinas de entrenamiento"""
     
-    def __init__(self):
+    def __init__(self, backend: Optional[LLMBackend] = None):
         # Ya no mantenemos una lista de ejercicios hardcodeados
         # Los días de la semana son útiles para format
         self.days_of_week = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+        # Backend de IA del que dependen las implementaciones (ver llm_backend)
+        self._backend = backend
+    
+    @property
+    def backend(self) -> Optional[LLMBackend]:
+        """Backend de IA utilizado por el generador"""
+        return self._backend
     
     async def create_initial_routine(self, request: RoutineRequest) -> Routine:
         """
-        Este método debe ser sobreescrito por una implementación que use IA
-        No hay implementación de respaldo
+        Implementación de respaldo sin IA: rutina determinista a partir de la
+        biblioteca local de ejercicios. Las clases derivadas usan el modelo y
+        recurren a ella cuando no está disponible.
         """
-        raise NotImplementedError("Este método debe ser implementado por una clase derivada que use IA")
+        return self.build_offline_routine(request)
+
+    def build_offline_routine(self, request: RoutineRequest) -> Routine:
+        """
+        Construye una rutina válida para cualquier petición sin llamar al modelo.
+        La misma petición produce siempre la misma rutina.
+        """
+        days = min(max(request.days, 1), len(self.days_of_week))
+        categories = parse_equipment(request.equipment)
+        level = parse_level(request.experience_level)
+        sets, reps, rest = self._offline_scheme(request.goals, level)
+        # Desplazamiento estable para que peticiones distintas no reciban siempre los mismos ejercicios
+        seed = int(hashlib.md5(normalize(request.goals + request.equipment).encode()).hexdigest()[:8], 16)
+
+        used_per_muscle: Dict[str, int] = {}
+        routine_days = []
+        for day_index, (focus, muscles) in zip(OFFLINE_SCHEDULES[days], OFFLINE_SPLITS[days]):
+            if level == BEGINNER and len(muscles) > 4:
+                muscles = muscles[:4]
+            exercises = []
+            for muscle in muscles:
+                candidates = [e for e in exercises_for(muscle, categories, level)
+                              if e.name not in {exercise.name for exercise in exercises}]
+                if not candidates:
+                    continue
+                turn = used_per_muscle.get(muscle, 0)
+                used_per_muscle[muscle] = turn + 1
+                choice = candidates[(seed + turn) % len(candidates)]
+                exercises.append(Exercise(name=choice.name, sets=sets, reps=reps, rest=rest,
+                                          equipment=choice.equipment))
+            routine_days.append(Day(day_name=self.days_of_week[day_index], focus=focus, exercises=exercises))
+
+        goals = request.goals.strip() or "entrenamiento general"
+        return Routine(
+            user_id=request.user_id,
+            routine_name=f"Rutina de {goals} ({days} días)",
+            days=routine_days,
+            created_at=datetime.now()
+        )
+
+    @staticmethod
+    def _offline_scheme(goals: str, level: int) -> Tuple[int, str, str]:
+        """Series, repeticiones y descanso según el objetivo y el nivel"""
+        sets, reps, rest = GOAL_SCHEMES[parse_goal(goals)]
+        if level == BEGINNER:
+            sets = max(2, sets - 1)
+        elif level == ADVANCED:
+            sets += 1
+        return sets, reps, rest
     
-    async def modify_routine(self, current_routine: Routine, user_request: str) -> Routine:
+    async def modify_routine(self, current_routine: Routine, user_request: str, history: str = "") -> Routine:
         """
         Este método debe ser sobreescrito por una implementación que use IA
         No hay implementación de respaldo
@@ -0,0 +1,396 @@
+"""
+Caché de rutinas para peticiones casi iguales.
+
+La caché de respuestas solo acierta si el prompt es idéntico, así que
+"ganar masa muscular" y "ganar músculo" con los mismos días y equipamiento
+generaban dos rutinas. Aquí cada petición se reduce a:
+
+- un grupo exacto: días, nivel, perfil de equipamiento y los términos
+  críticos de los objetivos (negaciones, partes del cuerpo y lesiones). Nunca
+  se sirve una rutina de otro número de días, con material que el usuario no
+  tiene, ni la de "ganar masa muscular" a quien pide "no quiero ganar masa
+  muscular" o la de "piernas" a quien pide "brazos";
+- una firma MinHash de las raíces de las palabras de sus objetivos.
+
+Un índice LSH (bandas de la firma) encuentra en tiempo constante las entradas
+candidatas, y se sirve la que tenga una similitud estimada (fracción de
+posiciones iguales de la firma) de al menos `SIMILARITY_CACHE_THRESHOLD`.
+
+Para que el índice ocupe poco con cientos de miles de entradas no usa
+diccionarios de Python: las firmas (16 bits por posición) y las tablas de
+bandas (direccionamiento abierto) viven en `array`, unos 250 bytes por
+entrada. Las rutinas se guardan en el archivo SQLite compartido y cada worker
+incorpora a su índice las entradas que añaden los demás. Las lecturas y
+escrituras de SQLite se hacen en un hilo para no bloquear el bucle de eventos.
+"""
+import os
+import re
+import time
+import zlib
+import sqlite3
+import asyncio
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.models.models import Routine, RoutineRequest
+from app.services.response_cache import default_cache_path
+from app.services.exercise_library import equipment_label, normalize, parse_equipment, parse_level
+
+SIMILARITY_CACHE_ENABLED = os.getenv("SIMILARITY_CACHE_ENABLED", "true").lower() == "true"
+
+# Similitud mínima (0-1) entre los objetivos para servir una rutina guardada
+SIMILARITY_CACHE_THRESHOLD = float(os.getenv("SIMILARITY_CACHE_THRESHOLD", "0.85"))
+
+# Entradas máximas (las más antiguas se descartan) y caducidad en segundos
+SIMILARITY_CACHE_MAX_ENTRIES = int(os.getenv("SIMILARITY_CACHE_MAX_ENTRIES", "300000"))
+SIMILARITY_CACHE_TTL = int(os.getenv("SIMILARITY_CACHE_TTL", str(7 * 24 * 60 * 60)))
+
+# Segundos entre lecturas de las entradas añadidas por otros workers
+SIMILARITY_CACHE_SYNC_INTERVAL = float(os.getenv("SIMILARITY_CACHE_SYNC_INTERVAL", "1"))
+
+# Entradas que se incorporan al índice en cada lectura (al arrancar el índice se
+# carga por partes en lugar de retrasar una petición hasta tenerlo completo)
+SYNC_BATCH = 2000
+
+# Firma MinHash: BANDS bandas de ROWS posiciones
+BANDS = 8
+ROWS = 4
+SIGNATURE_SIZE = BANDS * ROWS
+
+# Permutaciones de la firma: (a * x + b) mod MERSENNE_PRIME
+MERSENNE_PRIME = (1 << 61) - 1
+PERMUTATIONS = [((i * 0x9E3779B97F4A7C15 + 0x632BE59BD9B4E019) % MERSENNE_PRIME | 1,
+                 (i * 0xC2B2AE3D27D4EB4F + 0x165667B19E3779F9) % MERSENNE_PRIME)
+                for i in range(1, SIGNATURE_SIZE + 1)]
+
+# Palabras que no aportan al objetivo ("masa" de "masa muscular" no distingue de "músculo")
+STOPWORDS = {
+    "quiero", "quisiera", "me", "gustaria", "busco", "necesito", "mi", "mis", "de", "del", "la", "el",
+    "los", "las", "y", "e", "o", "para", "por", "en", "con", "un", "una", "unos", "unas", "lo", "al",
+    "a", "que", "mas", "muy", "poder", "tener", "estar", "rutina", "entrenamiento", "entrenar",
+    "objetivo", "objetivos", "mejor", "algo", "poco", "bastante", "cuerpo", "masa"
+}
+
+# Palabras que cambian el sentido del objetivo y deben coincidir exactamente
+NEGATION_WORDS = {"no", "sin", "ni", "nunca", "evitar", "excepto", "salvo"}
+BODY_PART_WORDS = {
+    "pierna", "brazo", "biceps", "triceps", "antebrazo", "gluteo", "espalda", "dorsal", "lumbar",
+    "pecho", "pectoral", "hombro", "trapecio", "cuello", "abdomen", "abdominal", "core", "cadera",
+    "cuadriceps", "isquiotibial", "femoral", "gemelo", "pantorrilla", "rodilla", "tobillo", "codo",
+    "muneca", "columna"
+}
+INJURY_WORDS = {
+    "lesion", "lesionado", "dolor", "molestia", "operado", "operacion", "cirugia", "hernia",
+    "tendinitis", "esguince", "fractura", "rotura", "rehabilitacion", "recuperacion", "artrosis",
+    "artritis", "escoliosis", "menisco", "ligamento", "embarazo", "embarazada", "postparto"
+}
+
+# Terminaciones que se quitan para quedarse con la raíz, de más larga a más corta
+SUFFIXES = ("aciones", "amiento", "imiento", "acion", "mente", "ciones", "cion", "ando", "iendo",
+            "ares", "ales", "ar", "er", "ir", "es", "os", "as", "al", "o", "a", "e", "s")
+
+
+def stem(word: str) -> str:
+    """Raíz aproximada: "muscular" y "músculo" se quedan en "muscul" """
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+CRITICAL_STEMS = {stem(word) for word in NEGATION_WORDS | BODY_PART_WORDS | INJURY_WORDS}
+
+
+def goal_features(goals: str) -> Set[str]:
+    """Raíces de las palabras significativas de los objetivos"""
+    words = re.findall(r"[a-z0-9]+", normalize(goals))
+    return {stem(word) for word in words if word not in STOPWORDS and len(word) > 1}
+
+
+def critical_terms(goals: str) -> List[str]:
+    """Raíces de las negaciones, partes del cuerpo y lesiones de los objetivos"""
+    words = re.findall(r"[a-z0-9]+", normalize(goals))
+    return sorted({stem(word) for word in words if stem(word) in CRITICAL_STEMS})
+
+
+def request_bucket(request: RoutineRequest) -> int:
+    """Grupo exacto de la petición: días, nivel, perfil de equipamiento y términos críticos"""
+    key = "|".join([
+        str(request.days),
+        str(parse_level(request.experience_level)),
+        equipment_label(parse_equipment(request.equipment)),
+        ",".join(critical_terms(request.goals))
+    ])
+    return zlib.crc32(key.encode("utf-8"))
+
+
+def minhash(features: Set[str]) -> List[int]:
+    """Firma MinHash de 16 bits por posición"""
+    hashes = [zlib.crc32(feature.encode("utf-8")) for feature in features]
+    return [min((a * x + b) % MERSENNE_PRIME for x in hashes) & 0xFFFF for a, b in PERMUTATIONS]
+
+
+def band_keys(bucket: int, signature) -> List[int]:
+    """Clave de 32 bits (distinta de 0) de cada banda, dentro del grupo de la petición"""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        key = zlib.crc32(array("H", rows).tobytes(), zlib.crc32(bytes([band]), bucket))
+        keys.append(key or 1)
+    return keys
+
+
+class BandTable:
+    """
+    Tabla hash de enteros de 32 bits con direccionamiento abierto sobre `array`.
+    Cada clave de banda apunta a la última entrada que la tenía.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.keys = array("I", bytes(4 * capacity))
+        self.values = array("I", bytes(4 * capacity))
+        self.used = 0
+
+    def _slot(self, key: int) -> int:
+        mask = self.capacity - 1
+        slot = (key * 2654435761) & mask
+        while self.keys[slot] and self.keys[slot] != key:
+            slot = (slot + 1) & mask
+        return slot
+
+    def get(self, key: int) -> int:
+        return self.values[self._slot(key)]
+
+    def set(self, key: int, value: int):
+        slot = self._slot(key)
+        if not self.keys[slot]:
+            self.keys[slot] = key
+            self.used += 1
+        self.values[slot] = value
+
+    @property
+    def full(self) -> bool:
+        return self.used * 10 >= self.capacity * 7
+
+
+class SimilarityIndex:
+    """Índice LSH en memoria de un número máximo de entradas (las más antiguas se sobrescriben)"""
+
+    def __init__(self, max_entries: int = SIMILARITY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.signatures = array("H")
+        self.buckets = array("I")
+        self.row_ids = array("q")
+        self.table = BandTable()
+        self.entries = 0
+
+    def add(self, row_id: int, bucket: int, signature):
+        """Añade una entrada (row_id es el ID de la fila en SQLite, desde 1)"""
+        slot = (row_id - 1) % self.max_entries
+        while len(self.row_ids) <= slot:
+            self.row_ids.append(0)
+            self.buckets.append(0)
+            self.signatures.extend([0] * SIGNATURE_SIZE)
+        if not self.row_ids[slot]:
+            self.entries += 1
+        self.row_ids[slot] = row_id
+        self.buckets[slot] = bucket
+        self.signatures[slot * SIGNATURE_SIZE:(slot + 1) * SIGNATURE_SIZE] = array("H", signature)
+        for key in band_keys(bucket, signature):
+            self.table.set(key, slot + 1)
+        if self.table.full:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Rehace la tabla de bandas sin las claves de entradas sobrescritas"""
+        capacity = 1024
+        while capacity * 7 < self.entries * BANDS * 20:
+            capacity *= 2
+        self.table = BandTable(capacity)
+        for slot, row_id in enumerate(self.row_ids):
+            if row_id:
+                signature = self.signatures[slot * SIGNATURE_SIZE:(slot + 1) * SIGNATURE_SIZE]
+                for key in band_keys(self.buckets[slot], signature):
+                    self.table.set(key, slot + 1)
+
+    def lookup(self, bucket: int, signature, threshold: float) -> Optional[Tuple[int, float]]:
+        """Entrada más parecida del mismo grupo: (row_id, similitud estimada) o None"""
+        best = None
+        checked = set()
+        for key in band_keys(bucket, signature):
+            value = self.table.get(key)
+            if not value or value in checked:
+                continue
+            checked.add(value)
+            slot = value - 1
+            if self.buckets[slot] != bucket:
+                continue
+            stored = self.signatures[slot * SIGNATURE_SIZE:(slot + 1) * SIGNATURE_SIZE]
+            similarity = sum(1 for x, y in zip(stored, signature) if x == y) / SIGNATURE_SIZE
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (self.row_ids[slot], similarity)
+        return best
+
+
+class SimilarityCache:
+    """Rutinas guardadas en SQLite y buscadas por similitud de la petición"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        threshold: float = SIMILARITY_CACHE_THRESHOLD,
+        max_entries: int = SIMILARITY_CACHE_MAX_ENTRIES,
+        ttl: int = SIMILARITY_CACHE_TTL,
+        sync_interval: float = SIMILARITY_CACHE_SYNC_INTERVAL,
+        enabled: bool = SIMILARITY_CACHE_ENABLED
+    ):
+        self._path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.enabled = enabled
+        self.index = SimilarityIndex(max_entries)
+        self._initialized = False
+        # El índice se lee y se modifica desde los hilos de `asyncio.to_thread`
+        self._lock = threading.Lock()
+        self._last_row_id = 0
+        self._last_sync = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = os.getenv("SIMILARITY_CACHE_PATH") or default_cache_path()
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        """Abre una conexión en modo autocommit (y crea la tabla la primera vez)"""
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS similarity_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bucket INTEGER NOT NULL,
+                signature BLOB NOT NULL,
+                routine TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            ''')
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _sync(self, conn: sqlite3.Connection):
+        """Incorpora al índice las entradas añadidas desde la última lectura"""
+        now = time.monotonic()
+        if now - self._last_sync < self.sync_interval:
+            return
+        newest = conn.execute("SELECT COALESCE(MAX(id), 0) FROM similarity_cache").fetchone()[0]
+        if newest <= self._last_row_id:
+            self._last_sync = now
+            return
+        rows = conn.execute(
+            "SELECT id, bucket, signature FROM similarity_cache WHERE id > ? ORDER BY id LIMIT ?",
+            (max(self._last_row_id, newest - self.max_entries), SYNC_BATCH)
+        ).fetchall()
+        if rows and rows[-1][0] >= newest:
+            self._last_sync = now
+        for row_id, bucket, signature in rows:
+            self.index.add(row_id, bucket, array("H", signature))
+            self._last_row_id = row_id
+
+    def _find(self, bucket: int, signature: List[int]) -> Tuple[Optional[Tuple[int, float]], Any]:
+        """Busca en el índice y lee la rutina de la entrada más parecida (bloqueante)"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                self._sync(conn)
+                match = self.index.lookup(bucket, signature, self.threshold)
+                row = None
+                if match is not None:
+                    row = conn.execute(
+                        "SELECT routine FROM similarity_cache WHERE id = ? AND created_at >= ?",
+                        (match[0], time.time() - self.ttl)
+                    ).fetchone()
+            finally:
+                conn.close()
+        return match, row
+
+    async def get(self, request: RoutineRequest) -> Optional[Routine]:
+        """Rutina guardada para una petición parecida, preparada para el usuario, o None"""
+        if not self.enabled:
+            return None
+        features = goal_features(request.goals)
+        if not features:
+            return None
+        bucket = request_bucket(request)
+        signature = minhash(features)
+
+        try:
+            match, row = await asyncio.to_thread(self._find, bucket, signature)
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al leer la caché por similitud: {str(e)}")
+            return None
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        print(f"✅ Rutina servida desde la caché por similitud ({match[1]:.2f})")
+        routine = Routine.model_validate_json(row[0])
+        return routine.model_copy(update={"user_id": request.user_id, "created_at": datetime.now()})
+
+    def _store(self, bucket: int, signature: List[int], routine: str):
+        """Inserta la entrada en SQLite y en el índice (bloqueante)"""
+        conn = self._connect()
+        try:
+            row_id = conn.execute(
+                "INSERT INTO similarity_cache (bucket, signature, routine, created_at) VALUES (?, ?, ?, ?)",
+                (bucket, array("H", signature).tobytes(), routine, time.time())
+            ).lastrowid
+            conn.execute("DELETE FROM similarity_cache WHERE id <= ?", (row_id - self.max_entries,))
+        finally:
+            conn.close()
+        # Se añade ya al índice; la próxima lectura la vuelve a incorporar sin efecto
+        with self._lock:
+            self.index.add(row_id, bucket, signature)
+
+    async def set(self, request: RoutineRequest, routine: Routine):
+        """Guarda la rutina generada para la petición"""
+        if not self.enabled:
+            return
+        features = goal_features(request.goals)
+        if not features:
+            return
+        bucket = request_bucket(request)
+        signature = minhash(features)
+        routine_json = routine.model_dump_json(exclude={"id", "created_at", "updated_at"})
+        try:
+            await asyncio.to_thread(self._store, bucket, signature, routine_json)
+        except sqlite3.Error as e:
+            print(f"⚠️ Error al escribir en la caché por similitud: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Aciertos de este worker y tamaño del índice"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": self.index.entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "index_bytes": (self.index.signatures.itemsize * len(self.index.signatures)
+                            + self.index.buckets.itemsize * len(self.index.buckets)
+                            + self.index.row_ids.itemsize * len(self.index.row_ids)
+                            + 8 * self.index.table.capacity)
+        }
+
+
+# Caché por similitud compartida por el proceso
+similarity_cache = SimilarityCache()
@@ -0,0 +1,121 @@
+"""
+Coalescencia de llamadas idénticas en curso ("single-flight").
+
+Cuando varias peticiones piden a la vez exactamente lo mismo (p. ej. varios
+usuarios eligiendo las opciones por defecto, o un doble clic en el formulario
+de creación) solo la primera llega al modelo; el resto espera y recibe el
+mismo resultado. Las métricas indican cuántas llamadas se han ahorrado.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+class _SharedStream:
+    """Fragmentos de una respuesta en streaming compartidos por varios lectores"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = asyncio.Condition()
+
+    async def read(self) -> AsyncIterator[Any]:
+        """Reproduce los fragmentos ya recibidos y sigue los nuevos hasta el final"""
+        index = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: index < len(self.chunks) or self.done)
+                pending = self.chunks[index:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola ejecución"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self.calls = 0
+        self.executed = 0
+        self.shared = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Ejecuta `func` si no hay otra llamada con la misma clave en curso;
+        en caso contrario espera el resultado de la que ya está en marcha.
+        """
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda finished: self._forget(self._calls, key, finished))
+
+        # shield: si un solicitante se cancela, la llamada sigue para los demás
+        return await asyncio.shield(task)
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        Versión en streaming de `do`: quien llega más tarde recibe primero los
+        fragmentos ya producidos y después los nuevos, sin repetir la llamada.
+        """
+        self.calls += 1
+        shared = self._streams.get(key)
+        if shared is not None:
+            self.shared += 1
+        else:
+            self.executed += 1
+            shared = _SharedStream()
+            self._streams[key] = shared
+            producer = asyncio.ensure_future(self._produce(shared, factory))
+            producer.add_done_callback(lambda finished: self._forget(self._streams, key, finished, shared))
+
+        async for chunk in shared.read():
+            yield chunk
+
+    async def _produce(self, shared: _SharedStream, factory: Callable[[], AsyncIterator[Any]]):
+        """Consume el iterador original y reparte sus fragmentos"""
+        try:
+            async for chunk in factory():
+                async with shared.condition:
+                    shared.chunks.append(chunk)
+                    shared.condition.notify_all()
+        except Exception as e:
+            shared.error = e
+        finally:
+            async with shared.condition:
+                shared.done = True
+                shared.condition.notify_all()
+
+    @staticmethod
+    def _forget(registry: Dict[str, Any], key: str, finished: asyncio.Future, value: Any = None):
+        """Elimina la llamada terminada del registro"""
+        current = registry.get(key)
+        if current is finished or (value is not None and current is value):
+            del registry[key]
+        # Marcar la excepción como recuperada aunque ningún solicitante la espere ya
+        if not finished.cancelled():
+            finished.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Métricas de coalescencia del proceso"""
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "saved": self.shared,
+            "in_flight": len(self._calls) + len(self._streams)
+        }
+
+
+# Instancia compartida por los servicios de IA del worker
+single_flight = SingleFlight()
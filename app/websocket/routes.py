@@ -1,9 +1,11 @@
+from typing import Tuple
 from fastapi import WebSocket, WebSocketDisconnect
 from app.models.models import Routine
 from app.websocket.manager import ConnectionManager
 from app.services.gemini_service import GeminiRoutineGenerator
 from app.services.image_analysis_service import GeminiImageAnalyzer
 from app.db.database import save_routine, get_routine, save_chat_message
+from app.services.conversation_context import load_conversation_context
 
 class WebSocketRoutes:
     """Clase para manejar las rutas de WebSocket"""
@@ -69,12 +71,17 @@ class WebSocketRoutes:
                 await websocket.send_json({"error": "Rutina no encontrada"})
                 return
             
+            # Contexto de la conversación anterior (antes de guardar el mensaje nuevo)
+            history = (await load_conversation_context(routine_id)).render()
+            
             # Guardar mensaje del usuario
             await save_chat_message(routine_id, "user", message)
             
             # Procesar con el generador de rutinas
-            modified_routine = await self.routine_generator.modify_routine(current_routine, message)
-            explanation = await self.routine_generator.explain_routine_changes(current_routine, modified_routine, message)
+            if getattr(self.routine_generator, "streams_modifications", False):
+                modified_routine, explanation = await self.stream_modification(routine_id, current_routine, message, history)
+            else:
+                modified_routine, explanation = await self.routine_generator.modify_and_explain(current_routine, message, history)
             
             # Actualizar la rutina en la BD
             await save_routine(modified_routine, routine_id=routine_id)
@@ -90,6 +97,35 @@ class WebSocketRoutes:
             print(f"Error al procesar mensaje de texto: {str(e)}")
             await websocket.send_json({"error": f"No se pudo procesar el mensaje: {str(e)}"})
     
+    async def stream_modification(
+        self,
+        routine_id: int,
+        current_routine: Routine,
+        message: str,
+        history: str = ""
+    ) -> Tuple[Routine, str]:
+        """Modifica la rutina enviando cada día actualizado en cuanto se genera"""
+        modified_routine = None
+        explanation = None
+        async for event in self.routine_generator.stream_modify_routine(current_routine, message, history):
+            if event["type"] == "routine":
+                modified_routine = event["routine"]
+                explanation = event.get("explanation")
+            elif event["type"] == "day":
+                await self.manager.broadcast(routine_id, {
+                    "type": "routine_day",
+                    "index": event["index"],
+                    "day": event["day"]
+                })
+        
+        if modified_routine is None:
+            raise ValueError("La respuesta de Gemini terminó sin una rutina completa")
+        
+        # Si la respuesta no trajo la explicación, pedirla por separado
+        if not explanation:
+            explanation = await self.routine_generator.explain_routine_changes(current_routine, modified_routine, message)
+        return modified_routine, explanation
+    
     async def handle_binary_message(self, websocket: WebSocket, routine_id: int, data: bytes):
         """Maneja un mensaje binario (posiblemente una imagen) recibido por WebSocket"""
         await websocket.send_json({"error": "Los mensajes binarios directos no están soportados. Utiliza el formato JSON para enviar imágenes."})
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Benchmark de concurrencia para /api/create_routine.
+
+Sustituye Gemini por el backend falso (`FakeBackend`), que bloquea el hilo
+como el SDK durante `--latency` segundos más el tiempo de generar la
+respuesta a `--tps` tokens por segundo, y lanza `--requests` peticiones
+simultáneas contra la app. Con `--error-rate` se simulan errores 503.
+
+Si las llamadas no bloquean el bucle de eventos, el tiempo total debe
+acercarse a `ceil(N / GEMINI_MAX_CONCURRENCY) * latencia` y no a
+`N * latencia`.
+
+Ejecutar desde la raíz del proyecto con: python scripts/bench_concurrent_create.py
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+
+def parse_args():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Benchmark de /api/create_routine concurrente")
+    parser.add_argument("--requests", "-n", type=int, default=8, help="Peticiones simultáneas")
+    parser.add_argument("--latency", "-l", type=float, default=1.0, help="Latencia simulada del modelo (s)")
+    parser.add_argument("--sigma", type=float, default=0.0, help="Dispersión log-normal de la latencia")
+    parser.add_argument("--tps", type=float, default=0, help="Tokens por segundo del backend falso (0 = sin límite)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proporción de errores simulados")
+    return parser.parse_args()
+
+
+async def run_benchmark(n_requests: int, latency: float, sigma: float, tps: float, error_rate: float):
+    """Lanza las peticiones y mide el tiempo total"""
+    from app.main import app
+    from app.services.llm_executor import llm_executor
+    from app.services.llm_backend import FakeBackend
+
+    async def fake_save_routine(*args, **kwargs):
+        return 1
+
+    async def fake_save_chat_message(*args, **kwargs):
+        return 1
+
+    # Solicitudes distintas para que no las agrupen la caché ni el single-flight
+    payloads = [{"goals": f"Hipertrofia {i}", "days": 1, "user_id": i} for i in range(n_requests)]
+
+    backend = FakeBackend(latency=latency, latency_sigma=sigma, error_rate=error_rate,
+                          tokens_per_second=tps, seed=0)
+    
+    with patch("app.services.gemini_service.backend", backend), \
+         patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+         patch("app.main.GEMINI_CONFIGURED", True), \
+         patch("app.main.save_routine", fake_save_routine), \
+         patch("app.main.save_chat_message", fake_save_chat_message), \
+         patch("app.services.gemini_service.response_cache.enabled", False), \
+         patch("app.services.gemini_service.rate_limiter.enabled", False):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/api/create_routine", json=payload) for payload in payloads
+            ])
+            elapsed = time.perf_counter() - start
+
+    ok = sum(1 for r in responses if r.status_code == 200)
+    limit = llm_executor.max_concurrency
+    waves = -(-n_requests // limit)
+
+    print(f"Peticiones: {n_requests} (OK: {ok}) | límite por worker: {limit}")
+    print(f"Tiempo total:            {elapsed:.2f} s")
+    print(f"Tiempo si fueran serie:  {n_requests * latency:.2f} s")
+    print(f"Mínimo teórico:          {waves * latency:.2f} s")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    asyncio.run(run_benchmark(args.requests, args.latency, args.sigma, args.tps, args.error_rate))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Benchmark del extractor de JSON sobre el corpus de respuestas defectuosas.
+
+Compara el extractor anterior (expresión regular sobre bloques de código y
+`json.loads` estricto) con `extract_json`: porcentaje de respuestas que acaban
+en una `Routine` válida y tiempo medio por respuesta.
+
+Ejecutar desde la raíz del proyecto con: python scripts/bench_json_extraction.py
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.models.models import Routine
+from app.services.json_repair import extract_json, coerce_routine_dict
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "..", "tests", "data", "malformed_responses.json")
+
+
+def legacy_extract(text: str) -> dict:
+    """Extractor anterior de GeminiRoutineGenerator"""
+    try:
+        json_matches = re.findall(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+        if json_matches:
+            return json.loads(json_matches[0].strip())
+        return json.loads(text.strip())
+    except Exception:
+        return {}
+
+
+def validates(data, coerce: bool) -> bool:
+    """Indica si el diccionario extraído es una rutina válida"""
+    if not isinstance(data, dict) or not data:
+        return False
+    if "routine" in data:
+        data = data["routine"]
+    try:
+        Routine.model_validate(coerce_routine_dict(data) if coerce else data)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_args():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Benchmark del extractor de JSON")
+    parser.add_argument("--rounds", "-r", type=int, default=200, help="Repeticiones del corpus para medir tiempos")
+    return parser.parse_args()
+
+
+def run_benchmark(rounds: int):
+    """Mide éxito y tiempo de ambos extractores"""
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = [case for case in json.load(f) if case["expected_days"] > 0]
+
+    for label, extractor, coerce in (("regex (anterior)", legacy_extract, False),
+                                     ("extract_json", extract_json, True)):
+        ok = sum(1 for case in corpus if validates(extractor(case["response"]), coerce))
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for case in corpus:
+                extractor(case["response"])
+        elapsed = time.perf_counter() - start
+        per_response = elapsed / (rounds * len(corpus)) * 1e6
+
+        print(f"{label:<18} válidas: {ok}/{len(corpus)} ({ok / len(corpus):.0%}) | {per_response:.1f} µs/respuesta")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_benchmark(args.rounds)
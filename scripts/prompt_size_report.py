@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Informe del tamaño de los prompts de creación y modificación.
+
+Compara los prompts anteriores (f-strings con sangría, esquema JSON con
+espacios y rutina completa con id y user_id) con los actuales de
+`app.services.prompts`: caracteres, tokens de entrada y reducción, y qué parte
+del prompt actual es el prefijo estático que se repite en todas las llamadas.
+
+Los tokens se estiman a partir de los caracteres; con `--count-tokens` y
+GEMINI_API_KEY definida se cuentan con la API de Gemini (sin coste de generación).
+
+Ejecutar desde la raíz del proyecto con: python scripts/prompt_size_report.py
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.models.models import Routine, RoutineRequest
+from app.services.llm_backend import CHARS_PER_TOKEN, FakeBackend, get_gemini_backend
+from app.services import prompts
+
+
+def legacy_initial_prompt(request: RoutineRequest) -> str:
+    """Prompt de creación anterior"""
+    return f"""
+        Actúa como un entrenador personal profesional y crea una rutina de entrenamiento detallada con estas características:
+
+        Objetivos: {request.goals}
+        Días de entrenamiento: {request.days} días a la semana
+        Nivel de experiencia: {request.experience_level if hasattr(request, 'experience_level') else 'No especificado'}
+        Equipo disponible: {request.available_equipment if hasattr(request, 'available_equipment') else 'No especificado'}
+        Tiempo por sesión: {request.time_per_session if hasattr(request, 'time_per_session') else 'No especificado'}
+        Condiciones de salud: {request.health_conditions if hasattr(request, 'health_conditions') else 'Ninguna'}
+
+        La rutina debe seguir ESTRICTAMENTE este formato JSON:
+
+        {{
+            "routine_name": "Nombre descriptivo de la rutina",
+            "days": [
+                {{
+                    "day_name": "Lunes",
+                    "focus": "Parte del cuerpo que se trabaja ese día",
+                    "exercises": [
+                        {{
+                            "name": "Nombre del ejercicio",
+                            "sets": 3,
+                            "reps": "8-12",
+                            "rest": "60-90 seg",
+                            "equipment": "Equipamiento necesario"
+                        }}
+                    ]
+                }}
+            ]
+        }}
+
+        IMPORTANTE:
+        1. Devuelve SOLO el JSON válido, sin texto explicativo.
+        2. Incluye exactamente {request.days} días en la rutina.
+        """
+
+
+def legacy_combined_prompt(current_routine: Routine, user_request: str) -> str:
+    """Prompt de modificación combinada anterior"""
+    routine_json = current_routine.model_dump_json()
+    return f"""
+        Actúa como un entrenador personal. El usuario tiene la siguiente rutina de entrenamiento:
+
+        ```json
+        {routine_json}
+        ```
+
+        El usuario ha solicitado: "{user_request}"
+
+        Modifica la rutina según esta solicitud y devuelve SOLO un JSON con este formato:
+
+        {{
+            "routine": {{ la rutina completa actualizada, con el mismo formato que la original }},
+            "explanation": "Explicación breve, profesional y motivadora de los cambios realizados"
+        }}
+
+        La explicación no debe incluir código JSON, solo texto.
+        """
+
+
+def legacy_patch_prompt(current_routine: Routine, user_request: str) -> str:
+    """Prompt de modificación por parche anterior"""
+    routine_json = current_routine.model_dump_json(include={"routine_name", "days"})
+    return f"""
+        Actúa como un entrenador personal. El usuario tiene la siguiente rutina de entrenamiento:
+
+        ```json
+        {routine_json}
+        ```
+
+        El usuario ha solicitado: "{user_request}"
+
+        NO devuelvas la rutina completa. Devuelve SOLO un JSON con la lista mínima de
+        operaciones (estilo JSON Patch) que aplican la solicitud y una explicación:
+
+        {{
+            "operations": [
+                {{"op": "replace", "path": "/days/0/exercises/1/sets", "value": 4}},
+                {{"op": "add", "path": "/days/2/exercises/-", "value": {{"name": "Nombre del ejercicio", "sets": 3, "reps": "8-12", "rest": "60-90 seg", "equipment": "Equipamiento necesario"}}}},
+                {{"op": "remove", "path": "/days/1/exercises/0"}}
+            ],
+            "explanation": "Explicación breve, profesional y motivadora de los cambios realizados"
+        }}
+
+        IMPORTANTE:
+        1. Las operaciones permitidas son "add", "remove" y "replace".
+        2. Las rutas usan índices que empiezan en 0 sobre "days" y "exercises"; "-" añade al final de la lista.
+        3. Solo se pueden modificar "routine_name" y el contenido de "days".
+        4. Las operaciones se aplican en orden, así que los índices deben tener en cuenta las operaciones anteriores.
+        """
+
+
+def parse_args():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Informe del tamaño de los prompts")
+    parser.add_argument("--days", "-d", type=int, default=6, help="Días de la rutina de ejemplo")
+    parser.add_argument("--count-tokens", action="store_true", help="Contar tokens con la API de Gemini")
+    return parser.parse_args()
+
+
+def make_counter(use_api: bool):
+    """Función que cuenta los tokens de un prompt"""
+    if use_api:
+        model = get_gemini_backend()._get_model()
+        return lambda text: model.count_tokens(text).total_tokens
+    return lambda text: -(-len(text) // CHARS_PER_TOKEN)
+
+
+def run_report(days: int, use_api: bool):
+    """Imprime el tamaño de cada prompt antes y después"""
+    count_tokens = make_counter(use_api)
+    request = RoutineRequest(goals="Hipertrofia y fuerza", equipment="Gimnasio completo", days=days, user_id=1)
+    routine_text = FakeBackend(latency=0, tokens_per_second=0).respond(prompts.build_initial_prompt(request))
+    routine = Routine.model_validate_json(routine_text.strip("`").replace("json\n", "", 1))
+    routine.id, routine.user_id = 42, 1
+    user_request = "Cambia las sentadillas por prensa y añade una serie al press de banca"
+
+    cases = [
+        ("create", legacy_initial_prompt(request), prompts.build_initial_prompt(request),
+         prompts.INITIAL_PROMPT_PREFIX),
+        ("modify (combinado)", legacy_combined_prompt(routine, user_request),
+         prompts.build_combined_modification_prompt(routine, user_request), prompts.COMBINED_PROMPT_PREFIX),
+        ("modify (parche)", legacy_patch_prompt(routine, user_request),
+         prompts.build_patch_prompt(routine, user_request), prompts.PATCH_PROMPT_PREFIX)
+    ]
+
+    unit = "tokens (API)" if use_api else f"tokens (≈{CHARS_PER_TOKEN} car./token)"
+    print(f"Rutina de ejemplo: {days} días | {unit}")
+    print(f"{'prompt':<20}{'antes car.':>11}{'ahora car.':>11}{'antes tok.':>11}{'ahora tok.':>11}"
+          f"{'reducción':>11}{'prefijo':>9}")
+    for label, before, after, prefix in cases:
+        tokens_before, tokens_after = count_tokens(before), count_tokens(after)
+        reduction = 1 - tokens_after / tokens_before
+        print(f"{label:<20}{len(before):>11}{len(after):>11}{tokens_before:>11}{tokens_after:>11}"
+              f"{reduction:>11.0%}{len(prefix) / len(after):>9.0%}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_report(args.days, args.count_tokens)
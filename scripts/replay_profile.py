@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Perfil del camino completo de las peticiones con tráfico grabado de Gemini.
+
+Ejecuta un escenario fijo: creación de rutinas por /api/create_routine,
+modificaciones por chat con el mismo flujo en streaming que el WebSocket y
+análisis de una imagen de ejercicio. Con `--record` el escenario llama al
+backend configurado (Gemini con GEMINI_API_KEY, o el falso con `--fake`) y
+graba cada llamada en la cassette; sin él, la reproduce sin red, al instante
+o con `--latency` con los tiempos grabados. Al final muestra las métricas de
+cada operación (llamadas, resultado y percentiles de tiempo).
+
+Las cachés, la reserva de rutinas, los comandos locales y el limitador se
+desactivan para que cada paso llegue al backend.
+
+Ejecutar desde la raíz del proyecto con:
+    python scripts/replay_profile.py --record     # una vez, con red
+    python scripts/replay_profile.py --latency    # las veces que haga falta, sin red
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from io import BytesIO
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+
+# Peticiones de creación del escenario
+CREATE_PAYLOADS = [
+    {"goals": "Ganar masa muscular", "days": 3, "equipment": "Gimnasio completo", "user_id": 1},
+    {"goals": "Perder grasa manteniendo fuerza", "days": 4, "equipment": "Mancuernas", "user_id": 2},
+    {"goals": "Mejorar la resistencia para correr", "days": 2, "equipment": "Sin equipo", "user_id": 3}
+]
+
+# Mensajes de chat que se envían a cada rutina creada
+CHAT_MESSAGES = ["Hazla más intensa", "Añade más trabajo de core al último día"]
+
+
+def parse_args():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(description="Perfil del camino completo con tráfico grabado de Gemini")
+    parser.add_argument("--cassette", default=None, help="Archivo de la cassette (por defecto LLM_CASSETTE_PATH)")
+    parser.add_argument("--record", action="store_true", help="Grabar el escenario en lugar de reproducirlo")
+    parser.add_argument("--fake", action="store_true", help="Grabar con el backend falso en lugar de Gemini")
+    parser.add_argument("--latency", action="store_true", help="Reproducir con las latencias grabadas")
+    return parser.parse_args()
+
+
+def exercise_image() -> bytes:
+    """Imagen PNG determinista para el análisis"""
+    from PIL import Image
+    image = Image.new("RGB", (64, 64), (120, 160, 200))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def run_scenario(backend):
+    """Creación, modificación en streaming y análisis de imagen con el backend indicado"""
+    from app.main import app, ws_routes
+    from app.services.gemini_service import GeminiRoutineGenerator
+    from app.services.image_analysis_service import GeminiImageAnalyzer
+    from app.services.llm_metrics import llm_metrics
+
+    async def fake_save(*args, **kwargs):
+        return 1
+
+    generator = GeminiRoutineGenerator(backend=backend, offline_fallback=False)
+    analyzer = GeminiImageAnalyzer(backend=backend)
+    llm_metrics.reset()
+
+    with patch("app.main.routine_generator", generator), \
+         patch.object(ws_routes, "routine_generator", generator), \
+         patch("app.main.GEMINI_CONFIGURED", True), \
+         patch("app.main.save_routine", fake_save), \
+         patch("app.main.save_chat_message", fake_save), \
+         patch("app.main.routine_pool.enabled", False), \
+         patch("app.services.gemini_service.response_cache.enabled", False), \
+         patch("app.services.gemini_service.similarity_cache.enabled", False), \
+         patch("app.services.gemini_service.local_commands.enabled", False), \
+         patch("app.services.gemini_service.rate_limiter.enabled", False), \
+         patch("app.services.image_analysis_service.rate_limiter.enabled", False):
+        start = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://profile", timeout=None) as client:
+            responses = [await client.post("/api/create_routine", json=payload) for payload in CREATE_PAYLOADS]
+        created = time.perf_counter()
+
+        routines = [generator._validate_routine(r.json()["routine"]) for r in responses if r.status_code == 200]
+        for routine in routines:
+            for message in CHAT_MESSAGES:
+                routine, _ = await ws_routes.stream_modification(0, routine, message)
+        modified = time.perf_counter()
+
+        await analyzer.analyze_exercise_image(exercise_image(), "Sentadilla")
+        analyzed = time.perf_counter()
+
+    print(f"Creación:    {len(routines)}/{len(CREATE_PAYLOADS)} rutinas en {created - start:.2f} s")
+    print(f"Chat:        {len(routines) * len(CHAT_MESSAGES)} modificaciones en {modified - created:.2f} s")
+    print(f"Imagen:      1 análisis en {analyzed - modified:.2f} s")
+    print()
+    for operation, stats in llm_metrics.stats().items():
+        total = stats["timings"].get("total", {})
+        print(f"{operation:<10} llamadas={stats['calls']:<3} modelo={stats['model_calls']:<3} "
+              f"p50={total.get('p50')} p90={total.get('p90')} resultados={stats['outcomes']}")
+
+
+def main():
+    args = parse_args()
+    from app.services.cassette import Cassette, RecordingBackend, ReplayBackend
+    from app.services.llm_backend import FakeBackend, get_gemini_backend
+
+    cassette = Cassette(args.cassette) if args.cassette else Cassette()
+    if args.record:
+        inner = FakeBackend(seed=0) if args.fake else get_gemini_backend()
+        if not inner.available:
+            sys.exit("GEMINI_API_KEY no está definida; usa --fake para grabar con el backend falso")
+        backend = RecordingBackend(inner, cassette)
+        print(f"📼 Grabando el escenario en {cassette.path}")
+    else:
+        backend = ReplayBackend(cassette, latency=args.latency)
+        if not backend.available:
+            sys.exit(f"La cassette {cassette.path} está vacía; grábala antes con --record")
+
+    asyncio.run(run_scenario(backend))
+    if not args.record:
+        print(f"\nLlamadas reproducidas: {backend.calls} (sin grabar: {backend.misses})")
+
+
+if __name__ == "__main__":
+    main()
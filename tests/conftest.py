@@ -12,6 +12,13 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 from app.main import app
 from app.models.models import Routine, Day, Exercise
 from app.db.database import Base
+from app.services.response_cache import ResponseCache
+from app.services.resilience import ResiliencePolicy
+from app.services.rate_limiter import RateLimiter, TokenBucketStore
+from app.services.llm_metrics import LLMMetrics
+from app.services.routine_commands import LocalCommands
+from app.services.routine_pool import RoutinePool
+from app.services.similarity_cache import SimilarityCache
 
 # Crear una base de datos de prueba en memoria
 TEST_DB_URL = "sqlite+aiosqlite:///:memory:"
@@ -21,6 +28,59 @@ def test_client():
     """Cliente de prueba para FastAPI"""
     return TestClient(app)
 
+@pytest.fixture(autouse=True)
+def isolated_response_cache(tmp_path, monkeypatch):
+    """Usar una caché de respuestas vacía y temporal en cada prueba"""
+    cache = ResponseCache(path=str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr("app.services.gemini_service.response_cache", cache)
+    return cache
+
+@pytest.fixture(autouse=True)
+def isolated_resilience(monkeypatch):
+    """Circuito cerrado y reintentos sin espera en cada prueba"""
+    policy = ResiliencePolicy(base_delay=0, max_delay=0)
+    monkeypatch.setattr("app.services.gemini_service.gemini_resilience", policy)
+    monkeypatch.setattr("app.services.image_analysis_service.gemini_resilience", policy)
+    return policy
+
+@pytest.fixture(autouse=True)
+def isolated_rate_limiter(tmp_path, monkeypatch):
+    """Buckets llenos y temporales en cada prueba"""
+    limiter = RateLimiter(store=TokenBucketStore(path=str(tmp_path / "llm_rate_limit.db")))
+    monkeypatch.setattr("app.services.gemini_service.rate_limiter", limiter)
+    monkeypatch.setattr("app.services.image_analysis_service.rate_limiter", limiter)
+    return limiter
+
+@pytest.fixture(autouse=True)
+def isolated_llm_metrics(monkeypatch):
+    """Histogramas vacíos y sin trazas en cada prueba"""
+    metrics = LLMMetrics(log=False)
+    monkeypatch.setattr("app.services.gemini_service.llm_metrics", metrics)
+    monkeypatch.setattr("app.services.image_analysis_service.llm_metrics", metrics)
+    monkeypatch.setattr("app.main.llm_metrics", metrics)
+    return metrics
+
+@pytest.fixture(autouse=True)
+def isolated_local_commands(monkeypatch):
+    """Contadores de comandos locales propios de cada prueba"""
+    commands = LocalCommands()
+    monkeypatch.setattr("app.services.gemini_service.local_commands", commands)
+    return commands
+
+@pytest.fixture(autouse=True)
+def isolated_similarity_cache(tmp_path, monkeypatch):
+    """Caché por similitud vacía y temporal en cada prueba"""
+    cache = SimilarityCache(path=str(tmp_path / "similarity_cache.db"))
+    monkeypatch.setattr("app.services.gemini_service.similarity_cache", cache)
+    return cache
+
+@pytest.fixture(autouse=True)
+def isolated_routine_pool(tmp_path, monkeypatch):
+    """Reserva de rutinas vacía y temporal en cada prueba"""
+    pool = RoutinePool(path=str(tmp_path / "routine_pool.db"))
+    monkeypatch.setattr("app.main.routine_pool", pool)
+    return pool
+
 @pytest.fixture
 def event_loop():
     """Crear un bucle de eventos estándar para pruebas"""
@@ -0,0 +1,111 @@
+from unittest.mock import patch, MagicMock
+from app.services.api_key_pool import ApiKeyPool, is_quota_error, parse_keys
+from app.services.llm_backend import GeminiBackend
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class QuotaError(Exception):
+    """Error 429 como los de google.api_core"""
+    code = 429
+
+class TestApiKeyPool:
+    """Pruebas para el reparto de llamadas entre varias claves"""
+
+    def test_parse_keys(self):
+        """Las claves se separan por comas, sin duplicados, y si no hay se usa la clave única"""
+        assert parse_keys(" uno, dos ,uno,,tres ") == ["uno", "dos", "tres"]
+        assert parse_keys("", fallback="sola") == ["sola"]
+
+    def test_requests_go_to_key_with_most_headroom(self):
+        """Cada llamada va a la clave menos usada en el último minuto"""
+        clock = FakeClock()
+        pool = ApiKeyPool(["clave-aaaa-1111", "clave-bbbb-2222"], rpm=10, tpm=1000, clock=clock)
+
+        first = pool.acquire()
+        pool.release(first, tokens=900)
+        second = pool.acquire()
+        pool.release(second, tokens=10)
+        third = pool.acquire()
+
+        assert first.api_key != second.api_key
+        # La primera clave ha consumido casi toda su cuota de tokens
+        assert third.api_key == second.api_key
+
+        clock.now += 61
+        pool.release(third)
+        assert pool.stats()["keys"][0]["tokens_per_minute"] == 0
+
+    def test_quota_error_benches_key(self):
+        """Una clave sin cuota se aparta, cada vez más tiempo si vuelve a fallar"""
+        clock = FakeClock()
+        pool = ApiKeyPool(["clave-aaaa-1111", "clave-bbbb-2222"], bench_seconds=10, clock=clock)
+
+        key = pool.acquire()
+        pool.release(key, error=QuotaError("429 Resource has been exhausted"))
+        assert all(pool.acquire().api_key != key.api_key for _ in range(3))
+
+        clock.now += 11
+        assert any(pool.acquire().api_key == key.api_key for _ in range(5))
+
+        pool.release(key, error=QuotaError("quota"))
+        stats = {entry["key"]: entry for entry in pool.stats()["keys"]}
+        assert stats[key.label]["benched_for"] == 20
+        assert stats[key.label]["quota_errors"] == 2
+        assert pool.stats()["available"] == 1
+
+    def test_stats_do_not_expose_keys(self):
+        """Las estadísticas solo muestran el final de cada clave"""
+        pool = ApiKeyPool(["AIzaSyEjemploSecreto1234"])
+        pool.release(pool.acquire(), tokens=50)
+
+        entry = pool.stats()["keys"][0]
+        assert entry["key"] == "…1234"
+        assert entry["total_requests"] == 1 and entry["total_tokens"] == 50
+        assert not is_quota_error(ValueError("JSON no válido"))
+
+class TestGeminiBackendKeys:
+    """El backend de Gemini usa una clave del pool en cada llamada"""
+
+    def test_each_key_gets_its_own_client(self, monkeypatch):
+        """Cada clave usa su propio cliente, creado una sola vez y sin tocar el estado del SDK"""
+        monkeypatch.setattr("app.services.llm_backend._key_clients", {})
+        pool = ApiKeyPool(["clave-aaaa-1111", "clave-bbbb-2222"])
+        clients = {}
+
+        def make_client(client_options):
+            clients[client_options["api_key"]] = client = MagicMock()
+            return client
+
+        with patch("google.ai.generativelanguage.GenerativeServiceClient", side_effect=make_client), \
+                patch("google.generativeai.types.generation_types.GenerateContentResponse.from_response",
+                      side_effect=lambda response: MagicMock(text="respuesta", usage_metadata=None)):
+            backend = GeminiBackend("gemini-test", key_pool=pool)
+            for _ in range(4):
+                backend.generate_content("hola")
+            GeminiBackend("gemini-otro", key_pool=pool).generate_content("hola")
+
+        assert sorted(clients) == ["clave-aaaa-1111", "clave-bbbb-2222"]
+        assert [client.generate_content.call_count for client in clients.values()] == [3, 2]
+        request = clients["clave-bbbb-2222"].generate_content.call_args_list[0][0][0]
+        assert request.model == "models/gemini-test"
+        assert [entry["total_requests"] for entry in pool.stats()["keys"]] == [3, 2]
+
+    def test_stream_tokens_are_counted_at_the_end(self):
+        """En streaming la clave se libera al consumir la respuesta"""
+        pool = ApiKeyPool(["clave-aaaa-1111"])
+        backend = GeminiBackend("gemini-test", key_pool=pool)
+        backend._models["clave-aaaa-1111"] = model = MagicMock()
+        model.generate_content.return_value = iter([MagicMock(text="a" * 40), MagicMock(text="b" * 40)])
+
+        chunks = backend.generate_content("p" * 40, stream=True)
+        assert pool.stats()["keys"][0]["in_flight"] == 1
+        assert len(list(chunks)) == 2
+
+        entry = pool.stats()["keys"][0]
+        assert entry["in_flight"] == 0
+        assert entry["total_tokens"] == 30
@@ -0,0 +1,107 @@
+import pytest
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import select
+from app.models.models import RoutineRequest
+from app.services.batch_service import generate_routines_batch
+from app.db.database import save_routines_bulk, RoutineModel, ChatMessageModel
+
+class FakeGenerator:
+    """Generador falso que tarda lo indicado en cada solicitud y mide la concurrencia"""
+    
+    def __init__(self, routine, delays, failing=()):
+        self.routine = routine
+        self.delays = delays
+        self.failing = failing
+        self.active = 0
+        self.max_active = 0
+    
+    async def create_initial_routine(self, request):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delays[request.goals])
+            if request.goals in self.failing:
+                raise ValueError(f"Fallo en {request.goals}")
+            return self.routine.model_copy(update={"routine_name": request.goals, "id": None})
+        finally:
+            self.active -= 1
+
+def make_requests(*goals):
+    return [RoutineRequest(goals=goal, days=3, user_id=7) for goal in goals]
+
+class TestBatchGeneration:
+    """Pruebas para la generación de rutinas por lotes"""
+    
+    @pytest.mark.asyncio
+    async def test_streams_results_as_they_finish(self, sample_routine):
+        """Los resultados llegan en orden de finalización, con su índice y su ID"""
+        generator = FakeGenerator(sample_routine, {"lenta": 0.05, "rapida": 0.01})
+        saved = []
+        
+        async def persist(ready):
+            saved.append([index for index, _, _ in ready])
+            return [100 + index for index, _, _ in ready]
+        
+        events = [event async for event in generate_routines_batch(generator, make_requests("lenta", "rapida"), persist)]
+        
+        assert [(e["type"], e.get("index")) for e in events] == [
+            ("routine_created", 1), ("routine_created", 0), ("batch_done", None)
+        ]
+        assert events[0]["routine_id"] == 101
+        assert events[0]["routine"]["routine_name"] == "rapida"
+        assert events[-1] == {"type": "batch_done", "total": 2, "created": 2, "failed": 0}
+    
+    @pytest.mark.asyncio
+    async def test_concurrency_cap_and_errors(self, sample_routine):
+        """No se superan las generaciones simultáneas permitidas y los errores son por solicitud"""
+        goals = [f"r{i}" for i in range(6)]
+        generator = FakeGenerator(sample_routine, {goal: 0.01 for goal in goals}, failing=("r2",))
+        
+        async def persist(ready):
+            return list(range(len(ready)))
+        
+        events = [event async for event in generate_routines_batch(
+            generator, make_requests(*goals) + [None], persist, concurrency=2
+        )]
+        
+        assert generator.max_active == 2
+        errors = sorted(e["index"] for e in events if e["type"] == "error")
+        assert errors == [2, 6]
+        assert events[-1] == {"type": "batch_done", "total": 7, "created": 5, "failed": 2}
+    
+    @pytest.mark.asyncio
+    async def test_routines_finished_while_saving_are_grouped(self, sample_routine):
+        """Las rutinas que terminan mientras se guarda un grupo se guardan juntas después"""
+        generator = FakeGenerator(sample_routine, {"a": 0.01, "b": 0.02, "c": 0.02, "d": 0.02})
+        groups = []
+        
+        async def persist(ready):
+            groups.append(len(ready))
+            await asyncio.sleep(0.05)
+            return list(range(len(ready)))
+        
+        events = [event async for event in generate_routines_batch(generator, make_requests("a", "b", "c", "d"), persist)]
+        
+        assert groups == [1, 3]
+        assert events[-1]["created"] == 4
+    
+    @pytest.mark.asyncio
+    async def test_save_routines_bulk(self, sample_routine, test_db_engine, monkeypatch):
+        """Las rutinas del grupo y sus mensajes se guardan en una sola transacción"""
+        session_factory = sessionmaker(test_db_engine, class_=AsyncSession, expire_on_commit=False)
+        monkeypatch.setattr("app.db.database.async_session", session_factory)
+        
+        ids = await save_routines_bulk([
+            (sample_routine, 3, [("user", "hola"), ("assistant", "rutina creada")]),
+            (sample_routine.model_copy(update={"routine_name": "Otra"}), 4, [])
+        ])
+        
+        async with session_factory() as session:
+            routines = (await session.execute(select(RoutineModel).order_by(RoutineModel.id))).scalars().all()
+            messages = (await session.execute(select(ChatMessageModel))).scalars().all()
+        
+        assert [r.id for r in routines] == ids
+        assert [(r.user_id, r.routine_name) for r in routines] == [(3, sample_routine.routine_name), (4, "Otra")]
+        assert {m.routine_id for m in messages} == {ids[0]}
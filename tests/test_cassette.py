@@ -0,0 +1,95 @@
+import time
+import pytest
+from PIL import Image
+from app.models.models import RoutineRequest
+from app.services.cassette import (
+    Cassette, CassetteMissError, RecordingBackend, ReplayBackend, ReplayedError, cassette_key
+)
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend, FakeBackendError, create_backend
+from app.services.resilience import is_retryable
+
+@pytest.fixture
+def cassette(tmp_path):
+    return Cassette(str(tmp_path / "gemini.jsonl.gz"))
+
+class TestCassette:
+    """Pruebas para la grabación y reproducción de llamadas al modelo"""
+
+    def test_record_and_replay(self, cassette):
+        """Las respuestas, normales y en streaming, se reproducen tal cual se grabaron"""
+        recorder = RecordingBackend(FakeBackend(latency=0, tokens_per_second=0), cassette)
+        text = recorder.generate_content("Explica los cambios").text
+        chunks = [chunk.text for chunk in recorder.generate_content('Crea "routine_name" de 2 días', stream=True)]
+
+        replay = ReplayBackend(cassette)
+        assert replay.generate_content("Explica   los cambios").text == text
+        assert [chunk.text for chunk in replay.generate_content('Crea "routine_name" de 2 días', stream=True)] == chunks
+        assert len(chunks) > 1 and replay.model_name == "fake-routine-model"
+
+        with pytest.raises(CassetteMissError) as error:
+            replay.generate_content("Otro prompt")
+        assert not is_retryable(error.value)
+        assert (replay.calls, replay.misses) == (3, 1)
+
+    def test_errors_and_repeated_prompts(self, cassette):
+        """Los errores conservan su código y un mismo prompt se reproduce en el orden grabado"""
+        failing = RecordingBackend(FakeBackend(latency=0, tokens_per_second=0, error_rate=1), cassette)
+        working = RecordingBackend(FakeBackend(latency=0, tokens_per_second=0), cassette)
+        with pytest.raises(FakeBackendError):
+            failing.generate_content("Explica los cambios")
+        working.generate_content("Explica los cambios")
+
+        replay = ReplayBackend(cassette)
+        with pytest.raises(ReplayedError) as error:
+            replay.generate_content("Explica los cambios")
+        assert error.value.code == 503 and is_retryable(error.value)
+        assert replay.generate_content("Explica los cambios").text.startswith("He revisado")
+
+    def test_recorded_latency(self, cassette):
+        """Con latencia se esperan los tiempos grabados; sin ella se responde al instante"""
+        recorder = RecordingBackend(FakeBackend(latency=0.05, latency_sigma=0, tokens_per_second=0), cassette)
+        recorder.generate_content("Explica los cambios")
+
+        start = time.perf_counter()
+        ReplayBackend(cassette, latency=True).generate_content("Explica los cambios")
+        assert time.perf_counter() - start >= 0.04
+
+        start = time.perf_counter()
+        ReplayBackend(cassette).generate_content("Explica los cambios")
+        assert time.perf_counter() - start < 0.01
+
+    def test_images_are_part_of_the_key(self):
+        """El mismo prompt con imágenes distintas son grabaciones distintas"""
+        red = Image.new("RGB", (8, 8), (255, 0, 0))
+        blue = Image.new("RGB", (8, 8), (0, 0, 255))
+        assert cassette_key(["Analiza", red]) == cassette_key(["Analiza", red.copy()])
+        assert cassette_key(["Analiza", red]) != cassette_key(["Analiza", blue])
+
+    @pytest.mark.asyncio
+    async def test_generator_replays_routine(self, cassette):
+        """Una rutina creada con el backend grabado se obtiene igual sin red"""
+        request = RoutineRequest(goals="Hipertrofia", days=3)
+        recorded = await GeminiRoutineGenerator(
+            backend=RecordingBackend(FakeBackend(latency=0, tokens_per_second=0), cassette)
+        ).create_initial_routine(request)
+
+        replayed = await GeminiRoutineGenerator(backend=ReplayBackend(cassette)).create_initial_routine(request)
+
+        assert replayed.days == recorded.days
+
+    def test_create_backend_modes(self, tmp_path, monkeypatch):
+        """`LLM_CASSETTE_RECORD` envuelve el backend y `replay` lee la misma cassette"""
+        path = str(tmp_path / "gemini.jsonl.gz")
+        monkeypatch.setattr("app.services.cassette.LLM_CASSETTE_PATH", path)
+        monkeypatch.setattr("app.services.cassette.LLM_CASSETTE_RECORD", True)
+
+        recorder = create_backend("fake")
+        assert isinstance(recorder, RecordingBackend) and recorder.name == "fake"
+        recorder.inner.latency = 0
+        recorder.inner.tokens_per_second = 0
+        text = recorder.generate_content("Explica los cambios").text
+
+        replay = create_backend("replay")
+        assert isinstance(replay, ReplayBackend) and replay.available
+        assert replay.generate_content("Explica los cambios").text == text
@@ -0,0 +1,89 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+from app.db.database import delete_routine_from_db, save_routine, save_chat_message, get_conversation_state
+from app.services.conversation_context import (
+    ConversationContext, estimate_tokens, fold_into_summary, load_conversation_context, split_recent
+)
+from app.services.gemini_service import GeminiRoutineGenerator
+
+def message(sender, content, id=0):
+    return {"id": id, "sender": sender, "content": content}
+
+class TestConversationContext:
+    """Pruebas para el contexto acotado de la conversación"""
+
+    def test_split_keeps_last_turns(self):
+        """Los últimos K turnos quedan literales y el resto se resume"""
+        messages = [message("user", "uno"), message("assistant", "ok"), message("user", "dos"),
+                    message("assistant", "ok"), message("user", "tres"), message("assistant", "ok")]
+
+        older, recent = split_recent(messages, turns=2)
+
+        assert [m["content"] for m in older] == ["uno", "ok"]
+        assert [m["content"] for m in recent] == ["dos", "ok", "tres", "ok"]
+
+    def test_summary_keeps_user_requests_within_budget(self):
+        """El resumen guarda las peticiones del usuario y descarta las más antiguas al llenarse"""
+        summary = ""
+        for index in range(30):
+            summary = fold_into_summary(summary, [message("user", f"Petición número {index} sobre la rutina"),
+                                                  message("assistant", "Hecho")], budget=50)
+
+        assert estimate_tokens(summary) <= 50
+        assert "Hecho" not in summary
+        assert "Petición número 29" in summary
+        assert summary.startswith("(+")
+
+    def test_render_respects_token_budget(self):
+        """El bloque nunca supera el presupuesto aunque los mensajes sean largos"""
+        context = ConversationContext("- Quitar sentadillas", [message("user", "palabra " * 200),
+                                                              message("assistant", "respuesta " * 200)])
+
+        text = context.render(budget=100)
+
+        assert estimate_tokens(text) <= 100
+        assert context.render(budget=10000).startswith("Resumen de peticiones anteriores del usuario:")
+
+    def test_history_is_added_to_modification_prompt(self, sample_routine):
+        """El contexto aparece en el prompt antes de la solicitud actual"""
+        generator = GeminiRoutineGenerator()
+
+        prompt = generator._build_patch_prompt(sample_routine, "Más series", "Usuario: sin saltos, por favor")
+
+        assert prompt.index("sin saltos") < prompt.index('"Más series"')
+        assert "Contexto de la conversación" not in generator._build_patch_prompt(sample_routine, "Más series")
+
+    @pytest.mark.asyncio
+    async def test_load_updates_summary_incrementally(self, sample_routine, test_db_engine, monkeypatch):
+        """Los turnos antiguos se guardan resumidos y no se vuelven a leer"""
+        session_factory = sessionmaker(test_db_engine, class_=AsyncSession, expire_on_commit=False)
+        monkeypatch.setattr("app.db.database.async_session", session_factory)
+        routine_id = await save_routine(sample_routine, user_id=1)
+        for index in range(5):
+            await save_chat_message(routine_id, "user", f"Cambio {index}")
+            await save_chat_message(routine_id, "assistant", f"Aplicado {index}")
+
+        context = await load_conversation_context(routine_id, turns=2)
+        state = await get_conversation_state(routine_id)
+
+        assert context.summary.splitlines() == ["- Cambio 0", "- Cambio 1", "- Cambio 2"]
+        assert [m["content"] for m in context.messages] == ["Cambio 3", "Aplicado 3", "Cambio 4", "Aplicado 4"]
+        assert len(state["messages"]) == 4
+        assert (await load_conversation_context(routine_id, turns=2)).summary == context.summary
+
+    @pytest.mark.asyncio
+    async def test_deleting_routine_removes_summary(self, sample_routine, test_db_engine, monkeypatch):
+        """Al borrar la rutina no quedan resúmenes ni mensajes huérfanos"""
+        session_factory = sessionmaker(test_db_engine, class_=AsyncSession, expire_on_commit=False)
+        monkeypatch.setattr("app.db.database.async_session", session_factory)
+        routine_id = await save_routine(sample_routine, user_id=1)
+        for index in range(5):
+            await save_chat_message(routine_id, "user", f"Cambio {index}")
+        await load_conversation_context(routine_id, turns=1)
+        assert (await get_conversation_state(routine_id))["summary"]
+
+        assert await delete_routine_from_db(routine_id)
+        state = await get_conversation_state(routine_id)
+
+        assert (state["summary"], state["summarized_until"], state["messages"]) == ("", 0, [])
@@ -0,0 +1,74 @@
+import pytest
+from app.models.models import Day, Exercise
+from app.services.day_targeting import target_days
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend
+
+@pytest.fixture
+def week_routine(sample_routine):
+    """Rutina de muestra con un tercer día de piernas"""
+    legs = Day(day_name="Viernes", focus="Piernas", exercises=[
+        Exercise(name="Sentadilla", sets=4, reps="6-8", rest="120 seg", equipment="Barra"),
+        Exercise(name="Zancadas", sets=3, reps="10-12", rest="60 seg", equipment="Mancuernas")
+    ])
+    return sample_routine.model_copy(update={"days": sample_routine.days + [legs]})
+
+class TestTargetDays:
+    """Pruebas para la detección de los días a los que se refiere un mensaje"""
+
+    def test_targets_by_focus_name_and_exercise(self, week_routine):
+        """El día se reconoce por su enfoque, su nombre, su posición o uno de sus ejercicios"""
+        assert target_days(week_routine, "Cambia el día de pierna") == [2]
+        assert target_days(week_routine, "El miércoles quiero algo más suave") == [1]
+        assert target_days(week_routine, "En el primer día sube las repeticiones") == [0]
+        assert target_days(week_routine, "Cambia las sentadillas por prensa") == [2]
+        assert target_days(week_routine, "Más descanso en press de banca y dominadas") == [0, 1]
+
+    def test_whole_routine_requests(self, week_routine):
+        """Sin días concretos, o si cambia la estructura de la semana, se modifica todo"""
+        assert target_days(week_routine, "Hazla más intensa") == []
+        assert target_days(week_routine, "Añade un día de hombros") == []
+        assert target_days(week_routine, "Sube las series en toda la rutina, sobre todo piernas") == []
+
+    def test_replacement_does_not_select_other_days(self, week_routine):
+        """En "cambia X por Y" el ejercicio nuevo no arrastra a otros días"""
+        assert target_days(week_routine, "Cambia las zancadas por press de banca") == [2]
+
+class TestScopedModification:
+    """Pruebas para la regeneración de solo los días afectados"""
+
+    @pytest.mark.asyncio
+    async def test_only_targeted_days_are_regenerated(self, week_routine):
+        """Se hace una llamada por día afectado y los demás días quedan idénticos"""
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+        generator = GeminiRoutineGenerator(backend=fake)
+
+        routine, explanation = await generator.modify_and_explain(week_routine, "Más volumen en pecho y piernas")
+
+        assert fake.calls == 2
+        assert routine.days[0].exercises[0].sets == 4
+        assert routine.days[2].exercises[0].sets == 5
+        assert routine.days[1].model_dump_json() == week_routine.days[1].model_dump_json()
+        assert (routine.id, routine.routine_name) == (week_routine.id, week_routine.routine_name)
+        assert explanation
+
+    @pytest.mark.asyncio
+    async def test_scoped_stream_emits_changed_days(self, week_routine):
+        """En streaming solo se emiten los días regenerados"""
+        generator = GeminiRoutineGenerator(backend=FakeBackend(latency=0, tokens_per_second=0),
+                                           modify_mode="full")
+
+        events = [event async for event in generator.stream_modify_routine(week_routine, "Cambia el viernes")]
+
+        assert [event["index"] for event in events if event["type"] == "day"] == [2]
+        assert events[-1]["routine"].days[:2] == week_routine.days[:2]
+
+    @pytest.mark.asyncio
+    async def test_disabled_uses_whole_routine(self, week_routine):
+        """Con la opción desactivada se envía la rutina completa en una llamada"""
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+        generator = GeminiRoutineGenerator(backend=fake, scoped_modify=False)
+
+        await generator.modify_and_explain(week_routine, "Cambia el día de piernas")
+
+        assert fake.calls == 1
@@ -136,4 +136,77 @@ class TestGeminiService:
             
             # Probar con JSON inválido
             with pytest.raises(Exception):
-                generator._extract_json_from_text("Esto no es JSON") 
\ No newline at end of file
+                generator._extract_json_from_text("Esto no es JSON") 
+
+class TestCombinedModification:
+    """Pruebas para la modificación y explicación en una sola llamada"""
+    
+    ROUTINE_JSON = """
+    {
+        "routine_name": "Rutina modificada",
+        "days": [
+            {
+                "day_name": "Lunes",
+                "focus": "Pecho",
+                "exercises": [
+                    {"name": "Press inclinado", "sets": 4, "reps": "8-10", "rest": "90 seg", "equipment": "Mancuernas"}
+                ]
+            }
+        ]
+    }
+    """
+    
+    @pytest.fixture
+    def original_routine(self):
+        return Routine(id=5, user_id=2, routine_name="Rutina original", days=[])
+    
+    def _mock_model(self, *texts):
+        mock_model = MagicMock()
+        mock_model.generate_content.side_effect = [MagicMock(text=text) for text in texts]
+        return mock_model
+    
+    @pytest.mark.asyncio
+    async def test_single_round_trip(self, original_routine):
+        """Una respuesta combinada válida se resuelve con una sola llamada"""
+        combined = '{"routine": %s, "explanation": "He cambiado el press."}' % self.ROUTINE_JSON
+        mock_model = self._mock_model(combined)
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator(combined_modify=True, modify_mode="full")
+            routine, explanation = await generator.modify_and_explain(original_routine, "Cambia el press")
+        
+        assert mock_model.generate_content.call_count == 1
+        assert routine.routine_name == "Rutina modificada"
+        assert routine.id == 5
+        assert routine.user_id == 2
+        assert explanation == "He cambiado el press."
+    
+    @pytest.mark.asyncio
+    async def test_fallback_to_two_calls(self, original_routine):
+        """Si falta la explicación se modifica por separado y se explica localmente"""
+        mock_model = self._mock_model(self.ROUTINE_JSON, self.ROUTINE_JSON)
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator(combined_modify=True, modify_mode="full")
+            routine, explanation = await generator.modify_and_explain(original_routine, "Cambia el press")
+        
+        assert mock_model.generate_content.call_count == 2
+        assert routine.routine_name == "Rutina modificada"
+        assert "Añadí el día Lunes (Pecho) con 1 ejercicio." in explanation
+    
+    @pytest.mark.asyncio
+    async def test_combined_mode_disabled(self, original_routine):
+        """Con el modo combinado desactivado se mantiene el flujo modificar y explicar"""
+        mock_model = self._mock_model(self.ROUTINE_JSON, "Explicación motivadora")
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator(
+                combined_modify=False, modify_mode="full", motivational_explanations=True
+            )
+            routine, explanation = await generator.modify_and_explain(original_routine, "Cambia el press")
+        
+        assert mock_model.generate_content.call_count == 2
+        assert explanation == "Explicación motivadora"
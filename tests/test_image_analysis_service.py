@@ -16,12 +16,9 @@ class TestImageAnalysisService:
     """Pruebas para el servicio de análisis de imágenes"""
     
     @pytest.fixture
-    def mock_genai(self):
-        """Mock para el módulo google.generativeai"""
-        with patch("app.services.image_analysis_service.genai") as mock_genai:
-            # Configurar el comportamiento del mock
-            mock_model = MagicMock()
-            mock_genai.GenerativeModel.return_value = mock_model
+    def mock_backend(self):
+        """Mock para el backend de IA"""
+        with patch("app.services.image_analysis_service.backend") as mock_model:
             
             # Crear una respuesta simulada de la API
             mock_response = MagicMock()
@@ -41,7 +38,7 @@ class TestImageAnalysisService:
             # Configurar generate_content para devolver la respuesta simulada
             mock_model.generate_content = AsyncMock(return_value=mock_response)
             
-            yield mock_genai
+            yield mock_model
     
     @pytest.fixture
     def sample_image_base64(self):
@@ -60,7 +57,7 @@ class TestImageAnalysisService:
         return base64_encoded
     
     @pytest.mark.asyncio
-    async def test_analyze_exercise_image(self, mock_genai, sample_image_base64):
+    async def test_analyze_exercise_image(self, mock_backend, sample_image_base64):
         """Probar el análisis de imagen de ejercicio"""
         # Configurar GEMINI_CONFIGURED para evitar errores
         with patch("app.services.image_analysis_service.GEMINI_CONFIGURED", True):
@@ -75,7 +72,7 @@ class TestImageAnalysisService:
             )
             
             # Verificar llamada al modelo
-            mock_genai.GenerativeModel.return_value.generate_content.assert_called_once()
+            mock_backend.generate_content.assert_called_once()
             
             # Verificar resultado
             assert "buena forma" in result.lower()
@@ -83,7 +80,7 @@ class TestImageAnalysisService:
             assert "recomendaciones" in result.lower()
     
     @pytest.mark.asyncio
-    async def test_analyze_exercise_image_with_invalid_image(self, mock_genai):
+    async def test_analyze_exercise_image_with_invalid_image(self, mock_backend):
         """Probar el análisis con imagen inválida"""
         # Configurar GEMINI_CONFIGURED para evitar errores
         with patch("app.services.image_analysis_service.GEMINI_CONFIGURED", True):
@@ -0,0 +1,85 @@
+import os
+import json
+import pytest
+from app.models.models import Routine
+from app.services.json_repair import repair_json, extract_json, coerce_exercise, coerce_routine_dict
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "malformed_responses.json")
+
+with open(CORPUS_PATH, encoding="utf-8") as corpus_file:
+    CORPUS = json.load(corpus_file)
+
+
+def parse_routine(text: str):
+    """Mismo camino que sigue el servicio: extraer, ajustar valores y validar"""
+    data = extract_json(text)
+    if not data:
+        return None
+    if "routine" in data:
+        data = data["routine"]
+    return Routine.model_validate(coerce_routine_dict(data))
+
+
+class TestMalformedCorpus:
+    """Respuestas reales del modelo con defectos habituales"""
+
+    @pytest.mark.parametrize("case", CORPUS, ids=[case["name"] for case in CORPUS])
+    def test_corpus_response_validates(self, case):
+        """Cada respuesta del corpus se convierte en una rutina válida (o en nada)"""
+        routine = parse_routine(case["response"])
+
+        if case["expected_days"] == 0:
+            assert routine is None
+        else:
+            assert routine is not None
+            assert len(routine.days) == case["expected_days"]
+
+
+class TestRepairJson:
+    """Pruebas unitarias de la reparación en una pasada"""
+
+    def test_clean_json_is_unchanged(self):
+        """El JSON correcto sale igual que entra"""
+        text = '{"a": [1, 2], "b": {"c": "x"}}'
+        assert repair_json(text) == text
+
+    def test_ignores_text_after_outer_object(self):
+        """Se detiene al cerrar el objeto más externo"""
+        assert repair_json('Hola {"a": 1} y {"b": 2}') == '{"a": 1}'
+
+    def test_removes_trailing_commas(self):
+        """Elimina las comas antes de cerrar listas y objetos"""
+        assert json.loads(repair_json('{"a": [1, 2,], "b": 3,}')) == {"a": [1, 2], "b": 3}
+
+    def test_truncated_list_keeps_complete_elements(self):
+        """Descarta el elemento incompleto y cierra los corchetes abiertos"""
+        assert json.loads(repair_json('{"a": 1, "b": [1, 2, {"c": "x')) == {"a": 1, "b": [1, 2]}
+
+    def test_escapes_inner_double_quotes_in_single_quoted_strings(self):
+        """Las comillas dobles dentro de una cadena con comillas simples se escapan"""
+        assert json.loads(repair_json("{'name': 'Flexiones \"diamante\"'}")) == {"name": 'Flexiones "diamante"'}
+
+    def test_no_object_returns_none(self):
+        """Sin ningún '{' no hay nada que reparar"""
+        assert repair_json("Sin JSON") is None
+        assert extract_json("Sin JSON") == {}
+
+
+class TestCoercion:
+    """Ajuste de valores casi correctos antes de validar"""
+
+    def test_coerce_exercise_values(self):
+        """Rangos, números y nulos se convierten al formato esperado"""
+        exercise = coerce_exercise({"name": "Sentadilla", "sets": "3-4", "reps": [8, 10], "rest": 90, "equipment": None})
+
+        assert exercise == {"name": "Sentadilla", "sets": 3, "reps": "8-10", "rest": "90 seg",
+                            "equipment": "No especificado"}
+
+    def test_unparseable_sets_still_fail_validation(self):
+        """Si no hay ningún número, el valor se deja tal cual y la validación falla"""
+        data = {"routine_name": "X", "days": [{"day_name": "Lunes", "focus": "Piernas", "exercises": [
+            {"name": "Sentadilla", "sets": "muchas", "reps": "10", "rest": "60 seg", "equipment": "Barra"}
+        ]}]}
+
+        with pytest.raises(ValueError):
+            Routine.model_validate(coerce_routine_dict(data))
@@ -0,0 +1,92 @@
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+from app.services.json_stream import IncrementalRoutineParser
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.models.models import Routine, RoutineRequest
+
+ROUTINE = {
+    "routine_name": "Rutina {fuerza} \"pro\"",
+    "days": [
+        {
+            "day_name": "Lunes",
+            "focus": "Pecho [superior]",
+            "exercises": [
+                {"name": "Press de banca", "sets": 4, "reps": "6-8", "rest": "90 seg", "equipment": "Barra"}
+            ]
+        },
+        {
+            "day_name": "Miércoles",
+            "focus": "Espalda",
+            "exercises": [
+                {"name": "Dominadas", "sets": 3, "reps": "8-10", "rest": "60 seg", "equipment": "Barra"}
+            ]
+        }
+    ]
+}
+
+def split_chunks(text, size):
+    """Trocea el texto en fragmentos de tamaño fijo"""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class TestIncrementalRoutineParser:
+    """Pruebas para el parser JSON incremental"""
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 10000])
+    def test_emits_days_for_any_chunking(self, chunk_size):
+        """Los días se emiten igual sin importar cómo se trocee la respuesta"""
+        text = "Aquí tienes tu rutina:\n```json\n" + json.dumps(ROUTINE, ensure_ascii=False, indent=2) + "\n```"
+        parser = IncrementalRoutineParser()
+        events = []
+        for chunk in split_chunks(text, chunk_size):
+            events.extend(parser.feed(chunk))
+
+        assert events[0] == ("routine_name", ROUTINE["routine_name"])
+        days = [value for kind, value in events if kind == "day"]
+        assert days == ROUTINE["days"]
+        assert parser.finished
+
+    def test_day_emitted_before_response_ends(self):
+        """El primer día se emite en cuanto se cierra su objeto"""
+        text = json.dumps(ROUTINE)
+        cut = text.index('{"day_name": "Mi')
+        parser = IncrementalRoutineParser()
+
+        events = parser.feed(text[:cut])
+
+        assert ("day", ROUTINE["days"][0]) in events
+        assert not parser.finished
+
+    def test_days_nested_under_other_key(self):
+        """Encuentra la lista de días aunque la rutina esté anidada"""
+        text = json.dumps({"routine": ROUTINE, "explanation": "days: []"})
+        parser = IncrementalRoutineParser()
+
+        days = [value for kind, value in parser.feed(text) if kind == "day"]
+
+        assert len(days) == 2
+
+class TestGeminiStreaming:
+    """Pruebas para la generación de rutinas en streaming"""
+
+    @pytest.mark.asyncio
+    async def test_stream_initial_routine(self):
+        """Emite los días validados y al final la rutina completa"""
+        chunks = [MagicMock(text=chunk) for chunk in split_chunks(json.dumps(ROUTINE), 20)]
+        mock_model = MagicMock()
+        mock_model.generate_content.return_value = iter(chunks)
+
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator()
+            request = RoutineRequest(goals="Fuerza", days=2, user_id=7)
+            events = [event async for event in generator.stream_initial_routine(request)]
+
+        mock_model.generate_content.assert_called_once()
+        assert mock_model.generate_content.call_args.kwargs["stream"] is True
+        assert [event["type"] for event in events] == ["routine_name", "day", "day", "routine"]
+        assert events[1]["index"] == 0 and events[2]["index"] == 1
+        routine = events[-1]["routine"]
+        assert isinstance(routine, Routine)
+        assert routine.user_id == 7
+        assert len(routine.days) == 2
@@ -0,0 +1,115 @@
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+from app.models.models import Routine, RoutineRequest
+from app.services.llm_backend import FakeBackend, FakeBackendError, GeminiBackend, create_backend, get_gemini_backend
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.resilience import is_retryable
+
+class TestFakeBackend:
+    """Pruebas para el backend falso de pruebas de carga"""
+    
+    def test_initial_routine_is_valid_and_deterministic(self):
+        """La rutina generada es válida, tiene los días pedidos y no cambia entre llamadas"""
+        backend = FakeBackend(latency=0, tokens_per_second=0)
+        prompt = GeminiRoutineGenerator()._build_initial_prompt(RoutineRequest(goals="Fuerza", days=4))
+        
+        first = backend.generate_content(prompt).text
+        second = backend.generate_content(prompt).text
+        routine = Routine.model_validate(json.loads(first.strip("`").replace("json\n", "", 1)))
+        
+        assert first == second
+        assert len(routine.days) == 4
+        assert backend.calls == 2
+    
+    def test_stream_chunks_match_full_response(self):
+        """En streaming los fragmentos reconstruyen la misma respuesta"""
+        backend = FakeBackend(latency=0, tokens_per_second=0)
+        prompt = GeminiRoutineGenerator()._build_initial_prompt(RoutineRequest(goals="Fuerza", days=2))
+        
+        chunks = [chunk.text for chunk in backend.generate_content(prompt, stream=True)]
+        
+        assert len(chunks) > 1
+        assert "".join(chunks) == backend.generate_content(prompt).text
+    
+    def test_simulated_errors_are_retryable(self):
+        """Los errores simulados se comportan como un 503 de la API"""
+        backend = FakeBackend(latency=0, tokens_per_second=0, error_rate=1)
+        
+        with pytest.raises(FakeBackendError) as error:
+            backend.generate_content("hola")
+        assert is_retryable(error.value)
+    
+    def test_create_backend_by_name(self):
+        """LLM_BACKEND=fake selecciona el backend falso"""
+        assert isinstance(create_backend("fake"), FakeBackend)
+
+class TestGeneratorWithFakeBackend:
+    """El generador funciona de principio a fin con el backend inyectado"""
+    
+    @pytest.mark.asyncio
+    async def test_create_and_modify(self):
+        """Crear, modificar con parche y explicar sin llamar a Gemini"""
+        generator = GeminiRoutineGenerator(backend=FakeBackend(latency=0, tokens_per_second=0))
+        
+        routine = await generator.create_initial_routine(RoutineRequest(goals="Hipertrofia", days=3, user_id=5))
+        modified, explanation = await generator.modify_and_explain(routine, "Añade una serie")
+        
+        assert len(routine.days) == 3
+        assert routine.user_id == 5
+        assert modified.days[0].exercises[0].sets == routine.days[0].exercises[0].sets + 1
+        assert explanation
+    
+    @pytest.mark.asyncio
+    async def test_stream_modification_in_full_mode(self, sample_routine):
+        """El modo completo en streaming también recibe una rutina válida"""
+        generator = GeminiRoutineGenerator(backend=FakeBackend(latency=0, tokens_per_second=0), modify_mode="full")
+        
+        events = [event async for event in generator.stream_modify_routine(sample_routine, "Más series")]
+        
+        assert events[-1]["type"] == "routine"
+        assert events[-1]["explanation"]
+        assert events[-1]["routine"].id == sample_routine.id
+
+class TestGeminiClientRegistry:
+    """El cliente de Gemini se crea una sola vez y de forma perezosa"""
+    
+    def test_model_created_lazily_and_once(self, monkeypatch):
+        """Crear el backend no crea el cliente; la primera llamada sí, y solo una vez por clave"""
+        monkeypatch.setattr("app.services.llm_backend._key_clients", {})
+        client = MagicMock()
+        with patch("google.ai.generativelanguage.GenerativeServiceClient", return_value=client) as client_class, \
+                patch("google.generativeai.types.generation_types.GenerateContentResponse.from_response",
+                      side_effect=lambda response: MagicMock(text="respuesta", usage_metadata=None)):
+            backend = GeminiBackend("gemini-test", api_key="clave")
+            assert backend.available and not backend.initialized
+            client_class.assert_not_called()
+            
+            backend.generate_content("hola")
+            backend.generate_content("adiós")
+            GeminiBackend("gemini-otro", api_key="clave").generate_content("hola")
+        
+        client_class.assert_called_once_with(client_options={"api_key": "clave"})
+        assert backend.initialized
+        assert client.generate_content.call_count == 3
+    
+    def test_sdk_requests_have_a_timeout(self, monkeypatch):
+        """Cada petición al SDK lleva su plazo para que el hilo no quede colgado"""
+        monkeypatch.setattr("app.services.llm_backend._key_clients", {})
+        client = MagicMock()
+        with patch("google.ai.generativelanguage.GenerativeServiceClient", return_value=client), \
+                patch("google.generativeai.types.generation_types.GenerateContentResponse.from_response",
+                      side_effect=lambda response: MagicMock(text="respuesta", usage_metadata=None)), \
+                patch("google.generativeai.types.generation_types.GenerateContentResponse.from_iterator",
+                      return_value=iter([])):
+            backend = GeminiBackend("gemini-test", api_key="clave", timeout=12, stream_timeout=30)
+            backend.generate_content("hola")
+            list(backend.generate_content("hola", stream=True))
+        
+        assert client.generate_content.call_args.kwargs == {"timeout": 12}
+        assert client.stream_generate_content.call_args.kwargs == {"timeout": 30}
+    
+    def test_registry_shares_backend_per_model(self):
+        """Los servicios comparten el mismo cliente para el mismo modelo"""
+        assert get_gemini_backend("gemini-compartido") is get_gemini_backend("gemini-compartido")
+        assert get_gemini_backend("gemini-compartido") is not get_gemini_backend("gemini-distinto")
@@ -0,0 +1,132 @@
+import pytest
+import time
+import asyncio
+import threading
+from app.services.llm_executor import LLMExecutor
+
+class TestLLMExecutor:
+    """Pruebas para el pool de ejecución de llamadas al modelo"""
+
+    @pytest.mark.asyncio
+    async def test_calls_overlap(self):
+        """Las llamadas bloqueantes se ejecutan en paralelo sin bloquear el bucle"""
+        executor = LLMExecutor(max_concurrency=4)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            executor.run(lambda i=i: (time.sleep(0.2), i)[1]) for i in range(4)
+        ])
+        elapsed = time.perf_counter() - start
+
+        assert results == [0, 1, 2, 3]
+        assert elapsed < 0.6  # En serie serían 0.8 s
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self):
+        """Nunca se superan las llamadas simultáneas configuradas"""
+        executor = LLMExecutor(max_concurrency=2)
+        peak = 0
+
+        def blocking_call():
+            nonlocal peak
+            peak = max(peak, executor.in_flight)
+            time.sleep(0.05)
+
+        await asyncio.gather(*[executor.run(blocking_call) for _ in range(6)])
+
+        assert peak <= 2
+        assert executor.stats()["completed"] == 6
+        assert executor.stats()["in_flight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_event_loop_not_blocked(self):
+        """El bucle de eventos sigue atendiendo otras tareas durante la llamada"""
+        executor = LLMExecutor(max_concurrency=1)
+        start = time.perf_counter()
+
+        async def ticker():
+            for _ in range(5):
+                await asyncio.sleep(0.02)
+            return time.perf_counter() - start
+
+        _, ticker_elapsed = await asyncio.gather(executor.run(time.sleep, 0.3), ticker())
+
+        # El ticker termina mientras la llamada bloqueante sigue en curso
+        assert ticker_elapsed < 0.25
+
+    @pytest.mark.asyncio
+    async def test_stream_yields_items_as_produced(self):
+        """Los elementos de un iterable bloqueante llegan antes de que termine"""
+        executor = LLMExecutor(max_concurrency=1)
+        start = time.perf_counter()
+
+        def slow_chunks():
+            for i in range(3):
+                time.sleep(0.1)
+                yield i
+
+        arrivals = []
+        async for item in executor.stream(slow_chunks):
+            arrivals.append((item, time.perf_counter() - start))
+
+        assert [item for item, _ in arrivals] == [0, 1, 2]
+        assert arrivals[0][1] < 0.25
+
+    @pytest.mark.asyncio
+    async def test_stream_propagates_errors(self):
+        """Los errores del hilo productor se propagan al consumidor"""
+        executor = LLMExecutor(max_concurrency=1)
+
+        def failing_chunks():
+            yield "a"
+            raise RuntimeError("fallo de red")
+
+        items = []
+        with pytest.raises(RuntimeError):
+            async for item in executor.stream(failing_chunks):
+                items.append(item)
+
+        assert items == ["a"]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_call_keeps_its_permit(self):
+        """Si se cancela la espera, el permiso se libera cuando termina el hilo y no antes"""
+        executor = LLMExecutor(max_concurrency=1)
+        release = threading.Event()
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(executor.run(release.wait, 5), 0.05)
+        assert executor.stats()["in_flight"] == 1
+
+        second = asyncio.ensure_future(executor.run(lambda: "segunda"))
+        await asyncio.sleep(0.05)
+        assert not second.done() and executor.stats()["waiting"] == 1
+
+        release.set()
+        assert await second == "segunda"
+        assert executor.stats()["completed"] == 2
+
+    @pytest.mark.asyncio
+    async def test_abandoned_stream_stops_reading(self):
+        """Un stream que deja de consumirse no sigue leyendo fragmentos en el hilo"""
+        executor = LLMExecutor(max_concurrency=1)
+        produced = []
+        closed = threading.Event()
+
+        def chunks():
+            try:
+                for i in range(100):
+                    produced.append(i)
+                    time.sleep(0.01)
+                    yield i
+            finally:
+                closed.set()
+
+        async for item in executor.stream(chunks):
+            if item == 1:
+                break
+
+        assert await asyncio.to_thread(closed.wait, 1)
+        assert len(produced) < 10
+        await asyncio.sleep(0.01)
+        assert executor.stats()["in_flight"] == 0
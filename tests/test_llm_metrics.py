@@ -0,0 +1,127 @@
+import pytest
+from app.models.models import RoutineRequest
+from app.services.llm_backend import FakeBackend, FakeResponse
+from app.services.llm_metrics import Histogram, LLMCall, LLMMetrics
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.resilience import LLMUnavailableError
+
+class TestHistogram:
+    """Pruebas para los histogramas de buckets fijos"""
+
+    def test_counts_and_percentiles(self):
+        """Cada valor cae en el primer bucket cuyo límite no supera"""
+        histogram = Histogram((1, 2, 5))
+        for value in (0.5, 1, 1.5, 3, 10):
+            histogram.observe(value)
+
+        stats = histogram.to_dict()
+
+        assert stats["count"] == 5
+        assert stats["buckets"] == {"le_1": 2, "le_2": 1, "le_5": 1, "inf": 1}
+        assert stats["p50"] == 2
+        assert stats["p99"] == 10
+        assert stats["max"] == 10
+
+class TestLLMCall:
+    """Pruebas para el registro de una operación"""
+
+    def test_outcome_from_failed_phase(self):
+        """Una excepción dentro de una fase determina el resultado"""
+        call = LLMCall("create")
+        with pytest.raises(ValueError):
+            with call.phase("json_extraction"):
+                raise ValueError("JSON roto")
+
+        call.finish(ValueError("JSON roto"))
+
+        assert call.outcome == "parse_error"
+        assert "json_extraction" in call.timings
+
+    def test_unavailable_outcome(self):
+        """Los errores de disponibilidad se distinguen de los de red"""
+        call = LLMCall("modify")
+        call.finish(LLMUnavailableError("circuito abierto"))
+        assert call.outcome == "unavailable"
+
+    def test_sizes_and_estimated_tokens(self):
+        """Sin metadatos de uso los tokens se estiman a partir de los caracteres"""
+        call = LLMCall("create")
+        call.set_prompt(["x" * 400, object()])
+        call.set_response(FakeResponse("y" * 80))
+
+        assert call.prompt_chars == 400
+        assert call.tokens() == {"prompt": 100, "response": 20}
+
+    def test_nested_operation_of_same_type_is_counted_once(self):
+        """Una modificación que recurre a otro modo se registra una sola vez"""
+        metrics = LLMMetrics(log=False)
+        with metrics.track("modify") as outer:
+            with metrics.track("modify") as inner:
+                assert inner is outer
+
+        assert metrics.stats("modify")["calls"] == 1
+
+class TestGeneratorInstrumentation:
+    """Las operaciones del generador quedan registradas con su desglose"""
+
+    @pytest.mark.asyncio
+    async def test_create_records_phases(self, isolated_llm_metrics, isolated_similarity_cache):
+        """Crear una rutina registra red, extracción, validación y tamaños"""
+        isolated_similarity_cache.enabled = False
+        generator = GeminiRoutineGenerator(backend=FakeBackend(latency=0, tokens_per_second=0))
+
+        await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=3))
+        await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=3))
+        stats = isolated_llm_metrics.stats("create")
+
+        assert stats["calls"] == 2
+        assert stats["model_calls"] == 1
+        assert stats["outcomes"] == {"ok": 1, "cache_hit": 1}
+        for phase in ("queue_wait", "network", "json_extraction", "validation", "total"):
+            assert phase in stats["timings"]
+        assert stats["timings"]["network"]["count"] == 1
+        assert stats["sizes"]["response_chars"]["count"] == 2
+
+    @pytest.mark.asyncio
+    async def test_stream_records_first_chunk(self, isolated_llm_metrics):
+        """En streaming se registra el tiempo hasta el primer fragmento"""
+        generator = GeminiRoutineGenerator(backend=FakeBackend(latency=0, tokens_per_second=0))
+
+        events = [event async for event in generator.stream_initial_routine(RoutineRequest(goals="Fuerza", days=2))]
+        stats = isolated_llm_metrics.stats("create")
+
+        assert events[-1]["type"] == "routine"
+        assert stats["outcomes"] == {"ok": 1}
+        assert "first_chunk" in stats["timings"]
+
+    @pytest.mark.asyncio
+    async def test_parse_error_outcome(self, isolated_llm_metrics):
+        """Una respuesta sin JSON se registra como error de extracción"""
+        backend = FakeBackend(latency=0, tokens_per_second=0)
+        backend.respond = lambda contents: "Lo siento, no puedo ayudarte con eso."
+        generator = GeminiRoutineGenerator(backend=backend)
+
+        with pytest.raises(ValueError):
+            await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=3))
+
+        assert isolated_llm_metrics.stats("create")["outcomes"] == {"parse_error": 1}
+
+class TestMetricsEndpoints:
+    """Los endpoints exponen las métricas registradas"""
+
+    @pytest.mark.asyncio
+    async def test_metrics_endpoints(self, test_client, isolated_llm_metrics, isolated_similarity_cache):
+        """El resumen incluye las operaciones y cada operación tiene su detalle"""
+        isolated_similarity_cache.enabled = False
+        generator = GeminiRoutineGenerator(backend=FakeBackend(latency=0, tokens_per_second=0))
+        await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=3))
+
+        response = test_client.get("/api/llm/metrics")
+        assert response.status_code == 200
+        assert response.json()["operations"]["create"]["calls"] == 1
+
+        response = test_client.get("/api/llm/metrics/create")
+        assert response.status_code == 200
+        assert response.json()["outcomes"] == {"ok": 1}
+
+        assert test_client.get("/api/llm/metrics/desconocida").status_code == 404
@@ -0,0 +1,163 @@
+import pytest
+from unittest.mock import patch
+from app.models.models import RoutineRequest
+from app.services.cassette import Cassette, RecordingBackend
+from app.services.llm_backend import FakeBackend, FakeBackendError, GeminiBackend
+from app.services.model_router import ModelRoute, ModelRouter, parse_routes
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.resilience import LLMUnavailableError, ResiliencePolicy
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_router(clock, **kwargs):
+    options = dict(p95_threshold=5, error_threshold=0.5, min_samples=4, probe_interval=30,
+                   recovery_probes=2, clock=clock)
+    options.update(kwargs)
+    return ModelRouter(routes={"create": ModelRoute("create", "pro", "flash")}, **options)
+
+class TestParseRoutes:
+    """Pruebas para la tabla de rutas configurable"""
+
+    def test_routes_from_json(self):
+        """Cada operación toma sus modelos del JSON y el resto usa los valores por defecto"""
+        routes = parse_routes('{"create": {"primary": "pro", "fallback": "flash"}, "explain": "flash-8b"}',
+                              default_model="flash", default_fallback="flash-8b")
+
+        assert (routes["create"].primary, routes["create"].fallback) == ("pro", "flash")
+        assert (routes["explain"].primary, routes["explain"].fallback) == ("flash-8b", None)
+        assert (routes["analyze"].primary, routes["analyze"].fallback) == ("flash", "flash-8b")
+
+    def test_fallback_is_opt_in(self):
+        """Sin respaldo configurado ninguna operación cambia de modelo"""
+        routes = parse_routes('{"create": {"primary": "pro", "fallback": "flash"}}',
+                              default_model="flash", default_fallback="")
+
+        assert routes["create"].fallback == "flash"
+        assert all(routes[operation].fallback is None for operation in ("modify", "explain", "analyze"))
+
+    def test_invalid_json_uses_defaults(self):
+        """Una configuración rota no impide arrancar"""
+        routes = parse_routes("{no es json", default_model="flash", default_fallback=None)
+        assert routes["modify"].primary == "flash"
+        assert routes["modify"].fallback is None
+
+class TestModelRouter:
+    """Pruebas para el cambio adaptativo de modelo"""
+
+    def test_error_rate_moves_to_fallback(self):
+        """Con demasiados errores en el principal la operación pasa al respaldo"""
+        router = make_router(FakeClock())
+        for ok in (True, False, False, False):
+            assert router.choose("create") == "pro"
+            router.record("create", "pro", 1.0, ok)
+
+        assert router.choose("create") == "flash"
+        assert router.stats()["routes"]["create"]["switches"] == 1
+
+    def test_slow_p95_moves_to_fallback(self):
+        """Un p95 por encima del umbral también cambia de modelo"""
+        router = make_router(FakeClock())
+        for seconds in (1, 1, 1, 9):
+            router.record("create", "pro", seconds, True)
+
+        assert router.routes["create"].active == "flash"
+
+    def test_probes_restore_primary(self):
+        """En respaldo se prueba el principal cada cierto tiempo y vuelve tras varias pruebas sanas"""
+        clock = FakeClock()
+        router = make_router(clock)
+        for _ in range(4):
+            router.record("create", "pro", 1.0, False)
+        assert router.choose("create") == "flash"
+
+        for _ in range(2):
+            clock.now += 31
+            assert router.choose("create") == "pro"
+            assert router.choose("create") == "flash"
+            router.record("create", "pro", 1.0, True)
+
+        assert router.routes["create"].active == "pro"
+        assert router.choose("create") == "pro"
+
+    def test_disabled_router_always_uses_primary(self):
+        """Con el enrutado desactivado no se cambia de modelo"""
+        router = make_router(FakeClock(), enabled=False)
+        for _ in range(10):
+            router.record("create", "pro", 1.0, False)
+        assert router.choose("create") == "pro"
+
+class TestGeneratorRouting:
+    """El generador usa el modelo que asigna el enrutador"""
+
+    @pytest.mark.asyncio
+    async def test_failing_primary_falls_back(self):
+        """Tras fallar el principal, la siguiente creación la atiende el respaldo"""
+        backends = {
+            "pro": FakeBackend(latency=0, tokens_per_second=0, error_rate=1, model_name="pro"),
+            "flash": FakeBackend(latency=0, tokens_per_second=0, model_name="flash")
+        }
+        router = make_router(FakeClock(), min_samples=1)
+        request = RoutineRequest(goals="Fuerza", days=3)
+
+        with patch("app.services.gemini_service.backend", GeminiBackend("pro", api_key="clave")), \
+                patch("app.services.llm_backend.get_gemini_backend", side_effect=backends.get), \
+                patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+                patch("app.services.gemini_service.model_router", router):
+            generator = GeminiRoutineGenerator(offline_fallback=False)
+            with pytest.raises(LLMUnavailableError):
+                await generator.create_initial_routine(request)
+            routine = await generator.create_initial_routine(request)
+
+        assert len(routine.days) == 3
+        assert backends["flash"].calls == 1
+        assert router.stats()["routes"]["create"]["active"] == "flash"
+
+    @pytest.mark.asyncio
+    async def test_latency_is_measured_per_attempt(self):
+        """Los reintentos y sus esperas no cuentan en la latencia del modelo"""
+        clock = FakeClock()
+        router = make_router(clock)
+        attempts = 0
+
+        async def flaky():
+            nonlocal attempts
+            attempts += 1
+            clock.now += 2
+            if attempts == 1:
+                raise FakeBackendError("caída")
+            return "ok"
+
+        async def backoff(seconds):
+            clock.now += 10
+
+        policy = ResiliencePolicy(base_delay=1, max_retries=1, clock=clock)
+        observer = lambda seconds, ok: router.record("create", "pro", seconds, ok)
+        with patch("app.services.resilience.asyncio.sleep", side_effect=backoff):
+            assert await policy.call(flaky, on_attempt=observer) == "ok"
+
+        health = router._health[("create", "pro")]
+        assert list(health.results) == [False, True]
+        assert list(health.latencies.samples) == [2]
+
+    @pytest.mark.asyncio
+    async def test_recorded_backend_is_routed(self, tmp_path):
+        """Con la grabación activa se enruta igual y se graba el modelo elegido"""
+        backends = {"pro": FakeBackend(latency=0, tokens_per_second=0, model_name="pro")}
+        cassette = Cassette(str(tmp_path / "gemini.jsonl"))
+        router = make_router(FakeClock())
+
+        with patch("app.services.gemini_service.backend", RecordingBackend(GeminiBackend("flash", api_key="clave"), cassette)), \
+                patch("app.services.llm_backend.get_gemini_backend", side_effect=backends.get), \
+                patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+                patch("app.services.gemini_service.model_router", router):
+            generator = GeminiRoutineGenerator(offline_fallback=False)
+            await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=2))
+
+        assert backends["pro"].calls == 1
+        assert [record["model"] for records in cassette.load().values() for record in records] == ["pro"]
+        assert len(router._health[("create", "pro")].results) == 1
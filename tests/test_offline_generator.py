@@ -0,0 +1,105 @@
+import time
+import asyncio
+import pytest
+from app.models.models import RoutineRequest
+from app.services.exercise_library import BODYWEIGHT, EXERCISE_LIBRARY, parse_equipment, parse_level, BEGINNER
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend
+from app.services.routine_service import RoutineGenerator
+
+class UnconfiguredBackend(FakeBackend):
+    """Backend falso sin credenciales"""
+
+    @property
+    def available(self) -> bool:
+        return False
+
+LIBRARY = {exercise.name: exercise for exercise in EXERCISE_LIBRARY}
+
+class TestOfflineGenerator:
+    """Pruebas para la generación de rutinas sin el modelo"""
+
+    @pytest.mark.asyncio
+    async def test_any_request_gets_a_valid_routine(self):
+        """Cualquier número de días produce una rutina completa en milisegundos"""
+        generator = RoutineGenerator()
+        for days in range(1, 8):
+            start = time.perf_counter()
+            routine = await generator.create_initial_routine(RoutineRequest(goals="Hipertrofia", days=days))
+            assert time.perf_counter() - start < 0.05
+
+            assert len(routine.days) == days
+            assert len({day.day_name for day in routine.days}) == days
+            for day in routine.days:
+                assert len(day.exercises) >= 4
+                assert len({e.name for e in day.exercises}) == len(day.exercises)
+                assert all(e.reps == "8-12" for e in day.exercises)
+
+        routine = generator.build_offline_routine(RoutineRequest(goals="", days=12))
+        assert len(routine.days) == 7
+
+    def test_equipment_and_level(self):
+        """Solo se usan ejercicios del equipamiento disponible y del nivel indicado"""
+        assert parse_equipment("En casa, sin equipo") == {BODYWEIGHT}
+        assert "mancuernas" in parse_equipment("Tengo mancuernas y una banda elástica")
+        assert parse_level("Soy principiante") == BEGINNER
+
+        routine = RoutineGenerator().build_offline_routine(RoutineRequest(
+            goals="Fuerza", equipment="En casa, sin equipo", days=3, experience_level="principiante"
+        ))
+        exercises = [e for day in routine.days for e in day.exercises]
+
+        assert all(LIBRARY[e.name].category == BODYWEIGHT for e in exercises)
+        assert all(LIBRARY[e.name].level == BEGINNER for e in exercises)
+        assert {(e.sets, e.reps, e.rest) for e in exercises} == {(4, "3-5", "2-3 min")}
+
+    def test_same_request_same_routine(self):
+        """La generación es determinista"""
+        request = RoutineRequest(goals="Perder grasa", equipment="Mancuernas", days=5)
+        first = RoutineGenerator().build_offline_routine(request)
+        second = RoutineGenerator().build_offline_routine(request)
+
+        assert first.model_dump(exclude={"created_at"}) == second.model_dump(exclude={"created_at"})
+
+    @pytest.mark.asyncio
+    async def test_fallback_when_gemini_is_unavailable(self, isolated_resilience):
+        """Sin configurar o con el circuito abierto se genera la rutina localmente"""
+        request = RoutineRequest(goals="Fuerza", days=3)
+
+        fake = UnconfiguredBackend(latency=0, tokens_per_second=0)
+        routine = await GeminiRoutineGenerator(backend=fake).create_initial_routine(request)
+        assert len(routine.days) == 3 and fake.calls == 0
+
+        for _ in range(isolated_resilience.breaker.threshold):
+            isolated_resilience.breaker.record_failure()
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+        events = [event async for event in GeminiRoutineGenerator(backend=fake).stream_initial_routine(request)]
+        assert [event["type"] for event in events] == ["routine_name", "day", "day", "day", "routine"]
+        assert fake.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_fallback_on_deadline(self):
+        """Si el modelo no responde a tiempo se devuelve la rutina local"""
+        fake = FakeBackend(latency=1, latency_sigma=0, tokens_per_second=0)
+        generator = GeminiRoutineGenerator(backend=fake, offline_deadline=0.1)
+
+        start = time.perf_counter()
+        routine = await generator.create_initial_routine(RoutineRequest(goals="Resistencia", days=2))
+
+        assert time.perf_counter() - start < 0.5
+        assert routine.days[0].exercises[0].reps == "12-15"
+
+    @pytest.mark.asyncio
+    async def test_stream_fallback_on_deadline(self):
+        """En streaming el plazo se aplica al primer evento"""
+        fake = FakeBackend(latency=0.3, latency_sigma=0, tokens_per_second=0)
+        generator = GeminiRoutineGenerator(backend=fake, offline_deadline=0.05)
+
+        start = time.perf_counter()
+        events = [event async for event in generator.stream_initial_routine(RoutineRequest(goals="Resistencia", days=2))]
+
+        assert time.perf_counter() - start < 0.25
+        assert events[-1]["type"] == "routine"
+        assert len(events[-1]["routine"].days) == 2
+        # La llamada abandonada termina antes de cerrar el bucle de eventos
+        await asyncio.sleep(0.4)
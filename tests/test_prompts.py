@@ -0,0 +1,41 @@
+from app.models.models import RoutineRequest
+from app.services.llm_backend import FakeBackend
+from app.services import prompts
+
+class TestPrompts:
+    """Pruebas para los prompts con prefijo estático y minificados"""
+
+    def test_prompts_start_with_static_prefix(self, sample_routine):
+        """La parte estática es idéntica al principio de todos los prompts de un tipo"""
+        first = prompts.build_patch_prompt(sample_routine, "Más series")
+        second = prompts.build_patch_prompt(sample_routine, "Quita un día", "Usuario: sin saltos")
+
+        assert first.startswith(prompts.PATCH_PROMPT_PREFIX + "\n")
+        assert second.startswith(prompts.PATCH_PROMPT_PREFIX + "\n")
+        assert prompts.build_initial_prompt(RoutineRequest(goals="Fuerza", days=3)).startswith(
+            prompts.INITIAL_PROMPT_PREFIX + "\n")
+
+    def test_prompts_are_minified(self, sample_routine):
+        """Sin sangría, sin líneas vacías y con el JSON de la rutina compacto"""
+        prompt = prompts.build_combined_modification_prompt(sample_routine, "  Más   series ")
+
+        assert all(line == line.strip() and line for line in prompt.splitlines())
+        assert '", "' not in prompt
+        assert '"user_id"' not in prompt
+        assert '"Más series"' in prompt
+
+    def test_empty_optional_fields_are_omitted(self):
+        """Solo se envían los datos que tiene la petición, incluido el equipo"""
+        prompt = prompts.build_initial_prompt(RoutineRequest(goals="Fuerza", equipment="Mancuernas", days=4))
+
+        assert "Equipo disponible: Mancuernas" in prompt
+        assert "Nivel de experiencia" not in prompt
+        assert "Incluye exactamente 4 días en la rutina." in prompt
+
+    def test_fake_backend_understands_new_prompts(self, sample_routine):
+        """El backend de pruebas sigue reconociendo cada tipo de prompt"""
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+
+        assert '"routine_name"' in fake.respond(prompts.build_initial_prompt(RoutineRequest(goals="Fuerza", days=3)))
+        assert '"operations"' in fake.respond(prompts.build_patch_prompt(sample_routine, "Más series"))
+        assert '"explanation"' in fake.respond(prompts.build_combined_modification_prompt(sample_routine, "Más series"))
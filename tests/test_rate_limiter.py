@@ -0,0 +1,137 @@
+import pytest
+import asyncio
+import sqlite3
+from app.services.rate_limiter import (
+    RateLimiter, TokenBucketStore, RateLimitExceeded, PRIORITY_CHAT, PRIORITY_CREATE, PRIORITY_IMAGE
+)
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "buckets.db")
+
+class TestTokenBucketStore:
+    """Pruebas para los token buckets compartidos en SQLite"""
+    
+    def test_burst_then_wait(self, store_path):
+        """Se admite la ráfaga y después hay que esperar a que se rellene el bucket"""
+        store = TokenBucketStore(path=store_path, rate=1, capacity=2, reserve=0)
+        
+        assert store.try_acquire(None, PRIORITY_CREATE) == (0.0, None)
+        assert store.try_acquire(None, PRIORITY_CREATE) == (0.0, None)
+        wait, blocked_by = store.try_acquire(None, PRIORITY_CREATE)
+        
+        assert blocked_by == "global"
+        assert 0 < wait <= 1
+    
+    def test_user_buckets_are_independent(self, store_path):
+        """Un usuario que agota su bucket no bloquea a los demás"""
+        store = TokenBucketStore(path=store_path, rate=10, capacity=10, user_rate=0.01, user_capacity=1)
+        
+        assert store.try_acquire(1, PRIORITY_CHAT) == (0.0, None)
+        assert store.try_acquire(1, PRIORITY_CHAT)[1] == "user"
+        assert store.try_acquire(2, PRIORITY_CHAT) == (0.0, None)
+    
+    def test_state_shared_between_workers(self, store_path):
+        """Dos instancias sobre el mismo archivo (dos workers) comparten los tokens"""
+        worker_a = TokenBucketStore(path=store_path, rate=0.01, capacity=1)
+        worker_b = TokenBucketStore(path=store_path, rate=0.01, capacity=1)
+        
+        assert worker_a.try_acquire(None, PRIORITY_CHAT) == (0.0, None)
+        assert worker_b.try_acquire(None, PRIORITY_CHAT)[1] == "global"
+    
+    def test_lower_priorities_leave_a_reserve(self, store_path):
+        """Las prioridades bajas no pueden gastar los últimos tokens"""
+        store = TokenBucketStore(path=store_path, rate=0.01, capacity=3, reserve=1)
+        
+        assert store.try_acquire(None, PRIORITY_CREATE) == (0.0, None)  # Quedan 2
+        assert store.try_acquire(None, PRIORITY_IMAGE)[1] == "global"   # Necesita 3
+        assert store.try_acquire(None, PRIORITY_CREATE) == (0.0, None)  # Necesita 2
+        assert store.try_acquire(None, PRIORITY_CREATE)[1] == "global"
+        assert store.try_acquire(None, PRIORITY_CHAT) == (0.0, None)    # El chat usa el último
+
+class TestRateLimiter:
+    """Pruebas para la cola con prioridad"""
+    
+    @pytest.mark.asyncio
+    async def test_chat_beats_queued_image_request(self, store_path):
+        """Cuando se libera un token lo recibe la petición más prioritaria"""
+        limiter = RateLimiter(store=TokenBucketStore(path=store_path, rate=20, capacity=1, reserve=0))
+        await limiter.acquire(priority=PRIORITY_CREATE)
+        order = []
+        
+        async def request(name, priority):
+            await limiter.acquire(priority=priority)
+            order.append(name)
+        
+        image = asyncio.ensure_future(request("image", PRIORITY_IMAGE))
+        await asyncio.sleep(0)
+        chat = asyncio.ensure_future(request("chat", PRIORITY_CHAT))
+        await asyncio.gather(image, chat)
+        
+        assert order == ["chat", "image"]
+        stats = limiter.stats()
+        assert stats["granted"] == 3
+        assert stats["queue_depth"] == {"chat": 0, "create": 0, "image": 0}
+    
+    @pytest.mark.asyncio
+    async def test_rejects_after_max_wait(self, store_path):
+        """Si la espera estimada supera el máximo se rechaza con RateLimitExceeded"""
+        limiter = RateLimiter(store=TokenBucketStore(path=store_path, rate=0.01, capacity=1), max_wait=1)
+        await limiter.acquire()
+        
+        with pytest.raises(RateLimitExceeded):
+            await limiter.acquire()
+        assert limiter.stats()["rejected"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_disabled_limiter_never_waits(self, store_path):
+        """Con el limitador desactivado no se consulta el almacén"""
+        limiter = RateLimiter(store=TokenBucketStore(path=store_path, rate=0.01, capacity=1), enabled=False)
+        
+        for _ in range(3):
+            assert await limiter.acquire() == 0.0
+    
+    @pytest.mark.asyncio
+    async def test_locked_store_does_not_block_event_loop(self, store_path):
+        """Mientras otro worker tiene el bloqueo de SQLite el bucle de eventos sigue atendiendo"""
+        limiter = RateLimiter(store=TokenBucketStore(path=store_path, rate=10, capacity=10))
+        limiter.stats()  # Crea la tabla
+        other_worker = sqlite3.connect(store_path, isolation_level=None)
+        other_worker.execute("BEGIN IMMEDIATE")
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        
+        task = asyncio.ensure_future(ticker())
+        acquire = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.3)
+        other_worker.execute("COMMIT")
+        other_worker.close()
+        await acquire
+        task.cancel()
+        
+        assert ticks >= 15
+    
+    @pytest.mark.asyncio
+    async def test_waiters_back_off_instead_of_polling(self, store_path):
+        """Sin tokens se espera a que haya uno en lugar de consultar el almacén cada 100 ms"""
+        store = TokenBucketStore(path=store_path, rate=1, capacity=1, reserve=0)
+        limiter = RateLimiter(store=store)
+        await limiter.acquire()
+        attempts = 0
+        try_acquire = store.try_acquire
+        
+        def counted(*args):
+            nonlocal attempts
+            attempts += 1
+            return try_acquire(*args)
+        
+        store.try_acquire = counted
+        waited = await limiter.acquire()
+        
+        assert 0.9 <= waited < 2.5
+        assert attempts <= 3
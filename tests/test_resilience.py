@@ -0,0 +1,197 @@
+import pytest
+import asyncio
+from unittest.mock import patch, MagicMock
+from google.api_core import exceptions as api_exceptions
+from app.services.resilience import ResiliencePolicy, CircuitBreaker, LLMUnavailableError, is_retryable
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.models.models import RoutineRequest
+
+class FakeClock:
+    """Reloj manual para probar el circuito sin esperar"""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+class TestResiliencePolicy:
+    """Pruebas para plazos, reintentos, circuito y hedging"""
+    
+    def test_retryable_errors(self):
+        """429, 5xx y plazos agotados se reintentan; los errores del cliente no"""
+        assert is_retryable(api_exceptions.ResourceExhausted("cuota"))
+        assert is_retryable(api_exceptions.ServiceUnavailable("caída"))
+        assert is_retryable(asyncio.TimeoutError())
+        assert not is_retryable(api_exceptions.InvalidArgument("prompt no válido"))
+        assert not is_retryable(ValueError("JSON"))
+    
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self):
+        """Reintenta los errores transitorios hasta obtener respuesta"""
+        policy = ResiliencePolicy(base_delay=0, max_retries=2)
+        attempts = 0
+        
+        async def flaky():
+            nonlocal attempts
+            attempts += 1
+            if attempts < 3:
+                raise api_exceptions.ServiceUnavailable("caída")
+            return "ok"
+        
+        assert await policy.call(flaky) == "ok"
+        assert attempts == 3
+        assert policy.stats()["retries"] == 2
+        assert policy.breaker.state == "closed"
+    
+    @pytest.mark.asyncio
+    async def test_non_retryable_error_is_raised_once(self):
+        """Un error del cliente se propaga sin reintentos"""
+        policy = ResiliencePolicy(base_delay=0)
+        func = MagicMock(side_effect=api_exceptions.InvalidArgument("prompt no válido"))
+        
+        async def call():
+            return func()
+        
+        with pytest.raises(api_exceptions.InvalidArgument):
+            await policy.call(call)
+        assert func.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_deadline_and_exhausted_retries(self):
+        """Un intento que supera el plazo se corta y, agotados los reintentos, el error es LLMUnavailableError"""
+        policy = ResiliencePolicy(timeout=0.02, base_delay=0, max_retries=1)
+        
+        async def hanging():
+            await asyncio.sleep(1)
+        
+        with pytest.raises(LLMUnavailableError):
+            await policy.call(hanging)
+        assert policy.stats()["timeouts"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_circuit_opens_and_recovers(self):
+        """Tras el umbral de fallos falla al instante y, pasado el tiempo de espera, deja pasar una prueba"""
+        clock = FakeClock()
+        policy = ResiliencePolicy(base_delay=0, max_retries=0, clock=clock,
+                                  breaker=CircuitBreaker(threshold=2, cooldown=30, clock=clock))
+        calls = 0
+        
+        async def failing():
+            nonlocal calls
+            calls += 1
+            raise api_exceptions.ServiceUnavailable("caída")
+        
+        for _ in range(2):
+            with pytest.raises(LLMUnavailableError):
+                await policy.call(failing)
+        assert policy.breaker.state == "open"
+        
+        with pytest.raises(LLMUnavailableError) as error:
+            await policy.call(failing)
+        assert calls == 2  # No llega a llamar a la API
+        assert error.value.retry_after == 30
+        
+        clock.now = 31
+        
+        async def healthy():
+            return "ok"
+        
+        assert await policy.call(healthy) == "ok"
+        assert policy.breaker.state == "closed"
+    
+    @pytest.mark.asyncio
+    async def test_cancelled_trial_releases_circuit(self):
+        """Si se cancela la llamada de prueba, la siguiente puede volver a probar la API"""
+        clock = FakeClock()
+        policy = ResiliencePolicy(clock=clock, breaker=CircuitBreaker(threshold=1, cooldown=30, clock=clock))
+        policy.breaker.record_failure()
+        clock.now = 31
+        
+        async def slow():
+            await asyncio.sleep(10)
+        
+        async def healthy():
+            return "ok"
+        
+        async def chunks():
+            yield "a"
+            yield "b"
+        
+        trial = asyncio.ensure_future(policy.call(slow))
+        await asyncio.sleep(0)
+        assert policy.breaker.state == "half_open"
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        
+        stream = policy.stream(chunks)
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        
+        assert await policy.call(healthy) == "ok"
+        assert policy.breaker.state == "closed"
+    
+    @pytest.mark.asyncio
+    async def test_hedging_uses_fastest_response(self):
+        """Si el intento supera el p95 observado se lanza otro y gana el más rápido"""
+        policy = ResiliencePolicy(hedging=True, hedge_min_samples=3)
+        for _ in range(3):
+            policy.latency.record(0.01)
+        attempts = 0
+        
+        async def sometimes_slow():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(1 if attempts == 1 else 0.01)
+            return attempts
+        
+        assert await policy.call(sometimes_slow) == 2
+        assert policy.stats()["hedges"] == 1
+        assert policy.stats()["hedge_wins"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_stream_retries_before_first_chunk(self):
+        """En streaming solo se reintenta si aún no se ha entregado ningún fragmento"""
+        policy = ResiliencePolicy(base_delay=0)
+        attempts = 0
+        
+        async def chunks():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise api_exceptions.ResourceExhausted("cuota")
+            yield "a"
+            yield "b"
+        
+        assert [chunk async for chunk in policy.stream(chunks)] == ["a", "b"]
+        assert attempts == 2
+
+class TestGeminiResilience:
+    """Integración de la política con el generador de rutinas"""
+    
+    @pytest.mark.asyncio
+    async def test_create_routine_retries_quota_errors(self, isolated_resilience):
+        """Un 429 puntual no llega al usuario"""
+        text = '{"routine_name": "R", "days": [{"day_name": "Lunes", "focus": "Piernas", "exercises": [' \
+               '{"name": "Sentadilla", "sets": 3, "reps": "10", "rest": "60 seg", "equipment": "Barra"}]}]}'
+        with patch("app.services.gemini_service.backend") as mock_model, \
+             patch("app.services.gemini_service.GEMINI_CONFIGURED", True):
+            mock_model.generate_content.side_effect = [api_exceptions.ResourceExhausted("cuota"), MagicMock(text=text)]
+            
+            routine = await GeminiRoutineGenerator().create_initial_routine(RoutineRequest(goals="Fuerza", days=1))
+        
+        assert routine.routine_name == "R"
+        assert isolated_resilience.stats()["retries"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_open_circuit_is_not_wrapped(self, isolated_resilience):
+        """Con el circuito abierto el servicio propaga LLMUnavailableError (503 en la API)"""
+        for _ in range(isolated_resilience.breaker.threshold):
+            isolated_resilience.breaker.record_failure()
+        
+        with patch("app.services.gemini_service.backend"), \
+             patch("app.services.gemini_service.GEMINI_CONFIGURED", True):
+            with pytest.raises(LLMUnavailableError):
+                generator = GeminiRoutineGenerator(offline_fallback=False)
+                await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=1))
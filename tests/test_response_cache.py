@@ -0,0 +1,119 @@
+import pytest
+import time
+import sqlite3
+from unittest.mock import patch, MagicMock
+from app.services.response_cache import ResponseCache, make_cache_key
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.models.models import RoutineRequest
+
+class TestResponseCache:
+    """Pruebas para la caché persistente de respuestas"""
+    
+    @pytest.fixture
+    def cache_path(self, tmp_path):
+        return str(tmp_path / "cache.db")
+    
+    @pytest.mark.asyncio
+    async def test_set_and_get(self, cache_path):
+        """Una respuesta guardada se recupera con el mismo prompt y modelo"""
+        cache = ResponseCache(path=cache_path)
+        await cache.set("prompt", "gemini-1.5-flash", "respuesta")
+        
+        assert await cache.get("prompt", "gemini-1.5-flash") == "respuesta"
+        assert await cache.get("prompt", "otro-modelo") is None
+        assert await cache.get("otro prompt", "gemini-1.5-flash") is None
+    
+    def test_key_ignores_whitespace(self):
+        """El prompt se canoniza antes de calcular la clave"""
+        assert make_cache_key("  Hola\n   mundo ", "m") == make_cache_key("Hola mundo", "m")
+        assert make_cache_key("Hola mundo", "m") != make_cache_key("Hola mundo", "n")
+    
+    @pytest.mark.asyncio
+    async def test_shared_between_instances(self, cache_path):
+        """Dos instancias (p. ej. dos workers) comparten entradas y contadores"""
+        worker_a = ResponseCache(path=cache_path)
+        worker_b = ResponseCache(path=cache_path)
+        
+        await worker_a.set("prompt", "m", "respuesta")
+        
+        assert await worker_b.get("prompt", "m") == "respuesta"
+        assert worker_a.stats()["hits"] == 0
+        worker_b.flush()
+        assert worker_a.stats()["hits"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_reads_do_not_take_the_write_lock(self, cache_path):
+        """Un acierto no escribe: se sirve aunque otro worker tenga el bloqueo de escritura"""
+        cache = ResponseCache(path=cache_path, flush_batch=3)
+        await cache.set("prompt", "m", "respuesta")
+        other_worker = sqlite3.connect(cache_path, isolation_level=None)
+        other_worker.execute("BEGIN IMMEDIATE")
+        
+        start = time.monotonic()
+        assert await cache.get("prompt", "m") == "respuesta"
+        assert await cache.get("prompt", "m") == "respuesta"
+        assert time.monotonic() - start < 1
+        
+        other_worker.execute("COMMIT")
+        other_worker.close()
+        await cache.get("prompt", "m")  # La tercera lectura escribe el lote
+        assert ResponseCache(path=cache_path).stats()["hits"] == 3
+    
+    @pytest.mark.asyncio
+    async def test_ttl_expiration(self, cache_path):
+        """Las entradas caducadas cuentan como fallo y se eliminan en la siguiente escritura"""
+        cache = ResponseCache(path=cache_path, ttl=60)
+        await cache.set("prompt", "m", "respuesta")
+        
+        with patch("app.services.response_cache.time.time", return_value=time.time() + 120):
+            assert await cache.get("prompt", "m") is None
+            await cache.set("otro", "m", "otra respuesta")
+        
+        stats = cache.stats()
+        assert stats["expired"] == 1
+        assert stats["entries"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self, cache_path):
+        """Al superar el tamaño máximo se expulsa la entrada menos usada"""
+        cache = ResponseCache(path=cache_path, max_entries=2)
+        await cache.set("a", "m", "A")
+        time.sleep(0.01)
+        await cache.set("b", "m", "B")
+        time.sleep(0.01)
+        await cache.get("a", "m")  # "a" pasa a ser la más reciente
+        time.sleep(0.01)
+        await cache.set("c", "m", "C")
+        
+        assert await cache.get("a", "m") == "A"
+        assert await cache.get("b", "m") is None
+        assert await cache.get("c", "m") == "C"
+        assert cache.stats()["evictions"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_disabled(self, cache_path):
+        """Con la caché desactivada nunca se guardan ni sirven respuestas"""
+        cache = ResponseCache(path=cache_path, enabled=False)
+        await cache.set("prompt", "m", "respuesta")
+        
+        assert await cache.get("prompt", "m") is None
+    
+    @pytest.mark.asyncio
+    async def test_generator_uses_cache(self, isolated_response_cache, isolated_similarity_cache):
+        """Una solicitud idéntica no vuelve a llamar al modelo"""
+        isolated_similarity_cache.enabled = False
+        mock_model = MagicMock()
+        mock_model.generate_content.return_value = MagicMock(
+            text='{"routine_name": "Rutina", "days": []}'
+        )
+        request = RoutineRequest(goals="Hipertrofia", days=3, user_id=1)
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator()
+            first = await generator.create_initial_routine(request)
+            second = await generator.create_initial_routine(request)
+        
+        assert mock_model.generate_content.call_count == 1
+        assert first == second
+        assert isolated_response_cache.stats()["hits"] == 1
@@ -0,0 +1,90 @@
+import time
+import pytest
+from app.models.models import Exercise
+from app.services.routine_commands import LocalCommands, parse_command
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend
+
+def apply(routine, message):
+    return LocalCommands().apply(routine, message)
+
+class TestRoutineCommands:
+    """Pruebas para las ediciones mecánicas que se aplican sin el modelo"""
+
+    def test_sets_reps_and_rest(self, sample_routine):
+        """Series, repeticiones y descanso de un ejercicio o de toda la rutina"""
+        routine, explanation = apply(sample_routine, "Pon 4 series en dominadas")
+        assert routine.days[1].exercises[0].sets == 4
+        assert "Dominadas" in explanation
+
+        routine, _ = apply(sample_routine, "las repeticiones del curl de bíceps a 10-12")
+        assert routine.days[1].exercises[1].reps == "10-12"
+
+        routine, _ = apply(sample_routine, "Descanso de 90 segundos en todo, por favor")
+        assert {e.rest for day in routine.days for e in day.exercises} == {"90 seg"}
+
+    def test_remove_and_add_exercise(self, sample_routine):
+        """Quitar un ejercicio por su nombre y añadir uno nuevo a un día"""
+        routine, _ = apply(sample_routine, "Quita los fondos en paralelas")
+        assert [e.name for e in routine.days[0].exercises] == ["Press de banca"]
+
+        routine, _ = apply(sample_routine, "Añade 4 series de press inclinado al miércoles")
+        added = routine.days[1].exercises[-1]
+        assert (added.name, added.sets) == ("Press inclinado", 4)
+
+    def test_swap_days(self, sample_routine):
+        """Intercambiar dos días mantiene los nombres de los días"""
+        routine, _ = apply(sample_routine, "Intercambia el lunes y el miércoles")
+
+        assert [day.day_name for day in routine.days] == ["Lunes", "Miércoles"]
+        assert routine.days[0].focus == "Espalda y bíceps"
+        assert routine.days[1].exercises == sample_routine.days[0].exercises
+
+    def test_destructive_removals_go_to_model(self, sample_routine):
+        """Vaciar la rutina o un día necesita confirmación y no se aplica localmente"""
+        assert parse_command(sample_routine, "Quita todo") is None
+        assert parse_command(sample_routine, "Borra la rutina") is None
+        assert parse_command(sample_routine, "Elimina todos los ejercicios") is None
+        assert parse_command(sample_routine, "Quita las dominadas y el curl de bíceps") is None
+        assert parse_command(sample_routine, "quita las dominadas, quita el curl de bíceps") is None
+
+    def test_several_instructions(self, sample_routine):
+        """Varias instrucciones reconocidas en el mismo mensaje"""
+        routine, _ = apply(sample_routine, "pon 5 series en press de banca y quita las dominadas")
+
+        assert routine.days[0].exercises[0].sets == 5
+        assert [e.name for e in routine.days[1].exercises] == ["Curl de bíceps"]
+
+    def test_unclear_messages_go_to_model(self, sample_routine):
+        """Lo que no se entiende con seguridad no se toca"""
+        ambiguous = sample_routine.model_copy(deep=True)
+        ambiguous.days[1].exercises.append(Exercise(name="Press militar", sets=3, reps="8-12",
+                                                    rest="60 seg", equipment="Barra"))
+
+        assert parse_command(sample_routine, "Hazla más intensa") is None
+        assert parse_command(sample_routine, "Cambia las sentadillas por prensa") is None
+        assert parse_command(sample_routine, "Quita el miércoles") is None
+        assert parse_command(sample_routine, "Cambia el lunes por el miércoles") is None
+        assert parse_command(sample_routine, "pon 4 series en dominadas y hazla más dura") is None
+        assert parse_command(ambiguous, "pon 4 series en press") is None
+
+    def test_parsing_is_fast(self, sample_routine):
+        """Interpretar un mensaje cuesta muy por debajo de un milisegundo"""
+        start = time.perf_counter()
+        for _ in range(200):
+            parse_command(sample_routine, "Pon 4 series en dominadas")
+        assert (time.perf_counter() - start) / 200 < 0.001
+
+    @pytest.mark.asyncio
+    async def test_generator_skips_model(self, sample_routine, isolated_local_commands):
+        """El generador aplica el comando sin llamar al modelo y cuenta los aciertos"""
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+        generator = GeminiRoutineGenerator(backend=fake)
+
+        routine, _ = await generator.modify_and_explain(sample_routine, "pon 2 series en curl de bíceps")
+        await generator.modify_and_explain(sample_routine, "Hazla más intensa")
+
+        assert routine.days[1].exercises[1].sets == 2
+        assert fake.calls == 1
+        assert isolated_local_commands.stats()["hits"] == 1
+        assert isolated_local_commands.stats()["hit_rate"] == 0.5
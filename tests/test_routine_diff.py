@@ -0,0 +1,63 @@
+import pytest
+from app.models.models import Routine, Day, Exercise
+from app.services.routine_diff import diff_routines, render_explanation
+
+def change_types(changes):
+    return [change["type"] for change in changes]
+
+class TestRoutineDiff:
+    """Pruebas para la comparación estructural de rutinas"""
+    
+    def test_no_changes(self, sample_routine):
+        """Dos rutinas iguales no producen cambios"""
+        changes = diff_routines(sample_routine, sample_routine.model_copy(deep=True))
+        
+        assert changes == []
+        assert "no ha sido necesario" in render_explanation(changes)
+    
+    def test_exercise_field_changes(self, sample_routine):
+        """Detecta cambios de series, repeticiones y descanso"""
+        new = sample_routine.model_copy(deep=True)
+        new.days[0].exercises[0].sets = 5
+        new.days[0].exercises[0].rest = "120 seg"
+        
+        changes = diff_routines(sample_routine, new)
+        
+        assert [(c["field"], c["old"], c["new"]) for c in changes] == [("sets", 3, 5), ("rest", "60-90 seg", "120 seg")]
+        explanation = render_explanation(changes)
+        assert "Press de banca (Lunes): series de 3 a 5." in explanation
+    
+    def test_added_removed_and_reordered_exercises(self, sample_routine):
+        """Detecta ejercicios añadidos, eliminados y reordenados"""
+        new = sample_routine.model_copy(deep=True)
+        new.days[0].exercises.reverse()
+        new.days[1].exercises.pop(0)
+        new.days[1].exercises.append(
+            Exercise(name="Remo con barra", sets=4, reps="8-10", rest="90 seg", equipment="Barra")
+        )
+        
+        changes = diff_routines(sample_routine, new)
+        
+        assert change_types(changes) == ["exercises_reordered", "exercise_removed", "exercise_added"]
+        explanation = render_explanation(changes)
+        assert "Quité Dominadas del día Miércoles." in explanation
+        assert "Añadí Remo con barra al día Miércoles (4 series de 8-10)." in explanation
+    
+    def test_day_and_focus_changes(self, sample_routine):
+        """Detecta días añadidos, eliminados y cambios de enfoque"""
+        new = sample_routine.model_copy(deep=True)
+        new.days[0].focus = "Pecho y hombros"
+        new.days.pop(1)
+        new.days.append(Day(day_name="Viernes", focus="Piernas", exercises=[]))
+        new.routine_name = "Rutina renovada"
+        
+        changes = diff_routines(sample_routine, new)
+        
+        assert change_types(changes) == ["routine_name", "day_removed", "focus", "day_added"]
+    
+    def test_names_matched_case_insensitively(self, sample_routine):
+        """Los nombres se emparejan sin distinguir mayúsculas ni espacios"""
+        new = sample_routine.model_copy(deep=True)
+        new.days[0].exercises[0].name = "press  de BANCA"
+        
+        assert diff_routines(sample_routine, new) == []
@@ -0,0 +1,84 @@
+import time
+import threading
+import pytest
+from app.models.models import RoutineRequest
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend
+
+class ConcurrencyBackend(FakeBackend):
+    """Backend falso que anota cuántas llamadas atiende a la vez"""
+
+    def __init__(self, delay=0.02, broken_skeleton=False):
+        super().__init__(latency=0, tokens_per_second=0)
+        self.delay = delay
+        self.broken_skeleton = broken_skeleton
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            return super().generate_content(contents, stream=stream, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def respond(self, contents):
+        if self.broken_skeleton and "planifica la estructura" in contents:
+            return "No puedo planificar la rutina"
+        return super().respond(contents)
+
+class TestRoutineFanout:
+    """Pruebas para la generación por partes de las rutinas largas"""
+
+    @pytest.mark.asyncio
+    async def test_long_routine_is_generated_by_days(self):
+        """Una llamada para la estructura y otra por día, con la concurrencia limitada"""
+        fake = ConcurrencyBackend()
+        generator = GeminiRoutineGenerator(backend=fake, fanout_min_days=5, fanout_concurrency=2)
+
+        routine = await generator.create_initial_routine(RoutineRequest(goals="Hipertrofia", days=6, user_id=3))
+
+        assert fake.calls == 7
+        assert fake.max_active == 2
+        assert len(routine.days) == 6
+        assert routine.user_id == 3
+        assert [day.day_name for day in routine.days][:2] == ["Lunes", "Martes"]
+        assert all(day.exercises for day in routine.days)
+
+    @pytest.mark.asyncio
+    async def test_short_routine_uses_single_call(self):
+        """Por debajo del umbral se mantiene una sola respuesta"""
+        fake = ConcurrencyBackend(delay=0)
+        generator = GeminiRoutineGenerator(backend=fake, fanout_min_days=5)
+
+        routine = await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=3))
+
+        assert fake.calls == 1
+        assert len(routine.days) == 3
+
+    @pytest.mark.asyncio
+    async def test_invalid_skeleton_falls_back_to_single_call(self):
+        """Si la estructura no es válida se genera la rutina completa como antes"""
+        fake = ConcurrencyBackend(delay=0, broken_skeleton=True)
+        generator = GeminiRoutineGenerator(backend=fake, fanout_min_days=5)
+
+        routine = await generator.create_initial_routine(RoutineRequest(goals="Fuerza", days=5))
+
+        assert fake.calls == 2
+        assert len(routine.days) == 5
+
+    @pytest.mark.asyncio
+    async def test_stream_emits_every_day(self):
+        """En streaming se emite la estructura, cada día al terminar y la rutina final"""
+        generator = GeminiRoutineGenerator(backend=ConcurrencyBackend(delay=0), fanout_min_days=5)
+
+        events = [event async for event in generator.stream_initial_routine(RoutineRequest(goals="Fuerza", days=5))]
+
+        assert events[0]["type"] == "routine_name"
+        assert sorted(event["index"] for event in events if event["type"] == "day") == [0, 1, 2, 3, 4]
+        assert len(events[-1]["routine"].days) == 5
@@ -0,0 +1,94 @@
+import pytest
+import json
+from unittest.mock import patch, MagicMock
+from app.services.routine_patch import apply_routine_patch, PatchError
+from app.services.gemini_service import GeminiRoutineGenerator
+
+class TestRoutinePatch:
+    """Pruebas para la aplicación local de operaciones de modificación"""
+    
+    def test_replace_exercise_field(self, sample_routine):
+        """Reemplaza las series de un ejercicio sin tocar el resto"""
+        result = apply_routine_patch(sample_routine, [
+            {"op": "replace", "path": "/days/0/exercises/1/sets", "value": 4}
+        ])
+        
+        assert result.days[0].exercises[1].sets == 4
+        assert result.days[0].exercises[0] == sample_routine.days[0].exercises[0]
+        assert result.days[1] == sample_routine.days[1]
+        assert sample_routine.days[0].exercises[1].sets == 3  # El original no cambia
+    
+    def test_add_and_remove_exercises(self, sample_routine):
+        """Añade al final con "-" y elimina por índice, en orden"""
+        new_exercise = {"name": "Remo con barra", "sets": 4, "reps": "8-10", "rest": "90 seg", "equipment": "Barra"}
+        result = apply_routine_patch(sample_routine, [
+            {"op": "add", "path": "/days/1/exercises/-", "value": new_exercise},
+            {"op": "remove", "path": "/days/1/exercises/0"}
+        ])
+        
+        assert [e.name for e in result.days[1].exercises] == ["Curl de bíceps", "Remo con barra"]
+    
+    def test_replace_routine_name_and_focus(self, sample_routine):
+        """Permite modificar el nombre de la rutina y el enfoque de un día"""
+        result = apply_routine_patch(sample_routine, [
+            {"op": "replace", "path": "/routine_name", "value": "Rutina nueva"},
+            {"op": "replace", "path": "/days/1/focus", "value": "Espalda"}
+        ])
+        
+        assert result.routine_name == "Rutina nueva"
+        assert result.days[1].focus == "Espalda"
+        assert result.id == sample_routine.id
+    
+    @pytest.mark.parametrize("operations", [
+        [{"op": "move", "path": "/days/0", "from": "/days/1"}],
+        [{"op": "replace", "path": "/user_id", "value": 99}],
+        [{"op": "replace", "path": "/days/5/focus", "value": "Piernas"}],
+        [{"op": "remove", "path": "/days/0/exercises/0/name"}],
+        [{"op": "replace", "path": "/days/0/exercises/0/sets", "value": "muchas"}],
+        [{"op": "add", "path": "/days/0/exercises/-"}],
+        [{"op": "replace", "path": "days/0/focus", "value": "Piernas"}],
+        "no es una lista"
+    ])
+    def test_invalid_patches(self, sample_routine, operations):
+        """Las operaciones no válidas o que rompen el esquema se rechazan"""
+        with pytest.raises(PatchError):
+            apply_routine_patch(sample_routine, operations)
+    
+    @pytest.mark.asyncio
+    async def test_generator_patch_mode(self, sample_routine):
+        """En modo patch el modelo devuelve operaciones y la rutina se modifica localmente"""
+        response = {
+            "operations": [{"op": "replace", "path": "/days/0/exercises/0/sets", "value": 5}],
+            "explanation": "He subido el press de banca a 5 series."
+        }
+        mock_model = MagicMock()
+        mock_model.generate_content.return_value = MagicMock(text=json.dumps(response))
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator(modify_mode="patch")
+            routine, explanation = await generator.modify_and_explain(sample_routine, "Más volumen en el press")
+        
+        assert mock_model.generate_content.call_count == 1
+        assert routine.days[0].exercises[0].sets == 5
+        assert explanation == "He subido el press de banca a 5 series."
+    
+    @pytest.mark.asyncio
+    async def test_generator_falls_back_to_full_mode(self, sample_routine):
+        """Si el parche no es válido se pide la rutina completa"""
+        invalid_patch = {"operations": [{"op": "remove", "path": "/days/9"}], "explanation": "..."}
+        full_response = {"routine": sample_routine.model_dump(mode="json"), "explanation": "Rutina completa"}
+        mock_model = MagicMock()
+        mock_model.generate_content.side_effect = [
+            MagicMock(text=json.dumps(invalid_patch)),
+            MagicMock(text=json.dumps(full_response))
+        ]
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model):
+            generator = GeminiRoutineGenerator(modify_mode="patch")
+            routine, explanation = await generator.modify_and_explain(sample_routine, "Quita el día 10")
+        
+        assert mock_model.generate_content.call_count == 2
+        assert explanation == "Rutina completa"
+        assert routine.days == sample_routine.days
@@ -0,0 +1,94 @@
+import pytest
+import asyncio
+from unittest.mock import patch
+from app.models.models import RoutineRequest
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend
+from app.services.routine_pool import RoutinePool, combination_for
+
+def generator(fake=None):
+    return GeminiRoutineGenerator(backend=fake or FakeBackend(latency=0, tokens_per_second=0),
+                                  offline_fallback=False)
+
+class TestRoutinePool:
+    """Pruebas para la reserva de rutinas pregeneradas"""
+
+    def test_requests_are_grouped_in_combinations(self):
+        """Solo los objetivos canónicos comparten combinación; el resto va al modelo"""
+        first = combination_for(RoutineRequest(goals="Ganar masa muscular.", days=4,
+                                               equipment="Gimnasio completo"))
+        second = combination_for(RoutineRequest(goals="hipertrofia", days=4, equipment="gym",
+                                                experience_level="Intermedio"))
+
+        assert first == second
+        assert first.key == "hipertrofia|4|2|gimnasio"
+        assert combination_for(first.template()) == first
+        for goals in ("Ganar fuerza y perder grasa", "Preparar una media maratón",
+                      "Quiero ganar masa muscular pero tengo una lesión de rodilla"):
+            assert combination_for(RoutineRequest(goals=goals, days=3)) is None
+        assert combination_for(RoutineRequest(goals="Fuerza", days=3, experience_level="70 años")) is None
+        assert combination_for(RoutineRequest(goals="Fuerza", days=3, equipment="Gimnasio pero sin barra")) is None
+
+    @pytest.mark.asyncio
+    async def test_refill_by_demand_and_serve(self, isolated_routine_pool):
+        """Se rellenan las combinaciones más pedidas y se sirven adaptadas al usuario"""
+        pool = RoutinePool(path=isolated_routine_pool.path, size=2, top=1)
+        popular = RoutineRequest(goals="Ganar fuerza", days=3, equipment="mancuernas", user_id=7)
+        for _ in range(3):
+            assert await pool.take(popular) is None
+        await pool.take(RoutineRequest(goals="Hipertrofia", days=2))
+
+        plan = await pool.refill_plan()
+        assert [(combination.key, missing) for combination, missing in plan] == [("fuerza|3|2|mancuernas", 2)]
+        assert await pool.refill(generator(), plan) == 2
+        assert await pool.refill_plan() == []
+
+        routine = await pool.take(popular)
+        assert routine.user_id == 7 and len(routine.days) == 3
+
+        stats = pool.stats()
+        assert (stats["entries"], stats["hits"], stats["misses"], stats["refills"]) == (1, 1, 4, 2)
+        assert stats["top"][0]["requests"] == 4
+
+    @pytest.mark.asyncio
+    async def test_refill_stops_when_model_is_unavailable(self, isolated_resilience, isolated_routine_pool):
+        """Con el circuito abierto el relleno se detiene sin generar nada"""
+        await isolated_routine_pool.take(RoutineRequest(goals="Ganar fuerza", days=3))
+        for _ in range(isolated_resilience.breaker.threshold):
+            isolated_resilience.breaker.record_failure()
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+
+        assert await isolated_routine_pool.refill(generator(fake)) == 0
+        assert fake.calls == 0
+
+    @pytest.mark.asyncio
+    async def test_off_peak_hours_and_lease(self, tmp_path):
+        """La franja valle admite cruzar la medianoche y solo un worker rellena a la vez"""
+        pool = RoutinePool(path=str(tmp_path / "pool.db"), off_peak_hours="23-6")
+        assert pool.is_off_peak(23) and pool.is_off_peak(2)
+        assert not pool.is_off_peak(12)
+
+        other_worker = RoutinePool(path=pool.path)
+        assert await pool.claim_refill(60)
+        assert not await other_worker.claim_refill(60)
+
+    def test_create_endpoint_serves_from_pool(self, test_client, isolated_routine_pool):
+        """/api/create_routine responde con la rutina de la reserva sin llamar al modelo"""
+        request = RoutineRequest(goals="Ganar masa muscular", days=2, equipment="Gimnasio completo")
+        asyncio.run(isolated_routine_pool.put(combination_for(request), generator().build_offline_routine(request)))
+
+        async def fail(*args, **kwargs):
+            raise AssertionError("No debería generar la rutina")
+
+        async def save(*args, **kwargs):
+            return 1
+
+        with patch("app.main.routine_generator.create_initial_routine", fail), \
+                patch("app.main.save_routine", save), patch("app.main.save_chat_message", save):
+            response = test_client.post("/api/create_routine", json={
+                "goals": "ganar masa muscular", "days": 2, "equipment": "Gimnasio completo", "user_id": 3
+            })
+
+        assert response.status_code == 200
+        assert response.json()["routine"]["user_id"] == 3
+        assert isolated_routine_pool.stats()["entries"] == 0
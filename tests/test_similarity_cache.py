@@ -0,0 +1,106 @@
+import time
+import random
+import pytest
+from app.models.models import RoutineRequest
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.services.llm_backend import FakeBackend
+from app.services.routine_service import RoutineGenerator
+from app.services.similarity_cache import (
+    SIGNATURE_SIZE, SimilarityCache, SimilarityIndex, critical_terms, goal_features, minhash
+)
+
+def routine_for(request):
+    return RoutineGenerator().build_offline_routine(request)
+
+class TestSimilarityCache:
+    """Pruebas para la caché de peticiones casi iguales"""
+
+    def test_goal_features(self):
+        """Los objetivos se reducen a raíces sin palabras vacías ni acentos"""
+        assert goal_features("Quiero ganar masa muscular") == {"gan", "muscul"}
+        assert goal_features("ganar MÚSCULO") == {"gan", "muscul"}
+        assert goal_features("quiero una rutina") == set()
+
+    @pytest.mark.asyncio
+    async def test_similar_requests_share_routine(self, tmp_path):
+        """Una petición parecida con los mismos días y equipamiento reutiliza la rutina"""
+        cache = SimilarityCache(path=str(tmp_path / "cache.db"))
+        stored = RoutineRequest(goals="Quiero ganar masa muscular", days=3, equipment="Gimnasio")
+        await cache.set(stored, routine_for(stored))
+
+        similar = await cache.get(RoutineRequest(goals="ganar masa muscular", days=3, equipment="gimnasio", user_id=9))
+        assert similar is not None and similar.user_id == 9
+
+        assert await cache.get(RoutineRequest(goals="ganar fuerza", days=3, equipment="Gimnasio")) is None
+        assert await cache.get(RoutineRequest(goals="ganar masa muscular", days=4, equipment="Gimnasio")) is None
+        assert await cache.get(RoutineRequest(goals="ganar masa muscular", days=3, equipment="En casa")) is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+    @pytest.mark.asyncio
+    async def test_same_goal_in_other_words(self, tmp_path):
+        """"ganar músculo" reutiliza la rutina de "ganar masa muscular", pero no la de perderla"""
+        cache = SimilarityCache(path=str(tmp_path / "cache.db"))
+        stored = RoutineRequest(goals="ganar masa muscular", days=3, equipment="Gimnasio")
+        await cache.set(stored, routine_for(stored))
+
+        assert await cache.get(RoutineRequest(goals="ganar músculo", days=3, equipment="Gimnasio")) is not None
+        assert await cache.get(RoutineRequest(goals="perder masa muscular", days=3, equipment="Gimnasio")) is None
+
+    @pytest.mark.asyncio
+    async def test_critical_terms_must_match(self, tmp_path):
+        """Negaciones, partes del cuerpo y lesiones nunca se sirven de otra petición"""
+        cache = SimilarityCache(path=str(tmp_path / "cache.db"))
+        legs = RoutineRequest(goals="ganar masa muscular en piernas", days=3)
+        await cache.set(legs, routine_for(legs))
+        await cache.set(RoutineRequest(goals="ganar masa muscular", days=3), routine_for(legs))
+
+        assert await cache.get(RoutineRequest(goals="Ganar masa muscular en las piernas", days=3)) is not None
+        for goals in ("ganar masa muscular en brazos", "no quiero ganar masa muscular",
+                      "ganar masa muscular con lesión de rodilla"):
+            assert await cache.get(RoutineRequest(goals=goals, days=3)) is None
+        assert critical_terms("Sin dolor de rodilla") == ["dolor", "rodill", "sin"]
+
+    @pytest.mark.asyncio
+    async def test_entries_are_shared_between_workers(self, tmp_path):
+        """Cada worker incorpora a su índice las entradas que guardan los demás"""
+        path = str(tmp_path / "cache.db")
+        worker_a = SimilarityCache(path=path, sync_interval=0)
+        worker_b = SimilarityCache(path=path, sync_interval=0)
+        request = RoutineRequest(goals="Perder grasa y tonificar", days=2)
+
+        assert await worker_b.get(request) is None
+        await worker_a.set(request, routine_for(request))
+        assert await worker_b.get(RoutineRequest(goals="quiero perder grasa y tonificar", days=2)) is not None
+
+    def test_index_is_small_and_fast(self):
+        """Búsquedas por debajo del milisegundo y tamaño acotado con muchas entradas"""
+        rnd = random.Random(1)
+        index = SimilarityIndex(max_entries=10000)
+        for row_id in range(1, 15001):
+            index.add(row_id, rnd.randrange(50), [rnd.randrange(1 << 16) for _ in range(SIGNATURE_SIZE)])
+        signature = minhash({"gan", "muscul"})
+        index.add(15001, 7, signature)
+
+        start = time.perf_counter()
+        for _ in range(500):
+            match = index.lookup(7, minhash({"gan", "muscul", "mas"}), 0.6)
+        assert (time.perf_counter() - start) / 500 < 0.001
+
+        assert match is not None and match[0] == 15001
+        assert index.entries == 10000
+        size = (len(index.signatures) * 2 + len(index.buckets) * 4 + len(index.row_ids) * 8
+                + index.table.capacity * 8)
+        assert size / index.entries < 400
+
+    @pytest.mark.asyncio
+    async def test_generator_skips_model(self, isolated_similarity_cache):
+        """El generador sirve la rutina de una petición parecida sin llamar al modelo"""
+        fake = FakeBackend(latency=0, tokens_per_second=0)
+        generator = GeminiRoutineGenerator(backend=fake)
+
+        first = await generator.create_initial_routine(RoutineRequest(goals="Ganar masa muscular", days=3))
+        events = [event async for event in generator.stream_initial_routine(
+            RoutineRequest(goals="quiero ganar masa muscular", days=3))]
+
+        assert fake.calls == 1
+        assert events[-1]["routine"].days == first.days
@@ -0,0 +1,101 @@
+import pytest
+import time
+import json
+import asyncio
+from unittest.mock import patch, MagicMock
+from app.services.single_flight import SingleFlight
+from app.services.gemini_service import GeminiRoutineGenerator
+from app.models.models import RoutineRequest
+
+class TestSingleFlight:
+    """Pruebas para la coalescencia de llamadas idénticas en curso"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_result(self):
+        """Las llamadas concurrentes con la misma clave se ejecutan una sola vez"""
+        flight = SingleFlight()
+        executions = 0
+        
+        async def slow_call():
+            nonlocal executions
+            executions += 1
+            await asyncio.sleep(0.05)
+            return "resultado"
+        
+        results = await asyncio.gather(*[flight.do("clave", slow_call) for _ in range(5)])
+        
+        assert results == ["resultado"] * 5
+        assert executions == 1
+        assert flight.stats() == {"calls": 5, "executed": 1, "saved": 4, "in_flight": 0}
+    
+    @pytest.mark.asyncio
+    async def test_different_keys_not_shared(self):
+        """Claves distintas no se agrupan"""
+        flight = SingleFlight()
+        
+        async def call(value):
+            await asyncio.sleep(0.01)
+            return value
+        
+        results = await asyncio.gather(flight.do("a", lambda: call(1)), flight.do("b", lambda: call(2)))
+        
+        assert results == [1, 2]
+        assert flight.stats()["saved"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_errors_reach_all_waiters(self):
+        """Un error de la llamada compartida llega a todos los solicitantes"""
+        flight = SingleFlight()
+        
+        async def failing_call():
+            await asyncio.sleep(0.01)
+            raise ValueError("cuota agotada")
+        
+        results = await asyncio.gather(
+            *[flight.do("clave", failing_call) for _ in range(3)], return_exceptions=True
+        )
+        
+        assert all(isinstance(result, ValueError) for result in results)
+    
+    @pytest.mark.asyncio
+    async def test_stream_late_joiner_gets_all_chunks(self):
+        """Quien se une tarde a un streaming recibe también los fragmentos anteriores"""
+        flight = SingleFlight()
+        executions = 0
+        
+        async def chunks():
+            nonlocal executions
+            executions += 1
+            for chunk in ["a", "b", "c"]:
+                await asyncio.sleep(0.02)
+                yield chunk
+        
+        async def consume(delay):
+            await asyncio.sleep(delay)
+            return [chunk async for chunk in flight.stream("clave", chunks)]
+        
+        first, late = await asyncio.gather(consume(0), consume(0.03))
+        
+        assert first == late == ["a", "b", "c"]
+        assert executions == 1
+    
+    @pytest.mark.asyncio
+    async def test_generator_coalesces_identical_requests(self):
+        """Solicitudes de rutina idénticas y simultáneas hacen una sola llamada a Gemini"""
+        mock_model = MagicMock()
+        
+        def slow_generate(prompt, **kwargs):
+            time.sleep(0.1)
+            return MagicMock(text=json.dumps({"routine_name": "Rutina", "days": []}))
+        
+        mock_model.generate_content.side_effect = slow_generate
+        request = RoutineRequest(goals="Ganar masa muscular", days=3, user_id=1)
+        
+        with patch("app.services.gemini_service.GEMINI_CONFIGURED", True), \
+             patch("app.services.gemini_service.backend", mock_model), \
+             patch("app.services.gemini_service.single_flight", SingleFlight()):
+            generator = GeminiRoutineGenerator()
+            routines = await asyncio.gather(*[generator.create_initial_routine(request) for _ in range(4)])
+        
+        assert mock_model.generate_content.call_count == 1
+        assert all(routine.routine_name == "Rutina" for routine in routines)